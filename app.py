@@ -1,14 +1,26 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
 
-from src.loaders import read_excel_any
-from src.export import to_excel_bytes, to_excel_multiple_sheets
-
-from src.reconcile_estado_cuenta import conciliar_estado_cuenta_con_movimientos
-from src.reconcile_ppd_complementos import conciliar_ppd_desde_complementos
-from src.reconcile_ingresos_abonos import conciliar_ingresos_con_abonos
-from src.reconcile_publico_general import conciliar_publico_en_general_subset
-from src.complementos import agrupar_complementos_por_folio
+from src.export import FORMATOS_SALIDA
+from src.candidatos import MOTORES
+from src.preprocessing import BACKENDS
+from src.schema import reporte_columnas
+from src.pipeline import (
+    leer_hojas,
+    leer_bancos,
+    hojas_acumulado,
+    conciliar,
+    conciliar_en_cascada,
+    exportar_resultados,
+)
+from src.estado_conciliacion import conciliar_incremental
+from src.particiones import conciliar_por_mes, DIAS_ARRASTRE
+from src.barrido import barrido_tolerancias, TOLERANCIAS_BARRIDO
+from src.progreso import reportar_progreso, iniciar_etapa, ConciliacionCancelada
 
 
 # =====================================
@@ -34,7 +46,51 @@ with col2:
     ingresos_file = st.file_uploader("2️⃣ Ingresos (multi-hoja)", type=["xlsx"])
 
 with col3:
-    banco_file = st.file_uploader("3️⃣ Estado de Cuenta (Banco)", type=["xlsx"])
+    banco_file = st.file_uploader(
+        "3️⃣ Estado de Cuenta (Banco)",
+        type=["xlsx", "xls", "csv", "txt", "ofx", "qfx", "xml"],
+        accept_multiple_files=True,
+        help="Puedes subir varios archivos; los movimientos repetidos se eliminan."
+    )
+
+# =====================================
+# LECTURA ANTICIPADA
+# =====================================
+@st.cache_resource
+def _lectores():
+    return ThreadPoolExecutor(max_workers=3, thread_name_prefix="lectura")
+
+
+def _clave_archivos(archivos) -> tuple:
+    archivos = archivos if isinstance(archivos, list) else [archivos]
+    return tuple((a.name, a.size, getattr(a, "file_id", "")) for a in archivos)
+
+
+def _lectura_anticipada(rol: str, archivos, lector):
+    """
+    Empieza a leer y normalizar el archivo en cuanto se sube (mientras el usuario
+    sube los demás). Regresa el Future guardado en la sesión, o None sin archivo.
+    """
+    llave = f"lectura_{rol}"
+    if not archivos:
+        st.session_state.pop(llave, None)
+        return None
+
+    clave = _clave_archivos(archivos)
+    guardada = st.session_state.get(llave)
+    if guardada is None or guardada[0] != clave:
+        guardada = (clave, _lectores().submit(lector, archivos))
+        st.session_state[llave] = guardada
+    return guardada[1]
+
+
+lectura_egresos = _lectura_anticipada("egresos", egresos_file, leer_hojas)
+lectura_ingresos = _lectura_anticipada("ingresos", ingresos_file, leer_hojas)
+lectura_banco = _lectura_anticipada("banco", banco_file, leer_bancos)
+
+for col, lectura in zip((col1, col2, col3), (lectura_egresos, lectura_ingresos, lectura_banco)):
+    if lectura is not None:
+        col.caption("Leído ✅" if lectura.done() else "Leyendo en segundo plano...")
 
 tolerancia = st.number_input(
     "Tolerancia de monto",
@@ -43,6 +99,84 @@ tolerancia = st.number_input(
     step=0.01
 )
 
+formato_salida = st.selectbox(
+    "Formato de descarga",
+    options=list(FORMATOS_SALIDA),
+    format_func=lambda f: {
+        "xlsx": "Excel (.xlsx)",
+        "parquet": "Parquet (tipado, montos en centavos)",
+        "csv": "CSV",
+    }.get(f, f),
+)
+
+with st.expander("Motor de búsqueda de candidatos"):
+    motor = st.selectbox(
+        "Motor",
+        options=list(MOTORES),
+        help="duckdb hace los cruces monto/fecha en paralelo (útil para corridas de un año o varias cuentas)."
+    )
+    backend = st.selectbox(
+        "Backend de limpieza",
+        options=list(BACKENDS),
+        help="polars limpia montos y fechas en paralelo; el resultado es el mismo."
+    )
+    cascada = st.checkbox(
+        "Conciliar en cascada",
+        value=False,
+        help="Primero por folio/UUID en la descripción y por monto y fecha exactos; las etapas solo ven el residuo. "
+             "No aplica con el modo incremental ni con el modo por mes."
+    )
+
+with st.expander("Conciliación incremental"):
+    usar_estado = st.checkbox(
+        "Reutilizar lo conciliado en corridas anteriores",
+        value=False,
+        help="Los movimientos y CFDI ya conciliados se bloquean; solo se procesa lo nuevo."
+    )
+    ruta_estado = st.text_input("Archivo de estado (SQLite)", value="conciliacion_estado.sqlite")
+
+with st.expander("Índice de CFDI (periodos anteriores)"):
+    usar_indice = st.checkbox(
+        "Usar el índice de CFDI",
+        value=False,
+        help="Notas de crédito y complementos que apuntan a facturas de meses anteriores se resuelven contra el índice. "
+             "Solo aplica a la conciliación normal."
+    )
+    ruta_indice = st.text_input("Archivo del índice (SQLite)", value="indice_cfdi.sqlite")
+
+with st.expander("Puntos de control"):
+    usar_puntos = st.checkbox(
+        "Guardar cada etapa y reanudar corridas interrumpidas",
+        value=False,
+        help="Si la corrida se cancela o falla, al volver a conciliar los mismos archivos con los mismos parámetros "
+             "se sigue desde la última etapa terminada. Solo aplica a la conciliación normal."
+    )
+    ruta_puntos = st.text_input("Directorio de puntos de control", value="puntos_control")
+
+with st.expander("Modo por mes (estados de cuenta anuales)"):
+    por_mes = st.checkbox(
+        "Conciliar mes por mes",
+        value=False,
+        help="Parte banco y ACUMULADO por mes en archivos Parquet temporales; la memoria depende del mes más grande."
+    )
+    dias_arrastre = st.number_input(
+        "Días de arrastre para pagos tardíos",
+        min_value=0,
+        value=DIAS_ARRASTRE,
+        step=5
+    )
+
+with st.expander("Barrido de tolerancias"):
+    usar_barrido = st.checkbox(
+        "Comparar varias tolerancias",
+        value=False,
+        help="Concilia con cada tolerancia (los candidatos se generan una sola vez) y muestra qué CFDI cambian de estado."
+    )
+    texto_barrido = st.text_input(
+        "Tolerancias (separadas por coma)",
+        value=", ".join(f"{t:.2f}" for t in TOLERANCIAS_BARRIDO)
+    )
+
 if tolerancia < 0.01:
     st.warning(
         "⚠️ Se recomienda una tolerancia mínima de 0.01 por precisión decimal "
@@ -50,195 +184,234 @@ if tolerancia < 0.01:
     )
 
 # =====================================
-# BOTÓN
+# CORRIDA EN SEGUNDO PLANO
 # =====================================
-if st.button("Conciliar"):
-    if not egresos_file or not ingresos_file or not banco_file:
-        st.error("Debes subir los tres archivos.")
-        st.stop()
+def _conciliar(lectura_ingresos, lectura_egresos, lectura_banco, tolerancia, motor, backend,
+               usar_estado, ruta_estado, por_mes, dias_arrastre, cascada, tolerancias_barrido, indice,
+               puntos_control):
+    """Lectura y cadena de etapas. Corre en el hilo de trabajo: aquí no se usa st.*"""
+    # Normalmente ya terminaron: se leyeron mientras se subían los demás archivos
+    iniciar_etapa("Leyendo archivos", 1, 1)
+    ingresos_sheets = lectura_ingresos.result()
+    egresos_sheets = lectura_egresos.result()
+    hojas_acumulado(ingresos_sheets, egresos_sheets)
+    banco, duplicados_banco = lectura_banco.result()
+
+    entradas = dict(
+        ingresos_sheets=ingresos_sheets,
+        egresos_sheets=egresos_sheets,
+        banco=banco,
+        tolerancia=tolerancia,
+        motor=motor,
+        backend=backend
+    )
+    resultado = {"banco": banco, "duplicados": duplicados_banco, "resumen": None, "barrido": None}
+
+    if usar_estado:
+        banco_out, ingresos_out, egresos_out, resumen = conciliar_incremental(**entradas, ruta_estado=ruta_estado)
+        resultado["resumen"] = resumen
+    elif por_mes:
+        banco_out, ingresos_out, egresos_out = conciliar_por_mes(**entradas, dias_arrastre=dias_arrastre)
+    elif cascada:
+        banco_out, ingresos_out, egresos_out, resumen = conciliar_en_cascada(**entradas)
+        resultado["resumen"] = {f"Nivel {k}": v for k, v in resumen.items()}
+    else:
+        banco_out, ingresos_out, egresos_out = conciliar(**entradas, indice=indice, puntos_control=puntos_control)
 
-    # =====================================
-    # INGRESOS (TODAS LAS HOJAS)
-    # =====================================
-    xls_ing = pd.ExcelFile(ingresos_file)
-    ingresos_sheets = {}
+    if tolerancias_barrido:
+        entradas.pop("tolerancia")
+        resultado["barrido"] = barrido_tolerancias(**entradas, tolerancias=tolerancias_barrido)
 
-    for sheet in xls_ing.sheet_names:
-        df = xls_ing.parse(sheet)
-        df.columns = df.columns.astype(str).str.upper().str.strip()
-        df = df.loc[:, ~df.columns.str.contains("^UNNAMED", case=False)]
-        ingresos_sheets[sheet] = df
+    resultado.update(banco_out=banco_out, ingresos_sheets=ingresos_out, egresos_sheets=egresos_out)
+    return resultado
 
-    if "ACUMULADO" not in ingresos_sheets:
-        st.error("El archivo de INGRESOS debe tener una hoja llamada 'ACUMULADO'")
-        st.stop()
 
-    ingresos_acumulado = ingresos_sheets["ACUMULADO"]
-    ingresos_complementos = ingresos_sheets.get("COMPLEMENTOS")
+def _ejecutar_trabajo(trabajo: dict, parametros: dict):
+    def avisar(etapa, fraccion):
+        trabajo["progreso"] = (etapa, fraccion)
 
-    # =====================================
-    # EGRESOS (TODAS LAS HOJAS)
-    # =====================================
-    xls_egr = pd.ExcelFile(egresos_file)
-    egresos_sheets = {}
+    try:
+        with reportar_progreso(avisar, trabajo["cancelar"]):
+            trabajo["resultado"] = _conciliar(**parametros)
+    except ConciliacionCancelada:
+        trabajo["cancelado"] = True
+    except Exception as e:
+        trabajo["error"] = e
 
-    for sheet in xls_egr.sheet_names:
-        df = xls_egr.parse(sheet)
-        df.columns = df.columns.astype(str).str.upper().str.strip()
-        df = df.loc[:, ~df.columns.str.contains("^UNNAMED", case=False)]
-        egresos_sheets[sheet] = df
 
-    egresos_complementos = egresos_sheets.get("COMPLEMENTOS")
+# =====================================
+# BOTÓN
+# =====================================
+trabajo = st.session_state.get("trabajo")
+en_curso = trabajo is not None and trabajo["hilo"].is_alive()
 
-    if "ACUMULADO" in egresos_sheets:
-        egresos_acumulado = egresos_sheets["ACUMULADO"]
-    elif "EGRESOS" in egresos_sheets:
-        egresos_acumulado = egresos_sheets["EGRESOS"]
-    else:
-        st.error("El archivo de EGRESOS debe tener una hoja llamada 'ACUMULADO'")
+if st.button("Conciliar", disabled=en_curso):
+    if not egresos_file or not ingresos_file or not banco_file:
+        st.error("Debes subir los tres archivos.")
         st.stop()
 
-
-    # =====================================
-    # BANCO
-    # =====================================
-    banco = read_excel_any(banco_file)
-    banco = banco.loc[:, ~banco.columns.str.contains("^UNNAMED", case=False)]
-    banco.columns = banco.columns.astype(str).str.upper().str.strip()
-
-    # =====================================
-    # CONCILIACIONES
-    # =====================================
-    with st.spinner("Conciliando información..."):
-
-        # 1) Estado de cuenta ↔ Ingresos + Egresos
-        banco_out, ingresos_out, egresos_out = conciliar_estado_cuenta_con_movimientos(
-            banco=banco,
-            ingresos=ingresos_acumulado,
-            egresos=egresos_acumulado,
-            tolerancia=tolerancia
+    # Mismas combinaciones que rechaza la línea de comandos (no se ignora nada en silencio)
+    if usar_estado and por_mes:
+        st.error("La conciliación incremental y el modo por mes no se pueden combinar.")
+        st.stop()
+    if cascada and (usar_estado or por_mes):
+        st.error("La conciliación en cascada no se puede combinar con la incremental ni con el modo por mes.")
+        st.stop()
+    if (usar_indice or usar_puntos) and (usar_estado or por_mes or cascada):
+        st.error(
+            "El índice de CFDI y los puntos de control solo aplican a la conciliación normal: "
+            "desactívalos o quita el modo incremental, por mes o en cascada."
         )
+        st.stop()
 
-        # 2) PPD desde COMPLEMENTOS
-        if ingresos_complementos is not None and not ingresos_complementos.empty:
-            complementos_agrupados = agrupar_complementos_por_folio(
-                ingresos_complementos
-            )
-
-            banco_out, ingresos_out = conciliar_ppd_desde_complementos(
-                ingresos_acumulado=ingresos_out,
-                complementos=complementos_agrupados,
-                banco=banco_out,
-                tolerancia=tolerancia,
-                tipo_movimiento="ABONO"
-            )
-        
-        # ✅ 2B) PPD desde COMPLEMENTOS (EGRESOS)
-        if egresos_complementos is not None and not egresos_complementos.empty:
-            complementos_agrupados_egr = agrupar_complementos_por_folio(egresos_complementos)
-
-            banco_out, egresos_out = conciliar_ppd_desde_complementos(
-                ingresos_acumulado=egresos_out,          # (sí, aquí va egresos_out)
-                complementos=complementos_agrupados_egr,
-                banco=banco_out,
-                tolerancia=tolerancia,
-                tipo_movimiento="CARGO",                 # 🔥 CLAVE
-            )
-
-        # 3) Ingresos directos vs ABONOS
-        ingresos_out = conciliar_ingresos_con_abonos(
-            ingresos=ingresos_out,
-            banco=banco_out,
-            tolerancia=tolerancia
-        )
+    tolerancias_barrido = None
+    if usar_barrido:
+        try:
+            tolerancias_barrido = [float(t) for t in texto_barrido.replace(";", ",").split(",") if t.strip()]
+        except ValueError:
+            st.error("Las tolerancias del barrido deben ser números separados por coma.")
+            st.stop()
+
+    trabajo = {
+        "cancelar": threading.Event(),
+        "progreso": ("Leyendo archivos", 0.0),
+        "resultado": None,
+        "error": None,
+        "cancelado": False,
+    }
+    trabajo["hilo"] = threading.Thread(
+        target=_ejecutar_trabajo,
+        args=(trabajo, dict(
+            lectura_ingresos=lectura_ingresos,
+            lectura_egresos=lectura_egresos,
+            lectura_banco=lectura_banco,
+            tolerancia=tolerancia,
+            motor=motor,
+            backend=backend,
+            usar_estado=usar_estado,
+            ruta_estado=ruta_estado,
+            por_mes=por_mes,
+            dias_arrastre=int(dias_arrastre),
+            cascada=cascada,
+            tolerancias_barrido=tolerancias_barrido,
+            indice=ruta_indice if usar_indice else None,
+            puntos_control=ruta_puntos if usar_puntos else None,
+        )),
+        daemon=True,
+    )
+    st.session_state["trabajo"] = trabajo
+    trabajo["hilo"].start()
+    en_curso = True
 
-        # 4) Público en General → SUMA de ABONOS
-        ingresos_out, banco_out = conciliar_publico_en_general_subset(
-            ingresos=ingresos_out,
-            banco=banco_out,
-            tolerancia=tolerancia
-        )
+if trabajo is None:
+    st.stop()
 
-    # =====================================
-    # REEMPLAZAR HOJAS
-    # =====================================
-    ingresos_sheets["ACUMULADO"] = ingresos_out
-    egresos_sheets["ACUMULADO"] = egresos_out
+# =====================================
+# PROGRESO / CANCELAR
+# =====================================
+if en_curso:
+    # Un clic en Cancelar vuelve a ejecutar el script: se marca el evento y se espera al hilo
+    if st.button("Cancelar"):
+        trabajo["cancelar"].set()
+
+    barra = st.progress(0.0, text="Conciliando información...")
+    while trabajo["hilo"].is_alive():
+        etapa, fraccion = trabajo["progreso"]
+        barra.progress(fraccion, text=f"{etapa}...")
+        time.sleep(0.2)
+    st.rerun()
+
+if trabajo["cancelado"]:
+    st.warning("Conciliación cancelada.")
+    st.stop()
+
+if trabajo["error"] is not None:
+    if isinstance(trabajo["error"], ValueError):
+        st.error(str(trabajo["error"]))
+        st.stop()
+    raise trabajo["error"]
 
-    # =====================================
-    # VISTAS PREVIAS
-    # =====================================
-    st.success("Conciliación terminada ✅")
+resultado = trabajo["resultado"]
+banco = resultado["banco"]
+banco_out = resultado["banco_out"]
+ingresos_sheets = resultado["ingresos_sheets"]
+egresos_sheets = resultado["egresos_sheets"]
 
-    st.divider()
-    st.subheader("Vista previa - Estado de Cuenta conciliado")
+if not resultado["duplicados"].empty:
+    with st.expander(f"Movimientos duplicados descartados ({len(resultado['duplicados'])})"):
+        st.dataframe(resultado["duplicados"], use_container_width=True)
 
-    banco_out_display = banco_out.copy()
+if resultado["resumen"]:
+    st.info(" · ".join(f"{k}: {v}" for k, v in resultado["resumen"].items()))
 
-    if "FECHA" in banco_out_display.columns:
-        banco_out_display["FECHA"] = (
-            pd.to_datetime(banco_out_display["FECHA"], errors="coerce")
-            .dt.strftime("%d/%m/%Y")
-        )
+if resultado["barrido"] is not None:
+    tabla_barrido, cambios_barrido = resultado["barrido"]
+    with st.expander("Barrido de tolerancias", expanded=True):
+        st.dataframe(tabla_barrido, use_container_width=True)
+        st.caption(f"CFDI que cambian de estado entre tolerancias: {len(cambios_barrido)}")
+        st.dataframe(cambios_barrido, use_container_width=True)
 
-    st.dataframe(banco_out_display.head(100), use_container_width=True)
+ingresos_out = ingresos_sheets["ACUMULADO"]
+egresos_out = egresos_sheets["ACUMULADO"]
 
-    st.subheader("Vista previa - Ingresos (ACUMULADO)")
-    st.dataframe(ingresos_out.head(100), use_container_width=True)
+with st.expander("Columnas detectadas"):
+    c1, c2, c3 = st.columns(3)
+    c1.dataframe(reporte_columnas(banco, "banco.").dropna(), use_container_width=True)
+    c2.dataframe(reporte_columnas(ingresos_sheets["ACUMULADO"], "doc.").dropna(), use_container_width=True)
+    c3.dataframe(reporte_columnas(egresos_sheets["ACUMULADO"], "doc.").dropna(), use_container_width=True)
 
-    """ if ingresos_complementos is not None:
-        st.subheader("Vista previa - Ingresos (COMPLEMENTOS)")
-        st.dataframe(ingresos_complementos.head(100), use_container_width=True) """
+# =====================================
+# VISTAS PREVIAS
+# =====================================
+st.success("Conciliación terminada ✅")
 
-    st.subheader("Vista previa - Egresos (ACUMULADO)")
-    st.dataframe(egresos_out.head(100), use_container_width=True)
+st.divider()
+st.subheader("Vista previa - Estado de Cuenta conciliado")
 
-    """ if egresos_complementos is not None:
-        st.subheader("Vista previa - Egresos (COMPLEMENTOS)")
-        st.dataframe(egresos_complementos.head(100), use_container_width=True) """
+banco_out_display = banco_out.copy()
 
-    # =====================================
-    # DESCARGAS
-    # =====================================
-    st.divider()
-    st.subheader("Descargar archivos")
+if "FECHA" in banco_out_display.columns:
+    banco_out_display["FECHA"] = (
+        pd.to_datetime(banco_out_display["FECHA"], errors="coerce")
+        .dt.strftime("%d/%m/%Y")
+    )
 
-    banco_export = banco_out.copy()
+st.dataframe(banco_out_display.head(100), use_container_width=True)
 
-    for col in banco_export.columns:
-        if "FECHA" in col.upper():
-            banco_export[col] = banco_export[col].astype(str)
+st.subheader("Vista previa - Ingresos (ACUMULADO)")
+st.dataframe(ingresos_out.head(100), use_container_width=True)
 
-    banco_excel = to_excel_bytes(
-        banco_export,
-        sheet_name="ESTADO_CUENTA_CONCILIADO"
-    )
+""" if ingresos_complementos is not None:
+    st.subheader("Vista previa - Ingresos (COMPLEMENTOS)")
+    st.dataframe(ingresos_complementos.head(100), use_container_width=True) """
 
-    ingresos_excel = to_excel_multiple_sheets(ingresos_sheets)
-    egresos_excel = to_excel_multiple_sheets(egresos_sheets)
+st.subheader("Vista previa - Egresos (ACUMULADO)")
+st.dataframe(egresos_out.head(100), use_container_width=True)
 
-    c1, c2, c3 = st.columns(3)
+""" if egresos_complementos is not None:
+    st.subheader("Vista previa - Egresos (COMPLEMENTOS)")
+    st.dataframe(egresos_complementos.head(100), use_container_width=True) """
 
-    with c1:
-        st.download_button(
-            "⬇️ Estado de Cuenta",
-            data=banco_excel,
-            file_name="ESTADO_CUENTA_CONCILIADO.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+# =====================================
+# DESCARGAS
+# =====================================
+st.divider()
+st.subheader("Descargar archivos")
+
+salidas = exportar_resultados(
+    banco_out,
+    ingresos_sheets,
+    egresos_sheets,
+    formato=formato_salida
+)
 
-    with c2:
-        st.download_button(
-            "⬇️ Ingresos (todas las hojas)",
-            data=ingresos_excel,
-            file_name="INGRESOS_ACTUALIZADOS.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+etiquetas = ["⬇️ Estado de Cuenta", "⬇️ Ingresos (todas las hojas)", "⬇️ Egresos (todas las hojas)"]
 
-    with c3:
+for col, etiqueta, (file_name, (data, mime)) in zip(st.columns(3), etiquetas, salidas.items()):
+    with col:
         st.download_button(
-            "⬇️ Egresos (todas las hojas)",
-            data=egresos_excel,
-            file_name="EGRESOS_ACTUALIZADOS.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            etiqueta,
+            data=data,
+            file_name=file_name,
+            mime=mime
         )
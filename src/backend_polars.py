@@ -0,0 +1,118 @@
+"""
+Backend Polars (opcional) para la limpieza de montos/fechas y los cruces de candidatos.
+
+Se activa con config.BACKEND = "polars" o con preprocessing.usar_backend("polars").
+Las etapas siguen recibiendo y regresando pandas: la conversión ocurre aquí, en la
+frontera, y cuando Polars no puede garantizar el mismo resultado que pandas
+(fechas ambiguas, tipos mezclados) se regresa None para que se use el camino pandas.
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    import polars as pl
+except ImportError:  # pragma: no cover - dependencia opcional
+    pl = None
+
+
+#* Formatos ISO que pandas y Polars interpretan igual (sin ambigüedad día/mes)
+FORMATOS_FECHA_ISO = (
+    ("%Y-%m-%d %H:%M:%S", r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$"),
+    ("%Y-%m-%d", r"^\d{4}-\d{2}-\d{2}$"),
+)
+
+_VACIOS = ("nan", "None", "NaT", "")
+
+
+def _requiere_polars():
+    if pl is None:
+        raise ValueError("El backend 'polars' requiere instalar el paquete polars")
+
+
+def _texto(series: pd.Series) -> "pl.Series":
+    # Mismo texto que series.astype(str) en pandas (NaN -> "nan", None -> "None")
+    return pl.Series(series.astype(str).to_numpy(dtype=object), dtype=pl.Utf8)
+
+
+def to_money(series: pd.Series) -> pd.Series:
+    _requiere_polars()
+
+    # Numéricos: el ida y vuelta por texto de pandas no cambia el valor ni el tipo
+    if (
+        isinstance(series.dtype, np.dtype)
+        and pd.api.types.is_numeric_dtype(series)
+        and not pd.api.types.is_bool_dtype(series)
+    ):
+        return series.copy()
+
+    texto = (
+        _texto(series)
+        .str.replace_all(",", "", literal=True)
+        .str.replace_all("$", "", literal=True)
+        .str.strip_chars()
+    )
+
+    # pd.to_numeric regresa int64 solo si todo es entero y nada falla
+    if texto.str.contains(r"^[+-]?\d+$").all():
+        valores = texto.cast(pl.Int64, strict=False)
+        if valores.null_count() == 0:
+            return pd.Series(valores.to_numpy(), index=series.index, name=series.name)
+
+    valores = texto.cast(pl.Float64, strict=False).fill_null(np.nan)
+    return pd.Series(valores.to_numpy(), index=series.index, name=series.name)
+
+
+def to_date(series: pd.Series):
+    """
+    Fechas con Polars cuando todos los valores comparten un formato ISO.
+    Regresa None si hay que usar el parseo de pandas (formatos ambiguos o mezclados).
+    """
+    _requiere_polars()
+
+    if pd.api.types.is_datetime64_any_dtype(series) and getattr(series.dt, "tz", None) is None:
+        return series.astype("datetime64[ns]")
+
+    texto = _texto(series).str.strip_chars()
+    vacio = texto.is_in(list(_VACIOS))
+    valores = texto.filter(~vacio)
+
+    if len(valores) == 0:
+        return pd.Series(pd.NaT, index=series.index, name=series.name, dtype="datetime64[ns]")
+
+    for formato, patron in FORMATOS_FECHA_ISO:
+        if not valores.str.contains(patron).all():
+            continue
+        fechas = texto.str.strptime(pl.Datetime("ns"), formato, strict=False)
+        if fechas.null_count() == vacio.sum():
+            return pd.Series(
+                fechas.to_numpy(),
+                index=series.index,
+                name=series.name,
+            ).astype("datetime64[ns]")
+
+    return None
+
+
+def pares_polars(izq_cent, der_cent, banda, izq_dia=None, der_dia=None, dias=None):
+    """Band join en centavos (y rango de días) con LazyFrame.join_where (multi-hilo)."""
+    _requiere_polars()
+
+    izq = pl.LazyFrame({
+        "pi": np.arange(len(izq_cent)),
+        "lo": izq_cent - banda,
+        "hi": izq_cent + banda,
+    })
+    der = pl.LazyFrame({"pd": np.arange(len(der_cent)), "c": der_cent})
+    condiciones = [pl.col("c") >= pl.col("lo"), pl.col("c") <= pl.col("hi")]
+
+    if dias is not None:
+        # NaN -> null para que las filas sin fecha no crucen
+        izq = izq.with_columns(
+            d_lo=pl.Series(izq_dia - dias, nan_to_null=True),
+            d_hi=pl.Series(izq_dia + dias, nan_to_null=True),
+        )
+        der = der.with_columns(d=pl.Series(der_dia, nan_to_null=True))
+        condiciones += [pl.col("d") >= pl.col("d_lo"), pl.col("d") <= pl.col("d_hi")]
+
+    pares = izq.join_where(der, *condiciones).select("pi", "pd").collect()
+    return pares["pi"].to_numpy().astype(np.int64), pares["pd"].to_numpy().astype(np.int64)
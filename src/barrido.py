@@ -0,0 +1,110 @@
+"""
+Barrido de tolerancias: compara tasas de conciliación sin N corridas completas de cruces.
+
+Las tolerancias se recorren de mayor a menor dentro de candidatos.reutilizar_candidatos:
+el band join de cada etapa se hace una sola vez (con la mayor) y las demás solo filtran
+esos pares. Las reglas de cada etapa (usados, PPD/PUE, score) sí se evalúan por tolerancia.
+"""
+import pandas as pd
+
+from .candidatos import reutilizar_candidatos
+from .pipeline import conciliar, hojas_acumulado
+from .preprocessing import to_money
+from .schema import resolver_columnas
+
+#* Tolerancias que los analistas suelen comparar
+TOLERANCIAS_BARRIDO = (0.01, 0.50, 1.00, 5.00)
+
+_PENDIENTES_BANCO = {"", "N/A", "NAN"}
+
+
+def _resumen_libro(df: pd.DataFrame, prefijo: str) -> dict:
+    cols = resolver_columnas(df)
+    estado = df[cols["doc.estado_pago"]].fillna("").astype(str).str.upper().str.strip()
+    pagado = estado.isin(["PAGADO", "PAGADO OTRO"])
+    monto = to_money(df[cols["doc.monto"]]).abs() if cols["doc.monto"] else pd.Series(0.0, index=df.index)
+    return {
+        f"{prefijo} PAGADOS": int(pagado.sum()),
+        f"{prefijo} PARCIAL": int((estado == "PARCIAL").sum()),
+        f"{prefijo} SIN CONCILIAR": int((~pagado & (estado != "PARCIAL") & (estado != "CANCELADO")).sum()),
+        f"{prefijo} MONTO SIN CONCILIAR": round(float(monto[~pagado & (estado != "CANCELADO")].sum()), 2),
+    }
+
+
+def _resumen_banco(banco: pd.DataFrame) -> dict:
+    cols = resolver_columnas(banco)
+    obs = banco["OBSERVACIONES"].fillna("").astype(str).str.upper().str.strip() if "OBSERVACIONES" in banco else pd.Series("", index=banco.index)
+    pendiente = obs.isin(_PENDIENTES_BANCO)
+    montos = sum(
+        to_money(banco[c]).abs().fillna(0)
+        for c in (cols["banco.abono"], cols["banco.cargo"])
+        if c
+    )
+    return {
+        "MOVIMIENTOS CONCILIADOS": int((~pendiente).sum()),
+        "MOVIMIENTOS SIN CONCILIAR": int(pendiente.sum()),
+        "MONTO BANCO SIN CONCILIAR": round(float(montos[pendiente].sum()), 2) if len(banco) else 0.0,
+    }
+
+
+def barrido_tolerancias(
+    ingresos_sheets: dict,
+    egresos_sheets: dict,
+    banco: pd.DataFrame,
+    tolerancias=TOLERANCIAS_BARRIDO,
+    motor: str = None,
+    backend: str = None,
+):
+    """
+    Concilia con cada tolerancia reutilizando los candidatos de la mayor.
+    Regresa (tabla, cambios):
+        tabla   -> una fila por tolerancia con conteos y montos sin conciliar
+        cambios -> CFDI cuyo ESTADO DE PAGO cambia entre tolerancias (una columna por tolerancia)
+    """
+    tolerancias = sorted({float(t) for t in tolerancias}, reverse=True)
+    if not tolerancias:
+        raise ValueError("Indica al menos una tolerancia")
+
+    filas, estados = [], {}
+    with reutilizar_candidatos():
+        for tol in tolerancias:
+            banco_out, ing_sheets, egr_sheets = conciliar(
+                ingresos_sheets=ingresos_sheets,
+                egresos_sheets=egresos_sheets,
+                banco=banco,
+                tolerancia=tol,
+                motor=motor,
+                backend=backend,
+            )
+            ingresos_out, egresos_out = hojas_acumulado(ing_sheets, egr_sheets)
+
+            filas.append({
+                "TOLERANCIA": tol,
+                **_resumen_banco(banco_out),
+                **_resumen_libro(ingresos_out, "INGRESOS"),
+                **_resumen_libro(egresos_out, "EGRESOS"),
+            })
+            for libro, df in (("INGRESOS", ingresos_out), ("EGRESOS", egresos_out)):
+                col = resolver_columnas(df)["doc.estado_pago"]
+                estados.setdefault(libro, {})[tol] = df[col].fillna("").astype(str)
+
+    tabla = pd.DataFrame(filas).sort_values("TOLERANCIA").reset_index(drop=True)
+
+    # ---- CFDI que cambian de estado entre tolerancias ----
+    partes = []
+    for libro, original in zip(("INGRESOS", "EGRESOS"), hojas_acumulado(ingresos_sheets, egresos_sheets)):
+        por_tol = pd.DataFrame(estados[libro])[sorted(estados[libro])]
+        por_tol.columns = [f"ESTADO {t:.2f}" for t in por_tol.columns]
+        cambia = por_tol.nunique(axis=1) > 1
+        if not cambia.any():
+            continue
+
+        cols = resolver_columnas(original)
+        datos = pd.DataFrame({"LIBRO": libro}, index=por_tol.index[cambia])
+        for rol, nombre in (("doc.folio", "FOLIO"), ("doc.fecha_emision", "FECHA EMISION"), ("doc.monto", "TOTAL")):
+            if cols[rol]:
+                datos[nombre] = original[cols[rol]].reindex(datos.index)
+        partes.append(pd.concat([datos, por_tol[cambia]], axis=1))
+
+    cambios = pd.concat(partes) if partes else pd.DataFrame(columns=["LIBRO"])
+    return tabla, cambios
@@ -0,0 +1,204 @@
+"""
+Generación de candidatos monto/fecha para las etapas de conciliación.
+
+En lugar de filtrar todo el frame por cada fila, los pares (izquierda, derecha)
+que caen dentro de la tolerancia se generan de una sola vez como un "band join"
+sobre centavos enteros (y opcionalmente un rango de fechas). Las reglas de cada
+etapa (usados, PPD/PUE, score) siguen en Python y solo eligen entre esos pares.
+
+Motores:
+    "pandas" -> numpy searchsorted sobre los centavos ordenados (sin dependencias)
+    "duckdb" -> DuckDB en proceso (sin servidor), multi-hilo para corridas grandes
+    "polars" -> LazyFrame.join_where (multi-hilo; por defecto con el backend polars)
+"""
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+import pandas as pd
+
+from .config import MOTOR_CANDIDATOS
+from .preprocessing import backend_activo
+
+MOTORES = ("pandas", "duckdb", "polars")
+
+#* Pares del band join por llamada (solo durante un barrido de tolerancias)
+_cache_barrido = ContextVar("cache_barrido", default=None)
+
+
+@contextmanager
+def reutilizar_candidatos():
+    """
+    Durante el bloque, cada band join se guarda con su tolerancia. Si después se pide
+    el mismo cruce (mismos montos, índices y fechas) con una tolerancia menor o igual,
+    se filtran los pares guardados en lugar de volver a cruzar.
+    Conviene recorrer las tolerancias de mayor a menor.
+    """
+    token = _cache_barrido.set({})
+    try:
+        yield
+    finally:
+        _cache_barrido.reset(token)
+
+
+def _huella_cruce(*partes) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for parte in partes:
+        if isinstance(parte, pd.Series):
+            h.update(pd.util.hash_pandas_object(parte, index=True).to_numpy().tobytes())
+        else:
+            h.update(repr(parte).encode())
+    return h.hexdigest()
+
+
+def _banda(izq_cent, tolerancia, rtol):
+    # +1 centavo de holgura: el filtro exacto en flotantes se aplica después
+    return np.ceil(tolerancia * 100 + rtol * np.abs(izq_cent)) + 1
+
+
+def _dias(fechas) -> np.ndarray:
+    """Fecha -> número de día (float, NaN si no hay fecha)."""
+    f = pd.to_datetime(pd.Series(fechas), errors="coerce")
+    return (f - pd.Timestamp("1970-01-01")).dt.days.to_numpy(float)
+
+
+def _pares_pandas(izq_cent, der_cent, banda, *_):
+    orden = np.argsort(der_cent, kind="stable")
+    der_ord = der_cent[orden]
+
+    lo = np.searchsorted(der_ord, izq_cent - banda, side="left")
+    hi = np.searchsorted(der_ord, izq_cent + banda, side="right")
+    cuantos = hi - lo
+
+    pos_izq = np.repeat(np.arange(len(izq_cent)), cuantos)
+    inicio = np.repeat(lo - (np.cumsum(cuantos) - cuantos), cuantos)
+    pos_der = orden[np.arange(cuantos.sum()) + inicio]
+    return pos_izq, pos_der
+
+
+def _pares_duckdb(izq_cent, der_cent, banda, izq_dia=None, der_dia=None, dias=None):
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ValueError("El motor 'duckdb' requiere instalar el paquete duckdb") from e
+
+    izq = pd.DataFrame({"p": np.arange(len(izq_cent)), "c": izq_cent, "t": banda})
+    der = pd.DataFrame({"p": np.arange(len(der_cent)), "c": der_cent})
+
+    # Rango de fechas dentro del mismo join (días enteros; NaT -> NULL no cruza)
+    condicion_fecha = ""
+    if dias is not None:
+        izq["d"], der["d"] = izq_dia, der_dia
+        condicion_fecha = f"AND der.d BETWEEN izq.d - {int(dias)} AND izq.d + {int(dias)}"
+
+    con = duckdb.connect()
+    try:
+        con.register("izq", izq)
+        con.register("der", der)
+        pares = con.execute(f"""
+            SELECT izq.p AS pi, der.p AS pd
+            FROM izq JOIN der
+              ON der.c BETWEEN izq.c - izq.t AND izq.c + izq.t
+              {condicion_fecha}
+        """).df()
+    finally:
+        con.close()
+
+    return pares["pi"].to_numpy(np.int64), pares["pd"].to_numpy(np.int64)
+
+
+def generar_candidatos(
+    izq_montos: pd.Series,
+    der_montos: pd.Series,
+    tolerancia: float,
+    rtol: float = 0.0,
+    redondear: bool = False,
+    izq_fechas: pd.Series = None,
+    der_fechas: pd.Series = None,
+    dias: int = None,
+    motor: str = None,
+) -> pd.DataFrame:
+    """
+    Pares (IZQ, DER) de etiquetas de índice con |izq - der| <= tolerancia + rtol*|izq|
+    (redondeando a 2 decimales si 'redondear'), y si se da 'dias', con fechas a lo
+    más a esa distancia. Ordenados por posición de IZQ y luego de DER, igual que
+    recorrer la izquierda y filtrar la derecha en su orden original.
+    """
+    if motor is None:
+        motor = "polars" if backend_activo() == "polars" else MOTOR_CANDIDATOS
+    if motor not in MOTORES:
+        raise ValueError(f"Motor de candidatos no soportado: {motor}")
+
+    izq_val = pd.to_numeric(izq_montos, errors="coerce").to_numpy(float)
+    der_val = pd.to_numeric(der_montos, errors="coerce").to_numpy(float)
+    if redondear:
+        izq_val, der_val = np.round(izq_val, 2), np.round(der_val, 2)
+
+    # Los NaN nunca son candidatos
+    izq_ok = np.flatnonzero(~np.isnan(izq_val))
+    der_ok = np.flatnonzero(~np.isnan(der_val))
+
+    izq_cent = np.round(izq_val[izq_ok] * 100)
+    der_cent = np.round(der_val[der_ok] * 100)
+    banda = _banda(izq_cent, tolerancia, rtol)
+
+    con_fechas = dias is not None and izq_fechas is not None and der_fechas is not None
+    izq_dia = der_dia = None
+    if con_fechas:
+        izq_dia = _dias(izq_fechas)
+        der_dia = _dias(der_fechas)
+
+    cache = _cache_barrido.get()
+    clave = guardado = None
+    if cache is not None:
+        clave = _huella_cruce(
+            izq_montos, der_montos, rtol, redondear, dias,
+            izq_fechas if con_fechas else None, der_fechas if con_fechas else None,
+        )
+        guardado = cache.get(clave)
+
+    if guardado is not None and guardado[0] >= tolerancia:
+        # Pares de una tolerancia mayor: el filtro exacto de abajo deja los de esta
+        pi, pd_ = guardado[1]
+    elif len(izq_cent) and len(der_cent):
+        if motor == "polars":
+            from .backend_polars import pares_polars as pares
+        else:
+            pares = _pares_duckdb if motor == "duckdb" else _pares_pandas
+        pi, pd_ = pares(
+            izq_cent,
+            der_cent,
+            banda,
+            izq_dia[izq_ok] if con_fechas else None,
+            der_dia[der_ok] if con_fechas else None,
+            dias if con_fechas else None,
+        )
+        pi, pd_ = izq_ok[pi], der_ok[pd_]
+    else:
+        pi = pd_ = np.array([], dtype=np.int64)
+
+    if cache is not None and (guardado is None or guardado[0] < tolerancia):
+        cache[clave] = (tolerancia, (pi, pd_))
+
+    # Filtro exacto (mismo criterio flotante que usaban los filtros por fila)
+    a, b = izq_val[pi], der_val[pd_]
+    ok = np.abs(b - a) <= tolerancia + rtol * np.abs(a)
+
+    if con_fechas:
+        ok &= np.abs(der_dia[pd_] - izq_dia[pi]) <= dias
+
+    pi, pd_ = pi[ok], pd_[ok]
+    orden = np.lexsort((pd_, pi))
+
+    return pd.DataFrame({
+        "IZQ": izq_montos.index.to_numpy()[pi[orden]],
+        "DER": der_montos.index.to_numpy()[pd_[orden]],
+    })
+
+
+def candidatos_por_fila(pares: pd.DataFrame) -> dict:
+    """{etiqueta_izq: [etiquetas_der en orden]}"""
+    if pares.empty:
+        return {}
+    return pares.groupby("IZQ", sort=False)["DER"].agg(list).to_dict()
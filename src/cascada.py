@@ -0,0 +1,311 @@
+"""
+Conciliación en cascada: cada nivel solo ve lo que el nivel anterior dejó sin conciliar.
+
+    1) REFERENCIA  folio / UUID que aparece en la descripción o referencia del
+                   movimiento (hash join por token) y monto dentro de la tolerancia
+    2) EXACTO      centavos exactos y mismo día (hash join por (centavos, día))
+    3) TOLERANCIA  etapas existentes: estado de cuenta, complementos PPD, abonos
+    4) DIFUSO      etapas existentes: fuzzy de egresos, público en general y
+                   abono multi-factura (subset-sum)
+
+Los niveles 1 y 2 son joins vectorizados y solo aceptan pares uno a uno (un
+movimiento con un solo CFDI y viceversa). Lo que no resuelven pasa completo a
+las etapas de siempre, que así recorren una fracción de las filas.
+"""
+import numpy as np
+import pandas as pd
+
+from .complementos import normalizar_folio
+from .preprocessing import (
+    to_money,
+    to_date,
+    codificar_catalogos,
+    quitar_banderas,
+    norm_sin_acentos,
+    clasificar_cargos_bancarios,
+    folio_texto,
+)
+from .schema import normalizar_columnas, resolver_columnas
+from .utils_orden import mover_cancelados_al_final
+
+NIVELES = ("REFERENCIA", "EXACTO", "TOLERANCIA", "DIFUSO")
+
+OBS_REFERENCIA = "Conciliado por referencia (folio/UUID)"
+OBS_EXACTO = "Conciliado por monto y fecha exactos"
+
+ESTADOS_ABIERTOS = {"", "NAN", "NONE", "NO LOCALIZADO"}
+
+
+# =====================================
+# LLAVES
+# =====================================
+def _centavos(series: pd.Series) -> pd.Series:
+    return (to_money(series).abs() * 100).round()
+
+
+def _tokens(textos: pd.Series) -> pd.DataFrame:
+    """Una fila por (etiqueta, token) de los textos del banco (letras/números, con guiones internos)."""
+    limpio = textos.fillna("").astype(str).map(norm_sin_acentos)
+    tokens = limpio.str.findall(r"[A-Z0-9](?:[A-Z0-9-]*[A-Z0-9])?").explode().dropna()
+    return pd.DataFrame({"FILA": tokens.index, "TOKEN": tokens.to_numpy()}).drop_duplicates()
+
+
+def _uno_a_uno(pares: pd.DataFrame) -> pd.DataFrame:
+    """Solo pares sin ambigüedad: el movimiento y el CFDI aparecen una sola vez."""
+    pares = pares.drop_duplicates(["BANCO", "DOC"])
+    unicos = ~pares["BANCO"].duplicated(keep=False) & ~pares["DOC"].duplicated(keep=False)
+    return pares[unicos]
+
+
+# =====================================
+# ELEGIBLES
+# =====================================
+def _docs_abiertos(df: pd.DataFrame) -> pd.Series:
+    """CFDI que un pago bancario liquida directo (sin complementos, notas ni agrupaciones)."""
+    cols = resolver_columnas(df)
+    mask = ~(
+        df["_ES_PPD_"]
+        | df["_ES_CANCELADO_"]
+        | df["_ES_NOTA_CREDITO_"]
+        | df["_PUE_RESTRINGIDO_"]
+        | (df["_ES_PUE_"] & df["_ES_EFECTIVO_"])
+    )
+
+    if cols["doc.estado_pago"]:
+        estado = df[cols["doc.estado_pago"]].astype(str).str.upper().str.strip()
+        mask &= estado.isin(ESTADOS_ABIERTOS)
+
+    # Folios repetidos se concilian como grupo (suma) en el estado de cuenta
+    if cols["doc.folio"]:
+        mask &= ~df[cols["doc.folio"]].duplicated(keep=False)
+
+    # Facturas con nota de crédito relacionada se pagan por el neto
+    if cols["doc.uuid"] and cols["doc.uuid_relacionados"]:
+        relacionados = df.loc[df["_ES_NOTA_CREDITO_"], cols["doc.uuid_relacionados"]].astype(str).str.strip()
+        mask &= ~df[cols["doc.uuid"]].astype(str).str.strip().isin(relacionados)
+
+    return mask
+
+
+def _banco_libre(banco: pd.DataFrame, col_monto: str) -> pd.Series:
+    cols = resolver_columnas(banco)
+    # Comisiones / impuestos del banco nunca se concilian contra un CFDI
+    mask = (_centavos(banco[col_monto]) > 0) & (clasificar_cargos_bancarios(banco) == "")
+    if cols["banco.folio_factura"]:
+        mask &= banco[cols["banco.folio_factura"]].fillna("").astype(str).str.strip() == ""
+    return mask
+
+
+# =====================================
+# NIVELES 1 Y 2
+# =====================================
+def _nivel_referencia(banco, docs, col_monto, tolerancia) -> pd.DataFrame:
+    cols_banco = resolver_columnas(banco)
+    cols_doc = resolver_columnas(docs)
+
+    textos = [banco[c].fillna("").astype(str) for c in (cols_banco["banco.descripcion"], cols_banco["banco.referencia"]) if c]
+    llaves = [normalizar_folio(docs[c]).str.upper() for c in (cols_doc["doc.folio"], cols_doc["doc.uuid"]) if c]
+    if not textos or not llaves:
+        return pd.DataFrame(columns=["BANCO", "DOC"])
+
+    tokens = _tokens(pd.concat(textos, axis=1).agg(" ".join, axis=1))
+    claves = pd.concat(llaves)
+    claves = claves[~claves.isin(["", "NAN", "NONE"])]
+    claves = pd.DataFrame({"DOC": claves.index, "TOKEN": claves.to_numpy()})
+
+    pares = tokens.merge(claves, on="TOKEN").rename(columns={"FILA": "BANCO"})
+
+    # La referencia se confirma con el monto
+    diferencia = (
+        _centavos(banco[col_monto]).reindex(pares["BANCO"]).to_numpy()
+        - _centavos(docs[cols_doc["doc.monto"]]).reindex(pares["DOC"]).to_numpy()
+    )
+    pares = pares[np.abs(diferencia) <= round(tolerancia * 100)]
+
+    return _uno_a_uno(pares[["BANCO", "DOC"]])
+
+
+def _nivel_exacto(banco, docs, col_monto, fechas_banco) -> pd.DataFrame:
+    cols_doc = resolver_columnas(docs)
+    if not cols_doc["doc.fecha_emision"]:
+        return pd.DataFrame(columns=["BANCO", "DOC"])
+
+    izq = pd.DataFrame({
+        "BANCO": banco.index,
+        "C": _centavos(banco[col_monto]).to_numpy(),
+        "D": fechas_banco.reindex(banco.index).dt.normalize().to_numpy(),
+    }).dropna()
+    der = pd.DataFrame({
+        "DOC": docs.index,
+        "C": _centavos(docs[cols_doc["doc.monto"]]).to_numpy(),
+        "D": to_date(docs[cols_doc["doc.fecha_emision"]]).dt.normalize().to_numpy(),
+    }).dropna()
+
+    return _uno_a_uno(izq.merge(der, on=["C", "D"])[["BANCO", "DOC"]])
+
+
+# =====================================
+# APLICAR RESULTADOS
+# =====================================
+def _marcar_docs(docs: pd.DataFrame, pares: pd.DataFrame, fechas_banco: pd.Series, observacion: str) -> pd.DataFrame:
+    cols = resolver_columnas(docs)
+    col_estado = cols["doc.estado_pago"] or "ESTADO DE PAGO"
+    col_fecha_pago = cols["doc.fecha_pago"] or "FECHA DE PAGO"
+    col_obs = cols["doc.observaciones"] or "OBSERVACIONES"
+
+    out = docs.loc[pares["DOC"]].copy()
+    for c in (col_estado, col_fecha_pago, col_obs):
+        if c not in out.columns:
+            out[c] = ""
+        out[c] = out[c].astype(object)
+
+    out[col_estado] = "PAGADO"
+    out[col_fecha_pago] = fechas_banco.reindex(pares["BANCO"]).dt.strftime("%d/%m/%Y").to_numpy()
+    sin_obs = out[col_obs].isna() | (out[col_obs].astype(str).str.strip() == "")
+    out.loc[sin_obs, col_obs] = observacion
+    return out
+
+
+def _marcar_banco(banco: pd.DataFrame, pares: pd.DataFrame, docs: pd.DataFrame) -> pd.DataFrame:
+    cols_banco = resolver_columnas(banco)
+    cols_doc = resolver_columnas(docs)
+    col_folio_fact = cols_banco["banco.folio_factura"] or "FOLIO FACTURA"
+    col_fecha_fact = cols_banco["banco.fecha_factura"] or "FECHA FACTURA"
+
+    out = banco.loc[pares["BANCO"]].copy()
+    for c in (col_folio_fact, col_fecha_fact, "OBSERVACIONES"):
+        if c not in out.columns:
+            out[c] = ""
+        out[c] = out[c].astype(object)
+
+    if cols_doc["doc.folio"]:
+        out[col_folio_fact] = docs.loc[pares["DOC"], cols_doc["doc.folio"]].map(folio_texto).to_numpy()
+    if cols_doc["doc.fecha_emision"]:
+        out[col_fecha_fact] = to_date(docs.loc[pares["DOC"], cols_doc["doc.fecha_emision"]]).dt.strftime("%d/%m/%Y").to_numpy()
+    out["OBSERVACIONES"] = "CONCILIADO"
+    out["_USADO_"] = True
+    return out
+
+
+def _orden_salida(df: pd.DataFrame, original: pd.DataFrame) -> pd.DataFrame:
+    """Mismo orden que las etapas: por fecha de emisión y cancelados al final."""
+    col_fecha = resolver_columnas(original)["doc.fecha_emision"]
+    orden = original.index
+    if col_fecha:
+        orden = to_date(original[col_fecha]).sort_values(kind="stable").index
+    return mover_cancelados_al_final(df.loc[orden.intersection(df.index, sort=False)])
+
+
+# =====================================
+# CASCADA
+# =====================================
+def _conteo_etapas(antes: pd.DataFrame, despues: pd.DataFrame) -> tuple:
+    """CFDI que las etapas dejaron PAGADO: (por tolerancia, por subset-sum)."""
+    col_antes = resolver_columnas(antes)["doc.estado_pago"]
+    col = resolver_columnas(despues)["doc.estado_pago"]
+    if not col:
+        return 0, 0
+
+    pagado = despues[col].astype(str).str.upper().str.strip().eq("PAGADO")
+    if col_antes:
+        previos = antes.index[antes[col_antes].astype(str).str.upper().str.strip().eq("PAGADO")]
+        pagado &= ~despues.index.isin(previos)
+
+    col_obs = resolver_columnas(despues)["doc.observaciones"]
+    difuso = pd.Series(False, index=despues.index)
+    if col_obs:
+        difuso = despues[col_obs].astype(str).str.contains("PUBLICO EN GENERAL|en grupo", na=False)
+    return int((pagado & ~difuso).sum()), int((pagado & difuso).sum())
+
+
+def ejecutar_en_cascada(ingresos_sheets, egresos_sheets, banco, tolerancia, motor, ejecutar_etapas):
+    """
+    Niveles 1-2 (joins exactos) y luego 'ejecutar_etapas' (niveles 3-4) sobre el residuo.
+    Regresa (banco_out, ingresos_sheets, egresos_sheets, resumen) con CFDI conciliados por nivel.
+    """
+    hoja_egr = "ACUMULADO" if "ACUMULADO" in egresos_sheets else "EGRESOS"
+    if "ACUMULADO" not in ingresos_sheets or hoja_egr not in egresos_sheets:
+        raise ValueError("Los archivos de INGRESOS y EGRESOS deben tener una hoja 'ACUMULADO'")
+
+    banco = normalizar_columnas(banco.copy())
+    cols_banco = resolver_columnas(banco)
+    col_fecha_banco = cols_banco["banco.fecha"]
+    if not col_fecha_banco:
+        raise ValueError("Banco: falta columna FECHA")
+    fechas_banco = to_date(banco[col_fecha_banco])
+
+    libros = {
+        "ingresos": (normalizar_columnas(ingresos_sheets["ACUMULADO"].copy()), cols_banco["banco.abono"]),
+        "egresos": (normalizar_columnas(egresos_sheets[hoja_egr].copy()), cols_banco["banco.cargo"]),
+    }
+    for docs, _ in libros.values():
+        codificar_catalogos(docs)
+
+    resumen = {nivel: 0 for nivel in NIVELES}
+    usados_banco = set()
+    resueltos = {nombre: [] for nombre in libros}
+    salidas_banco = []
+
+    # ---- Niveles 1 y 2: cada uno sobre lo que dejó el anterior ----
+    for nivel, observacion in (("REFERENCIA", OBS_REFERENCIA), ("EXACTO", OBS_EXACTO)):
+        for nombre, (docs, col_monto) in libros.items():
+            if not col_monto or not resolver_columnas(docs)["doc.monto"]:
+                continue
+
+            ya_resueltos = [i for parte in resueltos[nombre] for i in parte.index]
+            banco_res = banco[_banco_libre(banco, col_monto) & ~banco.index.isin(usados_banco)]
+            docs_res = docs[_docs_abiertos(docs) & ~docs.index.isin(ya_resueltos)]
+            if banco_res.empty or docs_res.empty:
+                continue
+
+            if nivel == "REFERENCIA":
+                pares = _nivel_referencia(banco_res, docs_res, col_monto, tolerancia)
+            else:
+                pares = _nivel_exacto(banco_res, docs_res, col_monto, fechas_banco)
+            if pares.empty:
+                continue
+
+            resueltos[nombre].append(_marcar_docs(docs, pares, fechas_banco, observacion))
+            salidas_banco.append(_marcar_banco(banco, pares, docs))
+            usados_banco.update(pares["BANCO"])
+            resumen[nivel] += len(pares)
+
+    # ---- Niveles 3 y 4: las etapas de siempre sobre el residuo ----
+    residuo = {
+        nombre: quitar_banderas(docs.drop([i for parte in resueltos[nombre] for i in parte.index]))
+        for nombre, (docs, _) in libros.items()
+    }
+    egr_residuo = dict(egresos_sheets)
+    egr_residuo[hoja_egr] = residuo["egresos"]
+
+    banco_out, ing_out, egr_out = ejecutar_etapas(
+        dict(ingresos_sheets, ACUMULADO=residuo["ingresos"]),
+        egr_residuo,
+        banco.drop(list(usados_banco)),
+        tolerancia,
+        motor,
+    )
+
+    for nombre, salida in (("ingresos", ing_out), ("egresos", egr_out)):
+        tolerancia_n, difuso_n = _conteo_etapas(residuo[nombre], salida["ACUMULADO"])
+        resumen["TOLERANCIA"] += tolerancia_n
+        resumen["DIFUSO"] += difuso_n
+
+    # ---- Unir niveles en el orden de las etapas ----
+    for parte in salidas_banco:
+        # Mismo formato que dejan las etapas (texto dd/mm/aaaa, o fecha si una etapa la volvió a leer)
+        texto = fechas_banco.reindex(parte.index).dt.strftime("%d/%m/%Y").fillna("")
+        es_fecha = pd.api.types.is_datetime64_any_dtype(banco_out[col_fecha_banco])
+        parte[col_fecha_banco] = to_date(texto) if es_fecha else texto
+    banco_final = pd.concat([banco_out] + salidas_banco)
+    banco_final = mover_cancelados_al_final(banco_final.loc[[i for i in banco.index if i in banco_final.index]])
+
+    ing_final = pd.concat([ing_out["ACUMULADO"]] + [quitar_banderas(p) for p in resueltos["ingresos"]])
+    egr_final = pd.concat(
+        [egr_out["ACUMULADO"]] + [quitar_banderas(p).assign(CONCILIADO_BANCO="SI") for p in resueltos["egresos"]]
+    )
+
+    ing_out = dict(ing_out, ACUMULADO=_orden_salida(ing_final, libros["ingresos"][0]))
+    egr_out = dict(egr_out, ACUMULADO=_orden_salida(egr_final, libros["egresos"][0]))
+
+    return banco_final, ing_out, egr_out, resumen
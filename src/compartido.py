@@ -0,0 +1,108 @@
+"""
+Frames compartidos entre procesos sin copiarlos (Arrow IPC mapeado en memoria).
+
+El proceso principal escribe cada frame normalizado una sola vez como archivo
+Arrow IPC en un directorio temporal. Cada worker lo abre con pa.memory_map: las
+páginas las comparte el sistema operativo (page cache), así que N workers no
+multiplican la memoria de los frames de entrada, y nada se serializa con pickle.
+Los workers solo regresan resultados compactos (códigos categóricos / arreglos).
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+
+#* Frames adjuntos en el worker actual (se abren una vez por proceso)
+_FRAMES = {}
+
+
+# =====================================
+# PUBLICAR / ADJUNTAR
+# =====================================
+def _tabla(df: pd.DataFrame) -> pa.Table:
+    try:
+        return pa.Table.from_pandas(df, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Columnas object con tipos mezclados (p. ej. FOLIO numérico y texto): a texto nullable
+        mezcladas = {
+            c: "string"
+            for c in df.columns
+            if df[c].dtype == object and df[c].dropna().map(type).nunique() > 1
+        }
+        return pa.Table.from_pandas(df.astype(mezcladas), preserve_index=True)
+
+
+def publicar_frames(frames: dict, directorio: str) -> dict:
+    """Escribe cada frame como Arrow IPC en 'directorio'. Regresa {nombre: ruta}."""
+    os.makedirs(directorio, exist_ok=True)
+    rutas = {}
+    for nombre, df in frames.items():
+        if df is None:
+            continue
+        ruta = os.path.join(directorio, f"{nombre}.arrow")
+        tabla = _tabla(df)
+        with pa.OSFile(ruta, "wb") as sink:
+            with pa.ipc.new_file(sink, tabla.schema) as writer:
+                writer.write_table(tabla)
+        rutas[nombre] = ruta
+    return rutas
+
+
+def adjuntar_frame(ruta: str) -> pd.DataFrame:
+    """
+    Abre un frame publicado sin leerlo a memoria propia: las columnas numéricas sin
+    nulos quedan como vistas de solo lectura sobre el archivo mapeado.
+    Las etapas hacen .copy() antes de escribir, así que no se modifican.
+    """
+    with pa.memory_map(ruta, "r") as fuente:
+        tabla = pa.ipc.open_file(fuente).read_all()
+    return tabla.to_pandas(split_blocks=True, self_destruct=False)
+
+
+def _iniciar_worker(rutas: dict):
+    _FRAMES.clear()
+    for nombre, ruta in rutas.items():
+        _FRAMES[nombre] = adjuntar_frame(ruta)
+
+
+def _ejecutar_tarea(funcion, tarea):
+    return funcion(_FRAMES, tarea)
+
+
+# =====================================
+# EJECUCIÓN EN PROCESOS
+# =====================================
+def mapa_en_procesos(funcion, frames: dict, tareas: list, procesos: int = None, directorio: str = None) -> list:
+    """
+    Ejecuta funcion(frames, tarea) para cada tarea en un pool de procesos.
+    Los frames se publican una vez y cada worker los adjunta al iniciar; 'funcion'
+    debe ser de nivel módulo (picklable) y regresar algo compacto.
+    Con procesos=1 se ejecuta en el mismo proceso (útil para depurar).
+    """
+    if procesos == 1:
+        return [funcion(frames, tarea) for tarea in tareas]
+
+    temporal = None
+    if directorio is None:
+        temporal = tempfile.TemporaryDirectory(prefix="conciliacion_compartido_")
+        directorio = temporal.name
+
+    try:
+        rutas = publicar_frames(frames, directorio)
+        with ProcessPoolExecutor(
+            max_workers=procesos,
+            initializer=_iniciar_worker,
+            initargs=(rutas,),
+        ) as pool:
+            futuros = [pool.submit(_ejecutar_tarea, funcion, tarea) for tarea in tareas]
+            return [f.result() for f in futuros]
+    finally:
+        if temporal is not None:
+            temporal.cleanup()
+
+
+def compactar(series: pd.Series) -> pd.Categorical:
+    """Resultado por fila como categórico (códigos enteros + categorías únicas)."""
+    return pd.Categorical(series.fillna("").astype(str))
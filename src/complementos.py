@@ -1,22 +1,21 @@
 import pandas as pd
-from .preprocessing import pick_column, to_money, to_date
+from .preprocessing import to_money, to_date
+from .schema import normalizar_columnas, resolver_columnas
 
 #* Funcionalidad que busca los folios iguales en la hoja de complementos del archivo de ingresos
 def agrupar_complementos_por_folio(complementos: pd.DataFrame):
-    complementos = complementos.copy()
-    complementos.columns = complementos.columns.astype(str).str.upper().str.strip()
-
-    col_folio = pick_column(complementos, ["FOLIO"])
-    col_importe = pick_column(complementos, ["IMPORTE PAGADO"])
-    col_folio_doc = pick_column(complementos, ["FOLIO DOCUMENTO"])
-    col_fecha_doc = pick_column(
-        complementos,
-        ["FECHA EMISION (DOC)", "FECHA EMISION DOC"]
-    )
-    col_fecha_cp = pick_column(
-        complementos,
-        ["FECHA EMISION", "FECHA COMPLEMENTO DE PAGO"]
-    )
+    complementos = normalizar_columnas(complementos.copy())
+    cols = resolver_columnas(complementos)
+
+    col_folio = cols["comp.folio"]
+    col_importe = cols["comp.importe_pagado"]
+    col_folio_doc = cols["comp.folio_documento"]
+    col_fecha_doc = cols["comp.fecha_doc"]
+    col_fecha_cp = cols["comp.fecha_cp"]
+
+    # Sin FOLIO DOCUMENTO el alias cae en FOLIO, que ya es la llave del groupby
+    if col_folio_doc == col_folio:
+        col_folio_doc = None
 
     if not col_folio or not col_importe:
         return complementos
@@ -28,26 +27,74 @@ def agrupar_complementos_por_folio(complementos: pd.DataFrame):
     if col_fecha_cp:
         complementos[col_fecha_cp] = to_date(complementos[col_fecha_cp])
 
-    # 🔹 AGRUPAR
-    grouped = (
-        complementos
-        .groupby(col_folio, dropna=False)
-        .agg({
-            col_importe: "sum",
-            #* Para poner los dos folios que sale en la hoja de complemento desde ingresos
-            col_folio_doc: lambda x: "-".join(
-                [str(v) for v in x if pd.notna(v)]
-            ),
-            #* Para poner las fechas que sale en la hoja de complemento desde ingresos
-            col_fecha_doc: lambda x: "-".join(
-                pd.to_datetime(x, errors="coerce")
-                .dropna()
-                .dt.strftime("%d/%m/%Y")
-                .tolist()
-            ),
-            col_fecha_cp: "min",
-        })
-        .reset_index()
-    )
-
-    return grouped
+    # 🔹 AGRUPAR (solo reducciones nativas; los textos se unen con una sola suma por grupo)
+    grupos = complementos.groupby(col_folio, dropna=False, sort=True)
+    grouped = grupos[[col_importe]].sum()
+
+    #* Para poner los dos folios que sale en la hoja de complemento desde ingresos
+    if col_folio_doc:
+        folios = complementos[col_folio_doc]
+        grouped[col_folio_doc] = _unir_textos(folios.astype(str), folios.notna(), grupos)
+
+    #* Para poner las fechas que sale en la hoja de complemento desde ingresos
+    if col_fecha_doc:
+        fechas = complementos[col_fecha_doc]
+        grouped[col_fecha_doc] = _unir_textos(fechas.dt.strftime("%d/%m/%Y"), fechas.notna(), grupos)
+
+    if col_fecha_cp:
+        grouped[col_fecha_cp] = grupos[col_fecha_cp].min()
+
+    return grouped.reset_index()
+
+
+def _unir_textos(textos: pd.Series, validos: pd.Series, grupos) -> pd.Series:
+    """
+    "-".join de los valores válidos de cada grupo, en el orden original.
+    Cada valor lleva su separador y la suma por grupo concatena; se quita el último "-".
+    """
+    con_sep = (textos + "-").where(validos, "")
+    unidos = con_sep.groupby(grupos.ngroup(), sort=True).sum()
+    return pd.Series(unidos.str[:-1].to_numpy(), index=grupos.size().index)
+
+
+def normalizar_folio(series: pd.Series) -> pd.Series:
+    """Folio como texto comparable (sin '.0' de Excel ni espacios)."""
+    return series.astype(str).str.replace(".0", "", regex=False).str.strip()
+
+
+#* Libro de pagos: lo pagado por factura según los complementos (parcialidades)
+def libro_de_pagos(complementos: pd.DataFrame, folios_cp=None, excluir=None) -> pd.DataFrame:
+    """
+    Suma IMPORTE PAGADO por FOLIO DOCUMENTO con un solo groupby.
+    Si se da 'folios_cp', solo cuentan esos complementos (p. ej. los encontrados en banco).
+    'excluir': pares (folio factura, folio CP) que ya se aplicaron en corridas anteriores.
+    Regresa un frame indexado por folio normalizado con PAGADO y PAGOS (número de parcialidades).
+    """
+    vacio = pd.DataFrame({"PAGADO": pd.Series(dtype=float), "PAGOS": pd.Series(dtype="int64")})
+    if complementos is None or complementos.empty:
+        return vacio
+
+    complementos = normalizar_columnas(complementos.copy())
+    cols = resolver_columnas(complementos)
+    col_folio = cols["comp.folio"]
+    col_folio_doc = cols["comp.folio_documento"]
+    col_importe = cols["comp.importe_pagado"]
+
+    # Sin FOLIO DOCUMENTO no se sabe a qué factura va cada pago
+    if not col_folio_doc or col_folio_doc == col_folio or not col_importe:
+        return vacio
+
+    pagos = pd.DataFrame({
+        "FOLIO": normalizar_folio(complementos[col_folio_doc]),
+        "IMPORTE": to_money(complementos[col_importe]).abs(),
+    })
+    if col_folio:
+        folio_cp = normalizar_folio(complementos[col_folio])
+        if folios_cp is not None:
+            pagos = pagos[folio_cp.isin(folios_cp)]
+        if excluir:
+            pares = pd.MultiIndex.from_arrays([pagos["FOLIO"], folio_cp.loc[pagos.index]])
+            pagos = pagos[~pares.isin(list(excluir))]
+
+    pagos = pagos[pagos["IMPORTE"] > 0]
+    return pagos.groupby("FOLIO").agg(PAGADO=("IMPORTE", "sum"), PAGOS=("IMPORTE", "size"))
@@ -22,3 +22,110 @@ EGRESO_CONCEPTO_CANDIDATES = [
 INGRESO_ID_CANDIDATES = [
     "FOLIO", "FOLIO FACTURA", "FACTURA", "NO_FACTURA", "NUM_DOCUMENTO"
 ]
+
+#* Formas de pago que, con método PUE, no se concilian contra banco
+RESTRICTED_PUE_FORMA = {
+    "EFECTIVO",
+    "TARJETA CREDITO",
+    "TARJETA CRÉDITO",
+    "CONDONACION",
+    "CONDONACIÓN",
+    "NOVACION",
+    "NOVACIÓN",
+}
+
+#* Tokens que no distinguen una descripción bancaria de otra (se quitan antes del fuzzy)
+TOKENS_VACIOS_DESCRIPCION = {
+    "SPEI",
+    "TRANSF",
+    "TRANSFERENCIA",
+    "RECIBIDO",
+    "ENVIADO",
+    "DE",
+    "LA",
+    "EL",
+    "A",
+    "POR",
+}
+
+#* Movimientos del banco que nunca corresponden a un CFDI (comisiones, impuestos, intereses).
+#* Regex sobre la descripción/referencia sin acentos; ante empate en la misma posición gana el primero.
+CARGOS_BANCARIOS = {
+    "IVA COMISION": r"\bIVA\s+(?:POR\s+|DE\s+|S/\s*)?COM(?:ISION(?:ES)?|\.)?\b",
+    "COMISION SPEI": r"\bCOM(?:ISION|\.)?\s+(?:POR\s+|DE\s+)?(?:ENVIO\s+|TRANSF\w*\s+)?SPEI\b",
+    "COMISION": r"\bCOMISION(?:ES)?\b|\bCOM\.\s",
+    "ISR RETENIDO": r"\b(?:RET(?:ENCION|\.)?\s+(?:DE\s+)?)?ISR\b",
+    "INTERESES": r"\bINTERES(?:ES)?\b",
+}
+
+#* Campos estructurados de la descripción SPEI (texto sin acentos, en mayúsculas); grupo 1 = valor
+PATRONES_SPEI = {
+    "RASTREO": r"(?:CLAVE\s+(?:DE\s+)?RASTREO|CVE\.?\s*RAST(?:REO)?|RASTREO)\s*:?\s*([A-Z0-9]{6,30})\b",
+    "RFC": r"\b([A-Z&]{3,4}\d{6}[A-Z0-9]{3})\b",
+    "CLABE": r"(?<!\d)(\d{18})(?!\d)",
+    "FOLIO": r"\b(?:FOLIO|FACTURA|FACT|FAC)\.?\s*(?:NO\.?\s*|#\s*)?:?\s*([A-Z]{0,4}-?\d{1,10})\b",
+    "REFERENCIA": r"\b(?:REFERENCIA|REF)\.?\s*(?:NUM\.?\s*)?:?\s*(\d{4,12})\b",
+}
+
+#* Pares (concepto, descripción) que se conservan en el cache de similitud
+TAMANO_CACHE_SIMILITUD = 200_000
+
+
+# =====================================
+# REGISTRO DE ALIAS DE COLUMNAS
+# =====================================
+#* rol -> alias en orden de preferencia.
+#* La comparación ignora acentos, mayúsculas, espacios y signos ("FECHA_EMISION" == "FECHA EMISIÓN").
+COLUMN_ALIASES = {
+    # ---- Estado de cuenta ----
+    "banco.fecha": FECHA_COL_CANDIDATES,
+    "banco.cargo": CARGO_COL_CANDIDATES,
+    "banco.abono": ["ABONO", "ABONOS", "CREDITO", "DEPOSITO", "ENTRADA", "ENTRADAS", "HABER"],
+    "banco.monto": ["IMPORTE", "MONTO"],
+    "banco.descripcion": DESCRIP_COL_CANDIDATES,
+    "banco.referencia": ["REFERENCIA", "REF", "NO. REFERENCIA", "CLAVE DE RASTREO"],
+    "banco.saldo": ["SALDO", "SALDO FINAL", "SALDO DISPONIBLE"],
+    "banco.folio_factura": ["FOLIO FACTURA"],
+    "banco.fecha_factura": ["FECHA FACTURA"],
+    "banco.folio_cp": ["FOLIO COMPLEMENTO DE PAGO"],
+    "banco.fecha_cp": ["FECHA COMPLEMENTO DE PAGO", "FCHA COMPLEMENTO DE PAGO"],
+
+    # ---- ACUMULADO (ingresos / egresos) ----
+    "doc.monto": EGRESO_MONTO_CANDIDATES,
+    "doc.total": ["TOTAL"],
+    "doc.fecha": EGRESO_FECHA_CANDIDATES,
+    "doc.fecha_emision": ["FECHA EMISION"],
+    "doc.concepto": EGRESO_CONCEPTO_CANDIDATES,
+    "doc.id": INGRESO_ID_CANDIDATES,
+    "doc.folio": ["FOLIO"],
+    "doc.folio_documento": ["FOLIO DOCUMENTO", "FOLIO DOC", "FOLIO FACTURA"],
+    "doc.metodo": ["METODO PAGO", "METODO DE PAGO", "METODO"],
+    "doc.forma": ["FORMA PAGO", "FORMA DE PAGO", "FORMA"],
+    "doc.estado_pago": ["ESTADO DE PAGO", "ESTADO PAGO"],
+    "doc.fecha_pago": ["FECHA DE PAGO", "FECHA PAGO"],
+    "doc.observaciones": ["OBSERVACIONES", "OBSERVACION"],
+    "doc.estado_cfdi": ["ESTADO", "ESTATUS", "ESTADO CFDI", "ESTATUS CFDI", "STATUS", "SITUACION"],
+    "doc.tipo": ["TIPO"],
+    "doc.uuid": ["UUID"],
+    "doc.uuid_relacionados": ["UUIDS RELACIONADOS"],
+    "doc.razon_receptor": ["RAZON RECEPTOR", "RAZON"],
+    "doc.rfc_receptor": ["RFC RECEPTOR", "RFC"],
+    "doc.rfc_emisor": ["RFC EMISOR", "RFC PROVEEDOR"],
+
+    # ---- COMPLEMENTOS ----
+    "comp.folio": ["FOLIO", "FOLIO COMPLEMENTO DE PAGO"],
+    "comp.folio_documento": ["FOLIO DOCUMENTO", "FOLIO DOC", "FOLIO"],
+    "comp.importe_pagado": ["IMPORTE PAGADO"],
+    "comp.fecha_doc": ["FECHA EMISION (DOC)", "FECHA EMISION DOC", "FECHA DOC"],
+    "comp.fecha_cp": ["FECHA EMISION", "FECHA COMPLEMENTO DE PAGO"],
+}
+
+#* Motor para generar candidatos monto/fecha: "pandas" (por defecto), "duckdb" o "polars"
+MOTOR_CANDIDATOS = "pandas"
+
+#* Backend para limpiar montos/fechas: "pandas" (por defecto) o "polars"
+BACKEND = "pandas"
+
+#* Progreso: se avisa a lo más cada N segundos y la cancelación se revisa cada N filas
+INTERVALO_PROGRESO = 0.25
+FILAS_POR_LOTE_PROGRESO = 64
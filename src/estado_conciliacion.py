@@ -0,0 +1,344 @@
+"""
+Conciliación incremental: guarda en SQLite lo que ya quedó conciliado
+(movimientos por huella, CFDI por UUID/folio y complementos aplicados)
+para que la siguiente corrida solo procese lo nuevo o lo que cambió.
+Los CFDI en PARCIAL no se bloquean, pero se guarda lo ya pagado para que
+los complementos nuevos se sumen a los de corridas anteriores.
+"""
+import json
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from .pipeline import conciliar, hojas_acumulado
+from .preprocessing import (
+    to_money,
+    to_date,
+    huella_banco,
+    clave_cfdi,
+    huella_contenido,
+)
+from .reconcile_ppd_complementos import COL_PAGADO_CP, COL_SALDO
+from .schema import resolver_columnas
+from .utils_orden import mover_cancelados_al_final
+
+
+#* Columnas que escriben las etapas (lo único que se guarda por fila)
+BANCO_COLS_SALIDA = [
+    "FOLIO FACTURA",
+    "FECHA FACTURA",
+    "OBSERVACIONES",
+    "FOLIO COMPLEMENTO DE PAGO",
+    "FECHA COMPLEMENTO DE PAGO",
+]
+DOC_COLS_SALIDA = [
+    "ESTADO DE PAGO",
+    "FECHA DE PAGO",
+    "OBSERVACIONES",
+    "CONCILIADO_BANCO",
+    "FOLIO CP",
+    "FECHA CP",
+    COL_PAGADO_CP,
+    COL_SALDO,
+]
+
+#* Columnas guardadas que son importes (se regresan como número, "" se conserva)
+DOC_COLS_IMPORTE = (COL_PAGADO_CP, COL_SALDO)
+
+#* Estados de pago que ya no se vuelven a conciliar
+ESTADOS_BLOQUEADOS = {"PAGADO", "PAGADO OTRO", "NO PAGADO", "NOTA DE CREDITO", "CANCELADO"}
+#* Estado que se guarda aparte y se restaura sobre el delta (parcialidades)
+ESTADO_PARCIAL = "PARCIAL"
+
+#* Columnas de entrada que, si cambian, obligan a reconciliar el CFDI
+ROLES_CONTENIDO_CFDI = (
+    "doc.monto",
+    "doc.fecha_emision",
+    "doc.metodo",
+    "doc.forma",
+    "doc.estado_cfdi",
+    "doc.tipo",
+    "doc.uuid_relacionados",
+)
+
+
+# =====================================
+# ALMACÉN (SQLite)
+# =====================================
+def abrir_estado(ruta: str) -> sqlite3.Connection:
+    con = sqlite3.connect(ruta)
+    con.executescript("""
+        CREATE TABLE IF NOT EXISTS banco (
+            huella TEXT PRIMARY KEY,
+            datos TEXT NOT NULL,
+            actualizado TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS cfdi (
+            libro TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            contenido TEXT NOT NULL,
+            datos TEXT NOT NULL,
+            actualizado TEXT NOT NULL,
+            PRIMARY KEY (libro, clave)
+        );
+        CREATE TABLE IF NOT EXISTS complemento (
+            libro TEXT NOT NULL,
+            folio TEXT NOT NULL,
+            PRIMARY KEY (libro, folio)
+        );
+        CREATE TABLE IF NOT EXISTS parcial (
+            libro TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            datos TEXT NOT NULL,
+            actualizado TEXT NOT NULL,
+            PRIMARY KEY (libro, clave)
+        );
+    """)
+    return con
+
+
+def _leer(con, query, params=()) -> pd.DataFrame:
+    return pd.read_sql_query(query, con, params=params)
+
+
+def _datos_fila(df: pd.DataFrame, columnas) -> pd.Series:
+    cols = [c for c in columnas if c in df.columns]
+    valores = df[cols].astype(object).where(df[cols].notna(), "")
+    return pd.Series(
+        [json.dumps(dict(zip(cols, map(str, fila))), ensure_ascii=False) for fila in valores.itertuples(index=False)],
+        index=df.index,
+        dtype="object",
+    )
+
+
+def _aplicar_datos(df: pd.DataFrame, datos: pd.Series) -> pd.DataFrame:
+    """Escribe en df las columnas guardadas (datos = JSON por fila, mismo índice)."""
+    df = df.copy()
+    if datos.empty:
+        return df
+    guardado = pd.DataFrame([json.loads(d) for d in datos], index=datos.index)
+    for col in guardado.columns:
+        if col not in df.columns:
+            df[col] = ""
+        df[col] = df[col].astype(object)
+        valores = guardado[col]
+        if col in DOC_COLS_IMPORTE:
+            valores = to_money(valores).astype(object).where(valores != "", "")
+        df.loc[guardado.index, col] = valores
+    return df
+
+
+def _alinear_tipos(previo: pd.DataFrame, referencia: pd.DataFrame) -> pd.DataFrame:
+    """Iguala los tipos de las filas reutilizadas a los que dejó la corrida nueva."""
+    previo = previo.copy()
+    for col in previo.columns.intersection(referencia.columns):
+        ref, s = referencia[col], previo[col]
+        if ref.isna().all():
+            # Columna vacía en el delta (p. ej. OBSERVACIONES sin escribir): manda lo guardado
+            continue
+        if pd.api.types.is_datetime64_any_dtype(ref) and not pd.api.types.is_datetime64_any_dtype(s):
+            previo[col] = to_date(s)
+        elif pd.api.types.is_numeric_dtype(ref) and not pd.api.types.is_numeric_dtype(s):
+            previo[col] = to_money(s)
+        elif ref.dtype == object and pd.api.types.is_datetime64_any_dtype(s):
+            previo[col] = s.dt.strftime("%d/%m/%Y").fillna("")
+    return previo
+
+
+def _combinar(previo: pd.DataFrame, nuevo: pd.DataFrame) -> pd.DataFrame:
+    if previo.empty:
+        return nuevo
+    previo = _alinear_tipos(previo, nuevo)
+    columnas = list(nuevo.columns) + [c for c in previo.columns if c not in nuevo.columns]
+    return pd.concat([previo, nuevo]).reindex(columns=columnas).sort_index(kind="stable")
+
+
+# =====================================
+# CORRIDA INCREMENTAL
+# =====================================
+def _cfdi_bloqueados(con, libro, df):
+    claves = clave_cfdi(df)
+    contenido = huella_contenido(df, ROLES_CONTENIDO_CFDI)
+
+    guardados = _leer(con, "SELECT clave, contenido, datos FROM cfdi WHERE libro = ?", (libro,))
+    guardados = guardados.set_index("clave")
+
+    en_estado = claves.isin(guardados.index) & (claves != "")
+    mismo = pd.Series(False, index=df.index)
+    mismo[en_estado] = (
+        guardados.loc[claves[en_estado], "contenido"].to_numpy() == contenido[en_estado].to_numpy()
+    )
+    datos = pd.Series(dtype="object")
+    if mismo.any():
+        datos = pd.Series(guardados.loc[claves[mismo], "datos"].to_numpy(), index=df.index[mismo])
+
+    return mismo, datos, claves, contenido
+
+
+def _con_parciales(con, libro, df, claves):
+    """
+    Restaura sobre el delta el último resultado PARCIAL de cada CFDI (estado, FOLIO CP,
+    IMPORTE PAGADO CP y SALDO INSOLUTO): sus CP ya aplicados no vuelven a la etapa PPD,
+    así que el importe pagado tiene que venir de la corrida anterior.
+    """
+    guardados = _leer(con, "SELECT clave, datos FROM parcial WHERE libro = ?", (libro,))
+    claves = claves.reindex(df.index)
+    previos = claves.isin(guardados["clave"]) & (claves != "")
+    if not previos.any():
+        return df
+
+    datos = guardados.set_index("clave")["datos"]
+    return _aplicar_datos(df, pd.Series(datos.loc[claves[previos]].to_numpy(), index=df.index[previos]))
+
+
+def _guardar_parciales(con, libro, df_out, claves, ahora):
+    """Reemplaza las parcialidades guardadas de los CFDI procesados en esta corrida."""
+    claves = claves.reindex(df_out.index)
+    validas = claves.notna() & (claves != "")
+    con.executemany(
+        "DELETE FROM parcial WHERE libro = ? AND clave = ?",
+        [(libro, clave) for clave in claves[validas].unique()]
+    )
+
+    col_estado = resolver_columnas(df_out)["doc.estado_pago"]
+    if not col_estado:
+        return
+    estado = df_out[col_estado].astype(str).str.upper().str.strip()
+    mask = (estado == ESTADO_PARCIAL) & validas
+    datos = _datos_fila(df_out[mask], DOC_COLS_SALIDA)
+    con.executemany(
+        "INSERT OR REPLACE INTO parcial VALUES (?, ?, ?, ?)",
+        [(libro, clave, d, ahora) for clave, d in zip(claves[mask], datos)]
+    )
+
+
+def _filtrar_complementos(con, libro, complementos):
+    if complementos is None or complementos.empty:
+        return complementos
+    col_folio = resolver_columnas(complementos)["comp.folio"]
+    if not col_folio:
+        return complementos
+    aplicados = set(_leer(con, "SELECT folio FROM complemento WHERE libro = ?", (libro,))["folio"])
+    folios = complementos[col_folio].astype(str).str.strip()
+    return complementos[~folios.isin(aplicados)]
+
+
+def _guardar_cfdi(con, libro, df_out, claves, contenido, ahora):
+    col_estado = resolver_columnas(df_out)["doc.estado_pago"]
+    if not col_estado:
+        return 0
+    claves = claves.reindex(df_out.index)
+    estado = df_out[col_estado].astype(str).str.upper().str.strip()
+    mask = estado.isin(ESTADOS_BLOQUEADOS) & claves.notna() & (claves != "")
+    datos = _datos_fila(df_out[mask], DOC_COLS_SALIDA)
+    filas = [
+        (libro, clave, cont, d, ahora)
+        for clave, cont, d in zip(claves[mask], contenido.reindex(df_out.index)[mask], datos)
+    ]
+    con.executemany("INSERT OR REPLACE INTO cfdi VALUES (?, ?, ?, ?, ?)", filas)
+    return len(filas)
+
+
+def conciliar_incremental(
+    ingresos_sheets: dict,
+    egresos_sheets: dict,
+    banco: pd.DataFrame,
+    tolerancia: float = 0.01,
+    ruta_estado: str = "conciliacion_estado.sqlite",
+    motor: str = None,
+    backend: str = None,
+):
+    """
+    Igual que pipeline.conciliar, pero reutiliza lo conciliado en corridas previas:
+    los movimientos y CFDI ya resueltos se bloquean y solo el delta pasa por las etapas.
+    Regresa (banco_out, ingresos_sheets, egresos_sheets, resumen).
+    """
+    ingresos_acumulado, egresos_acumulado = hojas_acumulado(ingresos_sheets, egresos_sheets)
+    hoja_egr = "ACUMULADO" if "ACUMULADO" in egresos_sheets else "EGRESOS"
+    ahora = datetime.now().isoformat(timespec="seconds")
+
+    con = abrir_estado(ruta_estado)
+    try:
+        # ---- Banco: movimientos ya conciliados por huella ----
+        huellas = huella_banco(banco)
+        guardados = _leer(con, "SELECT huella, datos FROM banco").set_index("huella")["datos"]
+        bloq_banco = huellas.isin(guardados.index)
+        datos_banco = pd.Series(guardados.reindex(huellas[bloq_banco]).to_numpy(), index=banco.index[bloq_banco])
+
+        # ---- CFDI ya resueltos (mismo UUID/folio y mismo contenido) ----
+        bloq_ing, datos_ing, claves_ing, cont_ing = _cfdi_bloqueados(con, "ingresos", ingresos_acumulado)
+        bloq_egr, datos_egr, claves_egr, cont_egr = _cfdi_bloqueados(con, "egresos", egresos_acumulado)
+
+        delta_ing = dict(ingresos_sheets)
+        delta_egr = dict(egresos_sheets)
+        delta_ing["ACUMULADO"] = _con_parciales(con, "ingresos", ingresos_acumulado[~bloq_ing], claves_ing)
+        delta_egr[hoja_egr] = _con_parciales(con, "egresos", egresos_acumulado[~bloq_egr], claves_egr)
+
+        for libro, sheets in (("ingresos", delta_ing), ("egresos", delta_egr)):
+            if "COMPLEMENTOS" in sheets:
+                sheets["COMPLEMENTOS"] = _filtrar_complementos(con, libro, sheets["COMPLEMENTOS"])
+
+        banco_delta, delta_ing, delta_egr = conciliar(
+            ingresos_sheets=delta_ing,
+            egresos_sheets=delta_egr,
+            banco=banco[~bloq_banco],
+            tolerancia=tolerancia,
+            motor=motor,
+            backend=backend,
+        )
+
+        # ---- Guardar lo que quedó resuelto en esta corrida ----
+        obs = banco_delta.get("OBSERVACIONES", pd.Series("", index=banco_delta.index))
+        obs = obs.fillna("").astype(str).str.strip()
+        folio = banco_delta.get("FOLIO FACTURA", pd.Series("", index=banco_delta.index))
+        folio = folio.fillna("").astype(str).str.strip()
+        resuelto = ((obs != "") & (obs != "N/A")) | (folio != "")
+        datos = _datos_fila(banco_delta[resuelto], BANCO_COLS_SALIDA)
+        con.executemany(
+            "INSERT OR REPLACE INTO banco VALUES (?, ?, ?)",
+            [(h, d, ahora) for h, d in zip(huellas.reindex(banco_delta.index)[resuelto], datos)]
+        )
+
+        if "FOLIO COMPLEMENTO DE PAGO" in banco_delta.columns:
+            folios_cp = banco_delta["FOLIO COMPLEMENTO DE PAGO"].fillna("").astype(str).str.strip()
+            for libro, col_mov in (("ingresos", "ABONO"), ("egresos", "CARGO")):
+                if col_mov not in banco_delta.columns:
+                    continue
+                con_mov = to_money(banco_delta[col_mov]).fillna(0) > 0
+                con.executemany(
+                    "INSERT OR IGNORE INTO complemento VALUES (?, ?)",
+                    [(libro, f) for f in folios_cp[(folios_cp != "") & con_mov].unique()]
+                )
+
+        n_ing = _guardar_cfdi(con, "ingresos", delta_ing["ACUMULADO"], claves_ing, cont_ing, ahora)
+        n_egr = _guardar_cfdi(con, "egresos", delta_egr["ACUMULADO"], claves_egr, cont_egr, ahora)
+        _guardar_parciales(con, "ingresos", delta_ing["ACUMULADO"], claves_ing, ahora)
+        _guardar_parciales(con, "egresos", delta_egr["ACUMULADO"], claves_egr, ahora)
+        con.commit()
+    finally:
+        con.close()
+
+    # ---- Recombinar lo bloqueado con el delta ----
+    banco_out = _combinar(_aplicar_datos(banco[bloq_banco], datos_banco), banco_delta)
+    ingresos_out = _combinar(
+        _aplicar_datos(ingresos_acumulado[bloq_ing], datos_ing), delta_ing["ACUMULADO"]
+    )
+    egresos_out = _combinar(
+        _aplicar_datos(egresos_acumulado[bloq_egr], datos_egr), delta_egr["ACUMULADO"]
+    )
+
+    ingresos_sheets = dict(ingresos_sheets)
+    egresos_sheets = dict(egresos_sheets)
+    ingresos_sheets["ACUMULADO"] = mover_cancelados_al_final(ingresos_out)
+    egresos_sheets["ACUMULADO"] = mover_cancelados_al_final(egresos_out)
+
+    resumen = {
+        "Movimientos reutilizados": int(bloq_banco.sum()),
+        "Movimientos procesados": int((~bloq_banco).sum()),
+        "Ingresos reutilizados": int(bloq_ing.sum()),
+        "Egresos reutilizados": int(bloq_egr.sum()),
+        "CFDI guardados": n_ing + n_egr,
+    }
+
+    return banco_out, ingresos_sheets, egresos_sheets, resumen
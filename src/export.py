@@ -1,6 +1,19 @@
 import io
+import re
+import zipfile
 import pandas as pd
 
+from .preprocessing import to_money
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+#* Palabras que identifican columnas de dinero (se guardan como centavos enteros en Parquet)
+MONEY_COL_TOKENS = (
+    "CARGO", "ABONO", "TOTAL", "SUBTOTAL", "IMPORTE", "MONTO",
+    "SALDO", "IVA", "ISR", "DESCUENTO", "RETENCION", "RETENIDO"
+)
+
+
 def to_excel_bytes(df: pd.DataFrame, sheet_name="RESULTADO") -> bytes:
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
@@ -24,4 +37,139 @@ def to_excel_multiple_sheets(sheets: dict) -> bytes:
     with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
         for sheet_name, df in sheets.items():
             df.to_excel(writer, index=False, sheet_name=sheet_name)
-    return output.getvalue()
\ No newline at end of file
+    return output.getvalue()
+
+
+# =====================================
+# FORMATOS COLUMNARES (PARQUET / CSV)
+# =====================================
+def _es_columna_dinero(col) -> bool:
+    tokens = re.split(r"[^A-Z]+", str(col).upper())
+    return any(t in MONEY_COL_TOKENS for t in tokens)
+
+
+def _tipar_para_parquet(df: pd.DataFrame):
+    """
+    Devuelve una copia tipada para Parquet:
+    dinero -> Int64 en centavos, fechas -> datetime, texto -> string.
+    También regresa la lista de columnas guardadas en centavos.
+    """
+    out = df.copy()
+    out.columns = [str(c) for c in out.columns]
+    cols_centavos = []
+
+    for col in out.columns:
+        s = out[col]
+        no_vacio = s.notna() & (s.astype(str).str.strip() != "")
+
+        if _es_columna_dinero(col) and not pd.api.types.is_bool_dtype(s):
+            montos = to_money(s)
+            # Solo si TODOS los valores no vacíos son montos válidos
+            if montos[no_vacio].notna().all():
+                out[col] = (montos * 100).round().astype("Int64")
+                cols_centavos.append(col)
+                continue
+
+        if "FECHA" in col.upper() and not pd.api.types.is_datetime64_any_dtype(s):
+            fechas = pd.to_datetime(s.where(no_vacio), format="%d/%m/%Y", errors="coerce")
+            if no_vacio.any() and fechas[no_vacio].notna().all():
+                out[col] = fechas
+                continue
+
+        if s.dtype == object:
+            out[col] = s.astype("string").where(s.notna())
+
+    return out, cols_centavos
+
+
+def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Parquet tipado (requiere pyarrow). Los montos van en centavos enteros;
+    sus columnas quedan listadas en los metadatos 'montos_en_centavos'.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tipado, cols_centavos = _tipar_para_parquet(df)
+    table = pa.Table.from_pandas(tipado, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"montos_en_centavos"] = ",".join(cols_centavos).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+
+    output = io.BytesIO()
+    pq.write_table(table, output, compression="snappy")
+    return output.getvalue()
+
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    # utf-8-sig para que Excel respete acentos al abrir el CSV
+    return df.to_csv(index=False).encode("utf-8-sig")
+
+
+def _nombre_archivo(sheet_name) -> str:
+    return re.sub(r"[^\w\-]+", "_", str(sheet_name)).strip("_") or "HOJA"
+
+
+def _zip_por_hoja(sheets: dict, writer, extension: str) -> bytes:
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for sheet_name, df in sheets.items():
+            zf.writestr(f"{_nombre_archivo(sheet_name)}{extension}", writer(df))
+    return output.getvalue()
+
+
+def to_parquet_multiple_sheets(sheets: dict) -> bytes:
+    """ZIP con un archivo .parquet por hoja."""
+    return _zip_por_hoja(sheets, to_parquet_bytes, ".parquet")
+
+
+def to_csv_multiple_sheets(sheets: dict) -> bytes:
+    """ZIP con un archivo .csv por hoja."""
+    return _zip_por_hoja(sheets, to_csv_bytes, ".csv")
+
+
+# =====================================
+# REGISTRO DE FORMATOS DE SALIDA
+# =====================================
+FORMATOS_SALIDA = {
+    "xlsx": {
+        "una_hoja": lambda df, sheet_name: to_excel_bytes(df, sheet_name=sheet_name),
+        "varias_hojas": to_excel_multiple_sheets,
+        "ext": ".xlsx",
+        "ext_varias": ".xlsx",
+        "mime": XLSX_MIME,
+        "mime_varias": XLSX_MIME,
+    },
+    "parquet": {
+        "una_hoja": lambda df, sheet_name: to_parquet_bytes(df),
+        "varias_hojas": to_parquet_multiple_sheets,
+        "ext": ".parquet",
+        "ext_varias": ".parquet.zip",
+        "mime": "application/vnd.apache.parquet",
+        "mime_varias": "application/zip",
+    },
+    "csv": {
+        "una_hoja": lambda df, sheet_name: to_csv_bytes(df),
+        "varias_hojas": to_csv_multiple_sheets,
+        "ext": ".csv",
+        "ext_varias": ".csv.zip",
+        "mime": "text/csv",
+        "mime_varias": "application/zip",
+    },
+}
+
+
+def export_bytes(data, formato="xlsx", sheet_name="RESULTADO"):
+    """
+    Exporta un DataFrame (una hoja) o un dict de hojas al formato indicado.
+    Regresa (bytes, extension, mime).
+    """
+    if formato not in FORMATOS_SALIDA:
+        raise ValueError(f"Formato de salida no soportado: {formato}")
+
+    fmt = FORMATOS_SALIDA[formato]
+
+    if isinstance(data, dict):
+        return fmt["varias_hojas"](data), fmt["ext_varias"], fmt["mime_varias"]
+
+    return fmt["una_hoja"](data, sheet_name), fmt["ext"], fmt["mime"]
@@ -0,0 +1,271 @@
+"""
+Índice persistente de CFDI entre periodos (SQLite).
+
+Guarda cada CFDI visto (UUID, folio, total, emisión, estado de pago, importe pagado)
+por libro (INGRESOS / EGRESOS). Cada corrida lo actualiza en bloque y lo consulta por
+UUID o folio (índices B-tree, O(log n) por llave), así una nota de crédito o un
+complemento que apunta a una factura de meses anteriores se resuelve sin volver a
+subir el año completo.
+"""
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from .complementos import normalizar_folio
+from .preprocessing import to_money, to_date, clave_cfdi
+from .reconcile_ppd_complementos import COL_PAGADO_CP, COL_SALDO
+from .schema import resolver_columnas
+
+#* Estados que no pisan a uno ya cerrado en el índice (p. ej. una hoja re-subida sin actualizar)
+ESTADOS_ABIERTOS = ("", "NAN", "NO LOCALIZADO")
+
+_COLUMNA_HISTORICO = "_HISTORICO_"
+
+
+# =====================================
+# ALMACÉN
+# =====================================
+def abrir_indice(ruta: str) -> sqlite3.Connection:
+    con = sqlite3.connect(ruta)
+    con.executescript("""
+        CREATE TABLE IF NOT EXISTS cfdi (
+            libro TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            uuid TEXT NOT NULL,
+            folio TEXT NOT NULL,
+            total REAL,
+            fecha_emision TEXT,
+            estado TEXT NOT NULL,
+            fecha_pago TEXT,
+            pagado REAL,
+            folio_cp TEXT,
+            actualizado TEXT NOT NULL,
+            PRIMARY KEY (libro, clave)
+        );
+        CREATE INDEX IF NOT EXISTS cfdi_uuid ON cfdi (libro, uuid);
+        CREATE INDEX IF NOT EXISTS cfdi_folio ON cfdi (libro, folio);
+    """)
+    return con
+
+
+def _texto(series: pd.Series) -> pd.Series:
+    return series.fillna("").astype(str).str.strip().replace({"nan": "", "NaT": "", "None": ""})
+
+
+def _registros(df: pd.DataFrame) -> pd.DataFrame:
+    """Columnas del índice a partir de una hoja ACUMULADO (ya conciliada)."""
+    cols = resolver_columnas(df)
+    vacio = pd.Series("", index=df.index)
+
+    fecha = to_date(df[cols["doc.fecha_emision"]]) if cols["doc.fecha_emision"] else pd.Series(pd.NaT, index=df.index)
+    registros = pd.DataFrame({
+        "clave": clave_cfdi(df),
+        "uuid": _texto(df[cols["doc.uuid"]]).str.upper() if cols["doc.uuid"] else vacio,
+        "folio": normalizar_folio(_texto(df[cols["doc.folio"]])) if cols["doc.folio"] else vacio,
+        "total": to_money(df[cols["doc.total"] or cols["doc.monto"]]).abs() if (cols["doc.total"] or cols["doc.monto"]) else None,
+        "fecha_emision": fecha.dt.strftime("%Y-%m-%d"),
+        "estado": _texto(df[cols["doc.estado_pago"]]).str.upper() if cols["doc.estado_pago"] else vacio,
+        "fecha_pago": _texto(df[cols["doc.fecha_pago"]]) if cols["doc.fecha_pago"] else vacio,
+        "pagado": to_money(df[COL_PAGADO_CP]) if COL_PAGADO_CP in df.columns else None,
+        "folio_cp": _texto(df["FOLIO CP"]) if "FOLIO CP" in df.columns else vacio,
+    })
+    registros = registros[registros["clave"] != ""]
+    # Si una clave se repite en la hoja, manda la última fila
+    return registros.drop_duplicates("clave", keep="last")
+
+
+def actualizar_indice(con: sqlite3.Connection, libro: str, df: pd.DataFrame) -> int:
+    """Upsert en bloque de los CFDI de la hoja. Regresa cuántos se escribieron."""
+    registros = _registros(df)
+    if registros.empty:
+        return 0
+
+    registros = registros.astype(object).where(registros.notna(), None)
+    ahora = datetime.now().isoformat(timespec="seconds")
+    abiertos = ", ".join(f"'{e}'" for e in ESTADOS_ABIERTOS)
+
+    with con:
+        con.executemany(
+            f"""
+            INSERT INTO cfdi (libro, clave, uuid, folio, total, fecha_emision, estado, fecha_pago, pagado, folio_cp, actualizado)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (libro, clave) DO UPDATE SET
+                uuid = excluded.uuid,
+                folio = excluded.folio,
+                total = excluded.total,
+                fecha_emision = excluded.fecha_emision,
+                estado = CASE
+                    WHEN excluded.estado IN ({abiertos}) AND cfdi.estado NOT IN ({abiertos}) THEN cfdi.estado
+                    ELSE excluded.estado END,
+                fecha_pago = CASE
+                    WHEN excluded.estado IN ({abiertos}) AND cfdi.estado NOT IN ({abiertos}) THEN cfdi.fecha_pago
+                    ELSE excluded.fecha_pago END,
+                pagado = COALESCE(excluded.pagado, cfdi.pagado),
+                folio_cp = CASE WHEN excluded.folio_cp = '' THEN cfdi.folio_cp ELSE excluded.folio_cp END,
+                actualizado = excluded.actualizado
+            """,
+            [
+                (libro, *fila, ahora)
+                for fila in registros[
+                    ["clave", "uuid", "folio", "total", "fecha_emision", "estado", "fecha_pago", "pagado", "folio_cp"]
+                ].itertuples(index=False, name=None)
+            ],
+        )
+    return len(registros)
+
+
+def buscar(con: sqlite3.Connection, libro: str, columna: str, valores) -> pd.DataFrame:
+    """CFDI del índice cuyo 'uuid' o 'folio' está en 'valores' (join contra una tabla temporal)."""
+    if columna not in ("uuid", "folio"):
+        raise ValueError(f"Columna de búsqueda no válida: {columna}")
+
+    valores = sorted({v for v in valores if v})
+    if not valores:
+        return pd.DataFrame(columns=["uuid", "folio", "total", "fecha_emision", "estado", "fecha_pago", "pagado", "folio_cp"])
+
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS _buscar (valor TEXT PRIMARY KEY)")
+    con.execute("DELETE FROM _buscar")
+    con.executemany("INSERT INTO _buscar VALUES (?)", [(v,) for v in valores])
+    return pd.read_sql_query(
+        f"""
+        SELECT c.uuid, c.folio, c.total, c.fecha_emision, c.estado, c.fecha_pago, c.pagado, c.folio_cp
+        FROM _buscar b JOIN cfdi c ON c.libro = ? AND c.{columna} = b.valor
+        """,
+        con,
+        params=(libro,),
+    )
+
+
+# =====================================
+# NOTAS DE CRÉDITO (UUID RELACIONADO DE OTRO PERIODO)
+# =====================================
+def originales_de_notas(con: sqlite3.Connection, libro: str, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Facturas originales de las notas de la hoja que no vienen en la hoja.
+    Regresa un frame indexado por UUID con las columnas de la hoja (total, emisión, folio),
+    listo para conciliar_estado_cuenta_con_movimientos(historico_*=...).
+    """
+    cols = resolver_columnas(df)
+    if not cols["doc.uuid"] or not cols["doc.uuid_relacionados"]:
+        return None
+
+    en_hoja = set(_texto(df[cols["doc.uuid"]]).str.upper())
+    relacionados = set(_texto(df[cols["doc.uuid_relacionados"]]).str.upper()) - en_hoja
+    encontrados = buscar(con, libro, "uuid", relacionados)
+    if encontrados.empty:
+        return None
+
+    col_total = cols["doc.total"] or "TOTAL"
+    col_fecha = cols["doc.fecha_emision"] or "FECHA EMISION"
+    col_folio = cols["doc.folio"] or "FOLIO"
+    return pd.DataFrame({
+        col_total: encontrados["total"].to_numpy(),
+        col_fecha: pd.to_datetime(encontrados["fecha_emision"], errors="coerce").to_numpy(),
+        col_folio: encontrados["folio"].to_numpy(),
+    }, index=encontrados["uuid"].to_numpy())
+
+
+def cerrar_originales_por_notas(con: sqlite3.Connection, libro: str, df: pd.DataFrame) -> int:
+    """Las notas conciliadas dejan PAGADA su factura original en el índice (aunque no venga en la hoja)."""
+    cols = resolver_columnas(df)
+    if not all([cols["doc.estado_pago"], cols["doc.uuid_relacionados"]]):
+        return 0
+
+    estado = _texto(df[cols["doc.estado_pago"]]).str.upper()
+    notas = df[estado == "NOTA DE CREDITO"]
+    if notas.empty:
+        return 0
+
+    fecha_pago = _texto(notas[cols["doc.fecha_pago"]]) if cols["doc.fecha_pago"] else pd.Series("", index=notas.index)
+    pares = pd.DataFrame({
+        "uuid": _texto(notas[cols["doc.uuid_relacionados"]]).str.upper(),
+        "fecha_pago": fecha_pago,
+    })
+    pares = pares[pares["uuid"] != ""]
+
+    abiertos = ", ".join(f"'{e}'" for e in ESTADOS_ABIERTOS)
+    with con:
+        cursor = con.executemany(
+            f"""
+            UPDATE cfdi SET estado = 'PAGADO', fecha_pago = ?, actualizado = ?
+            WHERE libro = ? AND uuid = ? AND estado IN ({abiertos})
+            """,
+            [
+                (f, datetime.now().isoformat(timespec="seconds"), libro, u)
+                for u, f in pares[["uuid", "fecha_pago"]].itertuples(index=False, name=None)
+            ],
+        )
+    return cursor.rowcount
+
+
+# =====================================
+# COMPLEMENTOS (FOLIO DE OTRO PERIODO)
+# =====================================
+def agregar_historicos(con: sqlite3.Connection, libro: str, df: pd.DataFrame, complementos: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega a la hoja, marcadas con _HISTORICO_, las facturas del índice que aparecen en
+    COMPLEMENTOS y no vienen en la hoja; así la etapa PPD les aplica el libro de pagos
+    (PAGADO / PARCIAL / saldo) igual que a las del periodo. Se separan con separar_historicos.
+    """
+    cols = resolver_columnas(df)
+    cols_comp = resolver_columnas(complementos)
+    col_folio_doc = cols_comp["comp.folio_documento"]
+    if not cols["doc.folio"] or not col_folio_doc:
+        return df
+
+    folios = normalizar_folio(complementos[col_folio_doc].dropna()).str.split("-").explode().str.strip()
+    faltan = set(folios) - set(normalizar_folio(df[cols["doc.folio"]]))
+    encontrados = buscar(con, libro, "folio", faltan)
+    # Ya liquidadas en el índice: el complemento no les cambia nada
+    encontrados = encontrados[~encontrados["estado"].isin(["PAGADO", "CANCELADO", "NOTA DE CREDITO"])]
+    if encontrados.empty:
+        return df
+
+    # Mismas columnas (y orden) que crearía la etapa PPD, para traer lo ya pagado
+    df = df.copy()
+    for c in ("FOLIO CP", "FECHA CP", COL_PAGADO_CP, COL_SALDO):
+        if c not in df.columns:
+            df[c] = ""
+
+    historicos = pd.DataFrame(index=pd.RangeIndex(len(encontrados)), columns=df.columns)
+    for c in df.columns:
+        if pd.api.types.is_bool_dtype(df[c]):
+            historicos[c] = False
+
+    col_monto = cols["doc.monto"] or cols["doc.total"]
+    historicos[cols["doc.folio"]] = encontrados["folio"].to_numpy()
+    if col_monto:
+        historicos[col_monto] = encontrados["total"].to_numpy()
+    if cols["doc.uuid"]:
+        historicos[cols["doc.uuid"]] = encontrados["uuid"].to_numpy()
+    if cols["doc.fecha_emision"]:
+        historicos[cols["doc.fecha_emision"]] = pd.to_datetime(encontrados["fecha_emision"], errors="coerce").to_numpy()
+    if cols["doc.estado_pago"]:
+        historicos[cols["doc.estado_pago"]] = encontrados["estado"].to_numpy()
+    historicos[COL_PAGADO_CP] = encontrados["pagado"].to_numpy()
+    historicos["FOLIO CP"] = encontrados["folio_cp"].fillna("").to_numpy()
+
+    inicio = (df.index.max() + 1) if len(df) and pd.api.types.is_integer_dtype(df.index) else 0
+    historicos.index = pd.RangeIndex(inicio, inicio + len(historicos))
+    historicos[_COLUMNA_HISTORICO] = True
+
+    return pd.concat([df.assign(**{_COLUMNA_HISTORICO: False}), historicos])
+
+
+def separar_historicos(df: pd.DataFrame, tipos: dict = None):
+    """Regresa (hoja sin las filas agregadas, filas históricas). 'tipos': dtypes de la hoja original."""
+    if _COLUMNA_HISTORICO not in df.columns:
+        return df, df.iloc[0:0]
+
+    historico = df[_COLUMNA_HISTORICO].fillna(False).astype(bool)
+    tipos = tipos or {}
+    hoja = df.loc[~historico].drop(columns=[_COLUMNA_HISTORICO])
+    # El concat pudo cambiar tipos (enteros con NaN -> float): se regresan los de la hoja
+    for c, tipo in tipos.items():
+        if c in hoja.columns and hoja[c].dtype != tipo:
+            try:
+                hoja[c] = hoja[c].astype(tipo)
+            except (TypeError, ValueError):
+                pass
+    return hoja, df.loc[historico].drop(columns=[_COLUMNA_HISTORICO])
@@ -1,6 +1,488 @@
+import csv
+import io
+import os
+import re
+import zipfile
+from xml.etree import ElementTree
+
 import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from .config import CARGO_COL_CANDIDATES, FECHA_COL_CANDIDATES, DESCRIP_COL_CANDIDATES
+from .preprocessing import to_money, huella_banco
+from .schema import normalizar_columnas, resolver_columnas
+
+#* Filas que se revisan para encontrar el encabezado (los bancos ponen 5–12 de metadatos)
+HEADER_SCAN_ROWS = 30
+#* Movimientos por bloque al leer en streaming
+CHUNK_ROWS = 5000
+
+ABONO_COL_CANDIDATES = ["ABONO", "ABONOS", "CREDITO", "CRÉDITO", "DEPOSITO", "DEPÓSITO"]
+
+
+def _norm_header(v) -> str:
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return ""
+    return str(v).upper().strip()
+
+
+def _score_encabezado(valores) -> int:
+    """Cuántos grupos de columnas conocidas aparecen en la fila."""
+    celdas = {_norm_header(v) for v in valores}
+    grupos = [
+        FECHA_COL_CANDIDATES,
+        CARGO_COL_CANDIDATES,
+        ABONO_COL_CANDIDATES,
+        DESCRIP_COL_CANDIDATES,
+    ]
+    return sum(1 for g in grupos if celdas.intersection(g))
+
+
+def detectar_fila_encabezado(filas) -> int:
+    """
+    Regresa la posición de la fila que parece encabezado (FECHA + CARGO/ABONO/DESCRIPCION).
+    Si ninguna fila tiene al menos dos grupos, se asume la primera (comportamiento anterior).
+    """
+    mejor, mejor_score = 0, 1
+    for pos, valores in enumerate(filas):
+        score = _score_encabezado(valores)
+        if score > mejor_score:
+            mejor, mejor_score = pos, score
+    return mejor
+
+
+def _columnas_unicas(header) -> list:
+    cols, vistos = [], {}
+    for pos, v in enumerate(header):
+        nombre = _norm_header(v) or f"UNNAMED: {pos}"
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        cols.append(nombre)
+    return cols
+
+
+def _bloques(filas, columnas, chunk_size):
+    n = len(columnas)
+    bloque = []
+    for valores in filas:
+        if all(v is None or (isinstance(v, str) and not v.strip()) for v in valores):
+            continue
+        valores = tuple(valores[:n]) + (None,) * (n - len(valores))
+        bloque.append(valores)
+        if len(bloque) >= chunk_size:
+            yield pd.DataFrame.from_records(bloque, columns=columnas)
+            bloque = []
+    if bloque:
+        yield pd.DataFrame.from_records(bloque, columns=columnas)
+
+
+def iter_excel_chunks(file, chunk_size=CHUNK_ROWS, max_filas_encabezado=HEADER_SCAN_ROWS):
+    """
+    Lee la primera hoja en modo read-only de openpyxl (una sola pasada):
+    detecta el encabezado en las primeras filas y entrega los movimientos en bloques.
+    """
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        filas = ws.iter_rows(values_only=True)
+
+        inicio = []
+        for valores in filas:
+            inicio.append(valores)
+            if len(inicio) >= max_filas_encabezado:
+                break
+
+        if not inicio:
+            return
+
+        pos = detectar_fila_encabezado(inicio)
+        columnas = _columnas_unicas(inicio[pos])
+
+        def _movimientos():
+            yield from inicio[pos + 1:]
+            yield from filas
+
+        yield from _bloques(_movimientos(), columnas, chunk_size)
+    finally:
+        wb.close()
+
+
+def _read_excel_pandas(file, max_filas_encabezado=HEADER_SCAN_ROWS):
+    # Respaldo para formatos que openpyxl no abre (p. ej. .xls)
+    raw = pd.read_excel(file, header=None)
+    pos = detectar_fila_encabezado(raw.head(max_filas_encabezado).itertuples(index=False))
+    df = raw.iloc[pos + 1:].dropna(how="all").reset_index(drop=True)
+    df.columns = _columnas_unicas(raw.iloc[pos].tolist())
+    return df.infer_objects()
+
+
+def read_excel_any(file, chunk_size=CHUNK_ROWS):
+    try:
+        chunks = list(iter_excel_chunks(file, chunk_size=chunk_size))
+    except (InvalidFileException, zipfile.BadZipFile):
+        if hasattr(file, "seek"):
+            file.seek(0)
+        df = _read_excel_pandas(file)
+    else:
+        if chunks:
+            df = pd.concat(chunks, ignore_index=True)
+        else:
+            df = pd.DataFrame()
+
+    normalizar_columnas(df)
+    return df
+
+
+# =====================================
+# PARSERS DE ESTADO DE CUENTA (CSV / OFX / CAMT.053)
+# =====================================
+#* Columnas del frame bancario normalizado
+BANCO_COLUMNAS = ["FECHA", "CARGO", "ABONO", "DESCRIPCION", "REFERENCIA"]
+
+REFERENCIA_COL_CANDIDATES = ["REFERENCIA", "REF", "NO. REFERENCIA", "CLAVE DE RASTREO", "FOLIO"]
+
+#* extension -> parser(file) -> DataFrame
+STATEMENT_PARSERS = {}
+
+
+def register_parser(*extensiones):
+    def _wrap(fn):
+        for ext in extensiones:
+            STATEMENT_PARSERS[ext.lower()] = fn
+        return fn
+    return _wrap
+
+
+def _leer_bytes(file) -> bytes:
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "seek"):
+        file.seek(0)
+    data = file.read()
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+def _decodificar(data: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("latin-1")
+
+
+def _separar_importe(df: pd.DataFrame) -> pd.DataFrame:
+    """Una sola columna CARGO con signo → CARGO (negativos, en positivo) y ABONO."""
+    if "ABONO" not in df.columns and "CARGO" in df.columns:
+        montos = to_money(df["CARGO"])
+        if (montos < 0).any():
+            df["ABONO"] = montos.where(montos > 0)
+            df["CARGO"] = (-montos).where(montos < 0)
+    return df
+
+
+def _normalizar_banco(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Renombra las columnas reconocidas a FECHA/CARGO/ABONO/DESCRIPCION/REFERENCIA.
+    Si solo hay una columna de importe con signo, la separa en CARGO (negativos) y ABONO.
+    """
+    normalizar_columnas(df)
+
+    renombres = {}
+    for destino, candidatos in (
+        ("FECHA", FECHA_COL_CANDIDATES),
+        ("ABONO", ABONO_COL_CANDIDATES),
+        ("CARGO", CARGO_COL_CANDIDATES),
+        ("DESCRIPCION", DESCRIP_COL_CANDIDATES),
+        ("REFERENCIA", REFERENCIA_COL_CANDIDATES),
+    ):
+        if destino in df.columns:
+            continue
+        for c in candidatos:
+            if c in df.columns and c not in renombres:
+                renombres[c] = destino
+                break
+    df = _separar_importe(df.rename(columns=renombres))
+
+    for col in BANCO_COLUMNAS:
+        if col not in df.columns:
+            df[col] = pd.NA if col in ("CARGO", "ABONO") else ""
+
+    extras = [c for c in df.columns if c not in BANCO_COLUMNAS]
+    return df[BANCO_COLUMNAS + extras]
+
+
+def _frame_desde_montos(fechas, montos, descripciones, referencias) -> pd.DataFrame:
+    montos = pd.to_numeric(pd.Series(montos, dtype="object"), errors="coerce")
+    return pd.DataFrame({
+        "FECHA": pd.Series(fechas, dtype="datetime64[ns]"),
+        "CARGO": (-montos).where(montos < 0),
+        "ABONO": montos.where(montos > 0),
+        "DESCRIPCION": pd.Series(descripciones, dtype="object"),
+        "REFERENCIA": pd.Series(referencias, dtype="object"),
+    })
+
+
+_DECIMAL_COMA = re.compile(r"^-?\$?\s*\d{1,3}(\.\d{3})*,\d{1,2}$")
+
 
-def read_excel_any(file):
-    df = pd.read_excel(file)
-    df.columns = df.columns.astype(str).str.upper().str.strip()
+def _corregir_decimal_coma(df: pd.DataFrame) -> pd.DataFrame:
+    # Exportaciones con "1.234,50": se pasan a "1234.50" antes de to_money
+    for col in df.columns:
+        if col not in CARGO_COL_CANDIDATES + ABONO_COL_CANDIDATES + ["MONTO", "SALDO"]:
+            continue
+        s = df[col].dropna().astype(str).str.strip()
+        s = s[s != ""]
+        coma = s.str.match(_DECIMAL_COMA)
+        entero = s.str.match(r"^-?\d+$")
+        if coma.any() and (coma | entero).all():
+            df[col] = (
+                df[col].astype("string")
+                .str.replace(".", "", regex=False)
+                .str.replace(",", ".", regex=False)
+                .astype(object)
+            )
     return df
+
+
+@register_parser(".csv", ".txt")
+def read_csv_statement(file, max_filas_encabezado=HEADER_SCAN_ROWS) -> pd.DataFrame:
+    """CSV con detección de codificación, delimitador y fila de encabezado."""
+    texto = _decodificar(_leer_bytes(file))
+
+    muestra = "\n".join(texto.splitlines()[:max_filas_encabezado])
+    try:
+        delimitador = csv.Sniffer().sniff(muestra, delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimitador = ","
+
+    filas = list(csv.reader(io.StringIO(muestra), delimiter=delimitador))
+    pos = detectar_fila_encabezado(filas)
+
+    df = pd.read_csv(
+        io.StringIO(texto),
+        sep=delimitador,
+        skiprows=pos,
+        dtype=str,
+        skip_blank_lines=True,
+    ).dropna(how="all")
+
+    df.columns = _columnas_unicas(df.columns)
+    df = _normalizar_banco(_corregir_decimal_coma(df))
+    return df.reset_index(drop=True)
+
+
+_OFX_TRN = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.S | re.I)
+_OFX_TAG = re.compile(r"<(DTPOSTED|TRNAMT|NAME|MEMO|FITID|REFNUM|CHECKNUM)>([^<\r\n]*)", re.I)
+
+
+@register_parser(".ofx", ".qfx")
+def read_ofx_statement(file) -> pd.DataFrame:
+    """OFX 1.x (SGML) y 2.x (XML): se extraen los <STMTTRN> con regex en una pasada."""
+    texto = _decodificar(_leer_bytes(file))
+
+    registros = []
+    for bloque in _OFX_TRN.findall(texto):
+        campos = {k.upper(): v.strip() for k, v in _OFX_TAG.findall(bloque)}
+        registros.append(campos)
+
+    raw = pd.DataFrame.from_records(
+        registros,
+        columns=["DTPOSTED", "TRNAMT", "NAME", "MEMO", "FITID", "REFNUM", "CHECKNUM"]
+    )
+
+    fechas = pd.to_datetime(raw["DTPOSTED"].str.slice(0, 8), format="%Y%m%d", errors="coerce")
+    descripcion = raw["NAME"].fillna("")
+    memo = raw["MEMO"].fillna("")
+    descripcion = descripcion.where(memo == "", (descripcion + " " + memo).str.strip())
+    referencia = raw["REFNUM"].fillna(raw["CHECKNUM"]).fillna(raw["FITID"]).fillna("")
+
+    return _frame_desde_montos(fechas, raw["TRNAMT"], descripcion, referencia)
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+@register_parser(".xml")
+def read_camt053_statement(file) -> pd.DataFrame:
+    """ISO 20022 camt.053: lectura en streaming de cada <Ntry> con iterparse."""
+    data = _leer_bytes(file)
+
+    fechas, montos, descripciones, referencias = [], [], [], []
+
+    for _, elem in ElementTree.iterparse(io.BytesIO(data), events=("end",)):
+        if _local(elem.tag) != "Ntry":
+            continue
+
+        valores = {}
+        textos = []
+        for sub in elem.iter():
+            nombre = _local(sub.tag)
+            texto = (sub.text or "").strip()
+            if not texto:
+                continue
+            if nombre in ("Amt", "CdtDbtInd", "NtryRef", "AcctSvcrRef", "EndToEndId") and nombre not in valores:
+                valores[nombre] = texto
+            elif nombre in ("Dt", "DtTm") and "fecha" not in valores:
+                valores["fecha"] = texto
+            elif nombre in ("AddtlNtryInf", "Ustrd", "AddtlTxInf", "Nm"):
+                textos.append(texto)
+
+        monto = pd.to_numeric(valores.get("Amt"), errors="coerce")
+        if valores.get("CdtDbtInd") == "DBIT":
+            monto = -monto
+
+        fechas.append(valores.get("fecha", "")[:10])
+        montos.append(monto)
+        descripciones.append(" ".join(dict.fromkeys(textos)))
+        referencias.append(
+            valores.get("EndToEndId")
+            or valores.get("AcctSvcrRef")
+            or valores.get("NtryRef", "")
+        )
+
+        elem.clear()
+
+    fechas = pd.to_datetime(pd.Series(fechas, dtype="object"), format="%Y-%m-%d", errors="coerce")
+    return _frame_desde_montos(fechas, montos, descripciones, referencias)
+
+
+def _excel_statement(file) -> pd.DataFrame:
+    # Excel se entrega tal cual (mismos encabezados, orden e importes que antes):
+    # la conciliación ya resuelve las columnas por alias
+    return read_excel_any(file)
+
+
+for _ext in (".xlsx", ".xlsm", ".xls"):
+    STATEMENT_PARSERS[_ext] = _excel_statement
+
+
+def _detectar_extension(file, nombre=None) -> str:
+    nombre = nombre or getattr(file, "name", None) or (file if isinstance(file, (str, os.PathLike)) else "")
+    ext = os.path.splitext(str(nombre))[1].lower()
+    if ext in STATEMENT_PARSERS:
+        return ext
+
+    # Sin extensión conocida: revisar el contenido
+    cabeza = _leer_bytes(file)[:2048]
+    if cabeza.startswith(b"PK") or cabeza.startswith(b"\xd0\xcf\x11\xe0"):
+        return ".xlsx"
+    texto = cabeza.decode("latin-1").upper()
+    if "OFXHEADER" in texto or "<OFX>" in texto:
+        return ".ofx"
+    if "CAMT.053" in texto or "<BKTOCSTMT" in texto:
+        return ".xml"
+    return ".csv"
+
+
+def read_statement_any(file, nombre=None) -> pd.DataFrame:
+    """
+    Lee un estado de cuenta en cualquier formato registrado. CSV / OFX / CAMT.053
+    regresan el frame normalizado (FECHA, CARGO, ABONO, DESCRIPCION, REFERENCIA +
+    columnas extra); Excel conserva sus columnas originales.
+    """
+    ext = _detectar_extension(file, nombre)
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return STATEMENT_PARSERS[ext](file)
+
+
+# =====================================
+# VARIOS ESTADOS DE CUENTA (SIN DUPLICADOS)
+# =====================================
+#* rol -> columna del esquema común al unir estados de cuenta (en orden de prioridad)
+COLUMNAS_CANONICAS = {
+    "banco.fecha": "FECHA",
+    "banco.cargo": "CARGO",
+    "banco.abono": "ABONO",
+    "banco.descripcion": "DESCRIPCION",
+    "banco.referencia": "REFERENCIA",
+    "banco.saldo": "SALDO",
+}
+
+
+def _esquema_comun(df: pd.DataFrame, archivo: str) -> pd.DataFrame:
+    """
+    Renombra las columnas resueltas por rol a COLUMNAS_CANONICAS (cada columna a un
+    solo rol) para que dos layouts distintos del mismo banco se alineen al unirlos.
+    """
+    cols = resolver_columnas(df)
+    if not cols["banco.cargo"] and not cols["banco.abono"]:
+        # Solo un importe con signo (MONTO): se trata como cargo y se separa abajo
+        cols["banco.cargo"] = cols["banco.monto"]
+
+    if not cols["banco.fecha"]:
+        raise ValueError(f"El estado de cuenta '{archivo}' no tiene columna de fecha")
+    if not cols["banco.cargo"] and not cols["banco.abono"]:
+        raise ValueError(f"El estado de cuenta '{archivo}' no tiene columna de cargo, abono o importe")
+
+    renombres = {}
+    for rol, destino in COLUMNAS_CANONICAS.items():
+        col = cols[rol]
+        if col and col not in renombres:
+            renombres[col] = destino
+    df = _separar_importe(df.rename(columns=renombres))
+
+    for col in ("CARGO", "ABONO"):
+        if col not in df.columns:
+            df[col] = pd.NA
+    return df
+
+
+def merge_statements(files, nombres=None):
+    """
+    Une varios estados de cuenta que pueden traslaparse (meses repetidos,
+    exportaciones concatenadas a mano). Cada movimiento se identifica por su
+    huella (fecha, centavos, descripción, referencia y saldo si existe) más su
+    número de repetición dentro del archivo, así dos pagos idénticos del mismo
+    día en un archivo se conservan, pero el mismo movimiento en dos archivos no.
+    Antes se llevan todos al esquema común (FECHA, CARGO, ABONO, DESCRIPCION,
+    REFERENCIA, SALDO); un archivo sin fecha o sin importe es un error.
+    Regresa (banco, duplicados) donde duplicados trae ARCHIVO y FILA_ORIGEN.
+    """
+    nombres = list(nombres) if nombres is not None else [None] * len(files)
+    frames = []
+    for file, nombre in zip(files, nombres):
+        df = read_statement_any(file, nombre)
+        df = df.loc[:, ~df.columns.str.contains("^UNNAMED", case=False)]
+        normalizar_columnas(df)
+        etiqueta = os.path.basename(str(nombre or getattr(file, "name", None) or str(file)))
+        frames.append((etiqueta, _esquema_comun(df, etiqueta)))
+
+    if not frames:
+        raise ValueError("No se recibió ningún estado de cuenta")
+
+    # La huella usa los roles del esquema común presentes en todos los archivos
+    # (FECHA, CARGO y ABONO siempre; OFX no trae saldo, p. ej.)
+    comunes = [
+        c for c in COLUMNAS_CANONICAS.values()
+        if all(c in df.columns for _, df in frames)
+    ]
+
+    partes = []
+    for archivo, df in frames:
+        partes.append(
+            df.assign(
+                _HUELLA_=huella_banco(df[comunes]).to_numpy(),
+                _ARCHIVO_=archivo,
+                _FILA_=range(len(df)),
+            )
+        )
+    todo = pd.concat(partes, ignore_index=True)
+
+    repetido = todo["_HUELLA_"].duplicated(keep="first")
+    duplicados = (
+        todo[repetido]
+        .rename(columns={"_ARCHIVO_": "ARCHIVO", "_FILA_": "FILA_ORIGEN"})
+        .drop(columns=["_HUELLA_"])
+        .reset_index(drop=True)
+    )
+    banco = todo[~repetido].drop(columns=["_HUELLA_", "_ARCHIVO_", "_FILA_"]).reset_index(drop=True)
+
+    return banco, duplicados
@@ -0,0 +1,278 @@
+"""
+Conciliación por mes (fuera de memoria) para estados de cuenta anuales.
+
+El banco y los ACUMULADO se parten por mes en archivos Parquet temporales.
+Cada mes se concilia por separado con los CFDI de ese mes más los pendientes
+de una ventana de arrastre (pagos tardíos), y al final se unen los resultados.
+La memoria máxima depende del mes más grande, no del año completo.
+"""
+import os
+import tempfile
+
+import pandas as pd
+
+from .pipeline import conciliar, hojas_acumulado
+from .estado_conciliacion import ESTADOS_BLOQUEADOS
+from .preprocessing import to_date
+from .schema import resolver_columnas
+from .utils_orden import mover_cancelados_al_final
+
+#* Días hacia atrás que un CFDI pendiente sigue participando en los meses siguientes
+DIAS_ARRASTRE = 45
+
+_SIN_FECHA = "SIN_FECHA"
+
+
+# =====================================
+# SPILL A PARQUET
+# =====================================
+def _escribir(df: pd.DataFrame, ruta: str):
+    try:
+        df.to_parquet(ruta)
+    except Exception:
+        # Columnas object con tipos mezclados (p. ej. FOLIO numérico y texto): a texto nullable
+        mezcladas = {
+            c: "string"
+            for c in df.columns
+            if df[c].dtype == object and df[c].dropna().map(type).nunique() > 1
+        }
+        df.astype(mezcladas).to_parquet(ruta)
+
+
+def _mes(fechas: pd.Series) -> pd.Series:
+    return to_date(fechas).dt.strftime("%Y-%m").fillna(_SIN_FECHA)
+
+
+def _partir(df: pd.DataFrame, meses: pd.Series, directorio: str, prefijo: str) -> dict:
+    """Escribe un Parquet por mes y regresa {mes: ruta}."""
+    rutas = {}
+    for mes, parte in df.groupby(meses, sort=True):
+        ruta = os.path.join(directorio, f"{prefijo}_{mes}.parquet")
+        _escribir(parte, ruta)
+        rutas[mes] = ruta
+    return rutas
+
+
+def _fecha_libro(df: pd.DataFrame) -> pd.Series:
+    cols = resolver_columnas(df)
+    col = cols["doc.fecha_emision"] or cols["doc.fecha"]
+    return df[col] if col else pd.Series(pd.NaT, index=df.index)
+
+
+def _meses_ventana(mes: str, meses: list, dias: int) -> list:
+    """Meses cuyo rango toca [inicio(mes) - dias, fin(mes)], más los CFDI sin fecha."""
+    periodo = pd.Period(mes, freq="M")
+    desde = (periodo.start_time - pd.Timedelta(days=dias)).to_period("M")
+    dentro = [m for m in meses if m != _SIN_FECHA and desde <= pd.Period(m, freq="M") <= periodo]
+    return dentro + ([_SIN_FECHA] if _SIN_FECHA in meses else [])
+
+
+def _pendientes_libro(rutas: dict, meses: list, resueltos: set) -> pd.DataFrame:
+    partes = [pd.read_parquet(rutas[m]) for m in meses if m in rutas]
+    if not partes:
+        # Mismo layout aunque no haya CFDI en la ventana (las etapas buscan columnas)
+        return pd.read_parquet(next(iter(rutas.values()))).iloc[:0] if rutas else pd.DataFrame()
+    df = pd.concat(partes)
+    return df[~df.index.isin(resueltos)]
+
+
+def _resueltos(df: pd.DataFrame) -> pd.Index:
+    col = resolver_columnas(df)["doc.estado_pago"]
+    if not col:
+        return df.index[:0]
+    estado = df[col].astype(str).str.upper().str.strip()
+    return df.index[estado.isin(ESTADOS_BLOQUEADOS)]
+
+
+def _parciales(df: pd.DataFrame) -> pd.DataFrame:
+    """CFDI con pago PARCIAL: siguen pendientes, pero con lo ya pagado (saldo insoluto)."""
+    col = resolver_columnas(df)["doc.estado_pago"]
+    if not col:
+        return df.iloc[:0]
+    return df[df[col].astype(str).str.upper().str.strip() == "PARCIAL"]
+
+
+def _con_parciales(df: pd.DataFrame, parciales: pd.DataFrame) -> pd.DataFrame:
+    """Sustituye las filas de 'df' por su último resultado PARCIAL (para acumular parcialidades)."""
+    previos = parciales[parciales.index.isin(df.index)]
+    if previos.empty:
+        return df
+    return pd.concat([df[~df.index.isin(previos.index)], previos]).sort_index(kind="stable")
+
+
+def _unir_parciales(anteriores: pd.DataFrame, nuevos: pd.DataFrame, resueltos: set) -> pd.DataFrame:
+    df = pd.concat([anteriores, nuevos]) if not anteriores.empty else nuevos
+    df = df[~df.index.duplicated(keep="last")]
+    return df[~df.index.isin(resueltos)]
+
+
+def _complementos_del_mes(complementos, mes, dias, aplicados):
+    """Complementos con fecha de CP cerca del mes (se emiten después del pago) y aún sin aplicar."""
+    if complementos is None or complementos.empty:
+        return complementos
+    cols = resolver_columnas(complementos)
+    mask = pd.Series(True, index=complementos.index)
+
+    if cols["comp.fecha_cp"] and mes != _SIN_FECHA:
+        fechas = to_date(complementos[cols["comp.fecha_cp"]])
+        periodo = pd.Period(mes, freq="M")
+        inicio = periodo.start_time - pd.Timedelta(days=dias)
+        fin = periodo.end_time + pd.Timedelta(days=dias)
+        mask = fechas.isna() | fechas.between(inicio, fin)
+    if cols["comp.folio"] and aplicados:
+        mask &= ~complementos[cols["comp.folio"]].astype(str).str.strip().isin(aplicados)
+
+    return complementos[mask]
+
+
+def _folios_cp_aplicados(banco_out: pd.DataFrame) -> set:
+    col = resolver_columnas(banco_out)["banco.folio_cp"]
+    if not col:
+        return set()
+    folios = banco_out[col].fillna("").astype(str).str.strip()
+    return set(folios[folios != ""])
+
+
+def _concatenar(partes: list) -> pd.DataFrame:
+    # Sin frames vacíos: pandas advierte (FutureWarning) al concatenarlos
+    partes = [p for p in partes if not p.empty]
+    if not partes:
+        return pd.DataFrame()
+    return pd.concat(partes) if len(partes) > 1 else partes[0]
+
+
+def _no_procesados(rutas: dict, meses_procesados: set) -> list:
+    """
+    CFDI que nunca entraron a un mes con movimientos. Todo lo de un mes que tocó una
+    ventana procesada ya viene en los resultados, así que solo se leen los otros meses.
+    """
+    return [pd.read_parquet(ruta) for mes, ruta in rutas.items() if mes not in meses_procesados]
+
+
+def _unir(rutas: list) -> pd.DataFrame:
+    df = _concatenar([pd.read_parquet(r) for r in rutas])
+    if df.empty:
+        return df
+    # Un CFDI pendiente pasa por varios meses: vale su último resultado
+    df = df[~df.index.duplicated(keep="last")]
+    return df.sort_index(kind="stable")
+
+
+# =====================================
+# CORRIDA POR MES
+# =====================================
+def conciliar_por_mes(
+    ingresos_sheets: dict,
+    egresos_sheets: dict,
+    banco: pd.DataFrame,
+    tolerancia: float = 0.01,
+    dias_arrastre: int = DIAS_ARRASTRE,
+    directorio: str = None,
+    motor: str = None,
+    backend: str = None,
+):
+    """
+    Igual que pipeline.conciliar, pero mes por mes con archivos Parquet temporales.
+    Un CFDI participa en su mes de emisión y, mientras siga pendiente, en los meses
+    cuyo inicio esté a menos de 'dias_arrastre' días. Las notas de crédito solo
+    encuentran su factura relacionada si ambas caen en la misma ventana.
+    Regresa (banco_out, ingresos_sheets, egresos_sheets).
+    """
+    ingresos_acumulado, egresos_acumulado = hojas_acumulado(ingresos_sheets, egresos_sheets)
+    hoja_egr = "ACUMULADO" if "ACUMULADO" in egresos_sheets else "EGRESOS"
+
+    col_fecha_banco = resolver_columnas(banco)["banco.fecha"]
+    if not col_fecha_banco:
+        raise ValueError("Banco: falta columna FECHA")
+
+    temporal = None
+    if directorio is None:
+        temporal = tempfile.TemporaryDirectory(prefix="conciliacion_")
+        directorio = temporal.name
+    os.makedirs(directorio, exist_ok=True)
+
+    try:
+        # ---- Partir y soltar los frames completos ----
+        rutas_banco = _partir(banco, _mes(banco[col_fecha_banco]), directorio, "banco")
+        rutas_ing = _partir(ingresos_acumulado, _mes(_fecha_libro(ingresos_acumulado)), directorio, "ingresos")
+        rutas_egr = _partir(egresos_acumulado, _mes(_fecha_libro(egresos_acumulado)), directorio, "egresos")
+        del banco, ingresos_acumulado, egresos_acumulado
+
+        meses_libros = sorted(set(rutas_ing) | set(rutas_egr))
+        meses = sorted((set(rutas_banco) | set(meses_libros)) - {_SIN_FECHA})
+
+        resueltos_ing, resueltos_egr = set(), set()
+        meses_procesados = set()
+        parciales_ing, parciales_egr = pd.DataFrame(), pd.DataFrame()
+        aplicados_ing, aplicados_egr = set(), set()
+        salidas_banco, salidas_ing, salidas_egr = [], [], []
+
+        pasos = [(mes, _meses_ventana(mes, meses_libros, dias_arrastre)) for mes in meses]
+        if _SIN_FECHA in rutas_banco:
+            # Movimientos sin fecha: al final, contra todo lo que siga pendiente
+            pasos.append((_SIN_FECHA, meses_libros))
+
+        for mes, ventana in pasos:
+            if mes not in rutas_banco:
+                # Sin movimientos: los CFDI del mes siguen pendientes para los meses siguientes
+                continue
+
+            banco_mes = pd.read_parquet(rutas_banco[mes])
+            meses_procesados.update(ventana)
+            ing_mes = _con_parciales(_pendientes_libro(rutas_ing, ventana, resueltos_ing), parciales_ing)
+            egr_mes = _con_parciales(_pendientes_libro(rutas_egr, ventana, resueltos_egr), parciales_egr)
+
+            ing_sheets = dict(ingresos_sheets, ACUMULADO=ing_mes)
+            egr_sheets = dict(egresos_sheets)
+            egr_sheets[hoja_egr] = egr_mes
+            if "COMPLEMENTOS" in ing_sheets:
+                ing_sheets["COMPLEMENTOS"] = _complementos_del_mes(
+                    ing_sheets["COMPLEMENTOS"], mes, dias_arrastre, aplicados_ing
+                )
+            if "COMPLEMENTOS" in egr_sheets:
+                egr_sheets["COMPLEMENTOS"] = _complementos_del_mes(
+                    egr_sheets["COMPLEMENTOS"], mes, dias_arrastre, aplicados_egr
+                )
+
+            banco_out, ing_sheets, egr_sheets = conciliar(
+                ingresos_sheets=ing_sheets,
+                egresos_sheets=egr_sheets,
+                banco=banco_mes,
+                tolerancia=tolerancia,
+                motor=motor,
+                backend=backend,
+            )
+
+            aplicados_cp = _folios_cp_aplicados(banco_out)
+            aplicados_ing |= aplicados_cp
+            aplicados_egr |= aplicados_cp
+            resueltos_ing.update(_resueltos(ing_sheets["ACUMULADO"]))
+            resueltos_egr.update(_resueltos(egr_sheets["ACUMULADO"]))
+            parciales_ing = _unir_parciales(parciales_ing, _parciales(ing_sheets["ACUMULADO"]), resueltos_ing)
+            parciales_egr = _unir_parciales(parciales_egr, _parciales(egr_sheets["ACUMULADO"]), resueltos_egr)
+
+            for salidas, df, prefijo in (
+                (salidas_banco, banco_out, "res_banco"),
+                (salidas_ing, ing_sheets["ACUMULADO"], "res_ingresos"),
+                (salidas_egr, egr_sheets["ACUMULADO"], "res_egresos"),
+            ):
+                ruta = os.path.join(directorio, f"{prefijo}_{mes}.parquet")
+                _escribir(df, ruta)
+                salidas.append(ruta)
+
+            del banco_mes, ing_mes, egr_mes, banco_out, ing_sheets, egr_sheets
+
+        banco_out = _unir(salidas_banco)
+        # CFDI que nunca entraron a un mes con movimientos quedan como estaban
+        ingresos_out = _concatenar([_unir(salidas_ing)] + _no_procesados(rutas_ing, meses_procesados))
+        egresos_out = _concatenar([_unir(salidas_egr)] + _no_procesados(rutas_egr, meses_procesados))
+    finally:
+        if temporal is not None:
+            temporal.cleanup()
+
+    ingresos_sheets = dict(ingresos_sheets)
+    egresos_sheets = dict(egresos_sheets)
+    ingresos_sheets["ACUMULADO"] = mover_cancelados_al_final(ingresos_out.sort_index(kind="stable"))
+    egresos_sheets["ACUMULADO"] = mover_cancelados_al_final(egresos_out.sort_index(kind="stable"))
+
+    return mover_cancelados_al_final(banco_out), ingresos_sheets, egresos_sheets
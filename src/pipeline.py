@@ -0,0 +1,562 @@
+"""
+Cadena de conciliación sin interfaz (la misma que usa app.py).
+
+Uso headless:
+    python -m src.pipeline --ingresos INGRESOS.xlsx --egresos EGRESOS.xlsx \
+        --banco BANCO.xlsx --salida resultados --formato xlsx parquet csv
+"""
+import argparse
+import os
+
+import pandas as pd
+
+from .loaders import read_statement_any, merge_statements
+from .export import export_bytes, FORMATOS_SALIDA
+from .candidatos import MOTORES
+from .schema import normalizar_columnas, proyectar, reunir
+from .preprocessing import (
+    codificar_catalogos,
+    quitar_banderas,
+    usar_backend,
+    clasificar_cargos_bancarios,
+    anotar_cargos_bancarios,
+    BANDERA_CARGO_BANCARIO,
+    BANDERAS,
+    BACKENDS,
+)
+
+from .reconcile_estado_cuenta import conciliar_estado_cuenta_con_movimientos
+from .reconcile_ppd_complementos import conciliar_ppd_desde_complementos
+from .reconcile_ingresos_abonos import conciliar_ingresos_con_abonos
+from .reconcile_publico_general import conciliar_publico_en_general_subset
+from .reconcile_grupos_cliente import conciliar_abonos_multifactura
+from .complementos import agrupar_complementos_por_folio
+from .compartido import mapa_en_procesos, compactar
+from .similitud import cargar_cache, guardar_cache
+from .progreso import iniciar_etapa
+from .spei import extraer_campos_spei, quitar_campos_spei
+from .puntos_control import huella_corrida, guardar_punto, ultimo_punto, descartar_puntos
+
+
+NOMBRE_BANCO = "ESTADO_CUENTA_CONCILIADO"
+NOMBRE_INGRESOS = "INGRESOS_ACTUALIZADOS"
+NOMBRE_EGRESOS = "EGRESOS_ACTUALIZADOS"
+
+
+def leer_hojas(file) -> dict:
+    """Lee todas las hojas de un libro con encabezados normalizados."""
+    xls = pd.ExcelFile(file)
+    sheets = {}
+
+    for sheet in xls.sheet_names:
+        df = xls.parse(sheet)
+        normalizar_columnas(df)
+        df = df.loc[:, ~df.columns.str.contains("^UNNAMED", case=False)]
+        sheets[sheet] = df
+
+    return sheets
+
+
+def leer_banco(file) -> pd.DataFrame:
+    banco = read_statement_any(file)
+    banco = banco.loc[:, ~banco.columns.str.contains("^UNNAMED", case=False)]
+    normalizar_columnas(banco)
+    return banco
+
+
+def leer_bancos(files):
+    """
+    Uno o varios estados de cuenta (pueden traslaparse).
+    Regresa (banco, duplicados_descartados).
+    """
+    if len(files) == 1:
+        return leer_banco(files[0]), pd.DataFrame()
+    return merge_statements(files)
+
+
+def hojas_acumulado(ingresos_sheets: dict, egresos_sheets: dict):
+    """Regresa (ingresos_acumulado, egresos_acumulado)."""
+    if "ACUMULADO" not in ingresos_sheets:
+        raise ValueError("El archivo de INGRESOS debe tener una hoja llamada 'ACUMULADO'")
+
+    if "ACUMULADO" in egresos_sheets:
+        return ingresos_sheets["ACUMULADO"], egresos_sheets["ACUMULADO"]
+    if "EGRESOS" in egresos_sheets:
+        return ingresos_sheets["ACUMULADO"], egresos_sheets["EGRESOS"]
+
+    raise ValueError("El archivo de EGRESOS debe tener una hoja llamada 'ACUMULADO'")
+
+
+def conciliar(
+    ingresos_sheets: dict,
+    egresos_sheets: dict,
+    banco: pd.DataFrame,
+    tolerancia: float = 0.01,
+    motor: str = None,
+    backend: str = None,
+    indice: str = None,
+    puntos_control: str = None,
+):
+    """
+    Ejecuta todas las etapas de conciliación.
+    motor: "pandas", "duckdb" o "polars" para generar candidatos (None = config.MOTOR_CANDIDATOS).
+    backend: "pandas" o "polars" para limpiar montos/fechas (None = config.BACKEND).
+    indice: SQLite con los CFDI de periodos anteriores (notas y complementos que los referencian);
+            se actualiza al terminar.
+    puntos_control: directorio donde se guarda cada etapa terminada; una corrida con las mismas
+            entradas y parámetros que se cayó o se canceló sigue desde la última etapa guardada.
+    Regresa (banco_out, ingresos_sheets, egresos_sheets) con ACUMULADO reemplazado.
+    """
+    puntos = None
+    if puntos_control:
+        puntos = (puntos_control, huella_corrida(
+            ingresos_sheets, egresos_sheets, banco,
+            tolerancia=tolerancia, motor=motor, backend=backend, indice=indice,
+        ))
+
+    with usar_backend(backend):
+        if not indice:
+            resultado = _ejecutar_etapas(ingresos_sheets, egresos_sheets, banco, tolerancia, motor, puntos=puntos)
+        else:
+            from .indice_cfdi import abrir_indice
+
+            con = abrir_indice(indice)
+            try:
+                resultado = _ejecutar_etapas(
+                    ingresos_sheets, egresos_sheets, banco, tolerancia, motor, indice=con, puntos=puntos
+                )
+            finally:
+                con.close()
+
+    descartar_puntos(puntos)
+    return resultado
+
+
+def conciliar_en_cascada(
+    ingresos_sheets: dict,
+    egresos_sheets: dict,
+    banco: pd.DataFrame,
+    tolerancia: float = 0.01,
+    motor: str = None,
+    backend: str = None,
+):
+    """
+    Como conciliar, pero primero resuelve por referencia (folio/UUID) y por monto y fecha
+    exactos; las etapas solo reciben el residuo. Regresa además el conteo por nivel.
+    """
+    from .cascada import ejecutar_en_cascada
+
+    with usar_backend(backend):
+        return ejecutar_en_cascada(ingresos_sheets, egresos_sheets, banco, tolerancia, motor, _ejecutar_etapas)
+
+
+# =====================================
+# VARIAS CORRIDAS EN PROCESOS (FRAMES COMPARTIDOS)
+# =====================================
+#* Columnas que regresa cada corrida en paralelo (lo demás se queda en el worker)
+COLUMNAS_RESULTADO = {
+    "banco": ["FOLIO FACTURA", "OBSERVACIONES"],
+    "ingresos": ["ESTADO DE PAGO"],
+    "egresos": ["ESTADO DE PAGO"],
+}
+
+
+def _hojas_compartidas(frames: dict, libro: str) -> dict:
+    prefijo = f"{libro}."
+    return {k[len(prefijo):]: v for k, v in frames.items() if k.startswith(prefijo)}
+
+
+def _conciliar_compartido(frames: dict, tarea: dict) -> dict:
+    """Worker: concilia sobre los frames adjuntos y regresa solo columnas compactas."""
+    banco_out, ingresos_sheets, egresos_sheets = conciliar(
+        ingresos_sheets=_hojas_compartidas(frames, "ingresos"),
+        egresos_sheets=_hojas_compartidas(frames, "egresos"),
+        banco=frames["banco"],
+        **tarea,
+    )
+    salidas = {
+        "banco": banco_out,
+        "ingresos": ingresos_sheets["ACUMULADO"],
+        "egresos": hojas_acumulado(ingresos_sheets, egresos_sheets)[1],
+    }
+    return {
+        f"{nombre}.{col}": (salidas[nombre].index.to_numpy(), compactar(salidas[nombre][col]))
+        for nombre, columnas in COLUMNAS_RESULTADO.items()
+        for col in columnas
+        if col in salidas[nombre].columns
+    }
+
+
+def conciliar_en_procesos(
+    ingresos_sheets: dict,
+    egresos_sheets: dict,
+    banco: pd.DataFrame,
+    tareas: list,
+    procesos: int = None,
+):
+    """
+    Varias corridas independientes (p. ej. una por tolerancia) en un pool de procesos.
+    Banco, ACUMULADO y COMPLEMENTOS se publican una vez como Arrow IPC mapeado en memoria;
+    cada tarea es un dict de argumentos de conciliar (tolerancia, motor, backend).
+    Regresa una lista (en el orden de 'tareas') de {"libro.columna": (índice, categórico)}.
+    """
+    hojas_etapas = ("ACUMULADO", "EGRESOS", "COMPLEMENTOS")
+    frames = {"banco": banco}
+    for libro, sheets in (("ingresos", ingresos_sheets), ("egresos", egresos_sheets)):
+        for hoja in hojas_etapas:
+            if hoja in sheets:
+                frames[f"{libro}.{hoja}"] = sheets[hoja]
+
+    return mapa_en_procesos(_conciliar_compartido, frames, tareas, procesos=procesos)
+
+
+#* Etapas de la cadena, en orden (para reportar progreso)
+ETAPAS = (
+    "Estado de cuenta",
+    "PPD ingresos",
+    "PPD egresos",
+    "Ingresos vs abonos",
+    "Público en general",
+    "Abonos multifactura",
+)
+
+
+def _ejecutar_etapas(ingresos_sheets, egresos_sheets, banco, tolerancia, motor, indice=None, puntos=None):
+    ingresos_acumulado, egresos_acumulado = hojas_acumulado(ingresos_sheets, egresos_sheets)
+
+    # Banderas de catálogo (PPD, PUE, EFECTIVO, CANCELADO, ...) una sola vez para todas las etapas
+    ingresos_acumulado = ingresos_acumulado.copy()
+    egresos_acumulado = egresos_acumulado.copy()
+    codificar_catalogos(ingresos_acumulado)
+    codificar_catalogos(egresos_acumulado)
+    # Las etapas trabajan solo con las columnas que usan; el resto se reúne al final por fila
+    ingresos_ancho, ingresos_acumulado = proyectar(ingresos_acumulado, extra=BANDERAS)
+    egresos_ancho, egresos_acumulado = proyectar(egresos_acumulado, extra=BANDERAS)
+    ingresos_complementos = ingresos_sheets.get("COMPLEMENTOS")
+    egresos_complementos = egresos_sheets.get("COMPLEMENTOS")
+
+    # Comisiones, IVA de comisiones, ISR retenido e intereses: ninguna etapa los usa y se reportan al final
+    banco = banco.copy()
+    normalizar_columnas(banco)
+    banco[BANDERA_CARGO_BANCARIO] = clasificar_cargos_bancarios(banco)
+    # Rastreo, RFC, CLABE, folio y referencia de la descripción SPEI (llaves para joins exactos)
+    banco = banco.join(extraer_campos_spei(banco))
+
+    # Corrida anterior interrumpida con las mismas entradas: se sigue desde la última etapa guardada
+    hecho = 0
+    guardado = ultimo_punto(puntos)
+    if guardado is not None:
+        hecho, banco_out, ingresos_out, egresos_out = guardado
+
+    if indice is not None:
+        from . import indice_cfdi
+
+    # 1) Estado de cuenta ↔ Ingresos + Egresos
+    if hecho < 1:
+        # Facturas de periodos anteriores que referencian las notas de esta corrida
+        historico_ingresos = historico_egresos = None
+        if indice is not None:
+            historico_ingresos = indice_cfdi.originales_de_notas(indice, "INGRESOS", ingresos_acumulado)
+            historico_egresos = indice_cfdi.originales_de_notas(indice, "EGRESOS", egresos_acumulado)
+
+        iniciar_etapa(ETAPAS[0], 1, len(ETAPAS))
+        banco_out, ingresos_out, egresos_out = conciliar_estado_cuenta_con_movimientos(
+            banco=banco,
+            ingresos=ingresos_acumulado,
+            egresos=egresos_acumulado,
+            tolerancia=tolerancia,
+            motor=motor,
+            historico_ingresos=historico_ingresos,
+            historico_egresos=historico_egresos,
+        )
+        guardar_punto(puntos, 1, banco_out, ingresos_out, egresos_out)
+
+    # 2) PPD desde COMPLEMENTOS
+    if hecho < 2:
+        iniciar_etapa(ETAPAS[1], 2, len(ETAPAS))
+        if ingresos_complementos is not None and not ingresos_complementos.empty:
+            complementos_agrupados = agrupar_complementos_por_folio(
+                ingresos_complementos
+            )
+
+            if indice is not None:
+                tipos = ingresos_out.dtypes.to_dict()
+                ingresos_out = indice_cfdi.agregar_historicos(indice, "INGRESOS", ingresos_out, ingresos_complementos)
+
+            banco_out, ingresos_out = conciliar_ppd_desde_complementos(
+                ingresos_acumulado=ingresos_out,
+                complementos=complementos_agrupados,
+                banco=banco_out,
+                tolerancia=tolerancia,
+                tipo_movimiento="ABONO",
+                motor=motor,
+                detalle=ingresos_complementos,
+            )
+
+            if indice is not None:
+                ingresos_out, historicos = indice_cfdi.separar_historicos(ingresos_out, tipos)
+                indice_cfdi.actualizar_indice(indice, "INGRESOS", historicos)
+        guardar_punto(puntos, 2, banco_out, ingresos_out, egresos_out)
+
+    # ✅ 2B) PPD desde COMPLEMENTOS (EGRESOS)
+    if hecho < 3:
+        iniciar_etapa(ETAPAS[2], 3, len(ETAPAS))
+        if egresos_complementos is not None and not egresos_complementos.empty:
+            complementos_agrupados_egr = agrupar_complementos_por_folio(egresos_complementos)
+
+            if indice is not None:
+                tipos = egresos_out.dtypes.to_dict()
+                egresos_out = indice_cfdi.agregar_historicos(indice, "EGRESOS", egresos_out, egresos_complementos)
+
+            banco_out, egresos_out = conciliar_ppd_desde_complementos(
+                ingresos_acumulado=egresos_out,          # (sí, aquí va egresos_out)
+                complementos=complementos_agrupados_egr,
+                banco=banco_out,
+                tolerancia=tolerancia,
+                tipo_movimiento="CARGO",                 # 🔥 CLAVE
+                motor=motor,
+                detalle=egresos_complementos,
+            )
+
+            if indice is not None:
+                egresos_out, historicos = indice_cfdi.separar_historicos(egresos_out, tipos)
+                indice_cfdi.actualizar_indice(indice, "EGRESOS", historicos)
+        guardar_punto(puntos, 3, banco_out, ingresos_out, egresos_out)
+
+    # 3) Ingresos directos vs ABONOS
+    if hecho < 4:
+        iniciar_etapa(ETAPAS[3], 4, len(ETAPAS))
+        ingresos_out = conciliar_ingresos_con_abonos(
+            ingresos=ingresos_out,
+            banco=banco_out,
+            tolerancia=tolerancia
+        )
+        guardar_punto(puntos, 4, banco_out, ingresos_out, egresos_out)
+
+    # 4) Público en General → SUMA de ABONOS
+    if hecho < 5:
+        iniciar_etapa(ETAPAS[4], 5, len(ETAPAS))
+        ingresos_out, banco_out = conciliar_publico_en_general_subset(
+            ingresos=ingresos_out,
+            banco=banco_out,
+            tolerancia=tolerancia
+        )
+        guardar_punto(puntos, 5, banco_out, ingresos_out, egresos_out)
+
+    # 5) Un ABONO → varias facturas del mismo cliente
+    iniciar_etapa(ETAPAS[5], 6, len(ETAPAS))
+    ingresos_out, banco_out = conciliar_abonos_multifactura(
+        ingresos=ingresos_out,
+        banco=banco_out,
+        tolerancia=tolerancia
+    )
+
+    ingresos_out = reunir(ingresos_ancho, ingresos_out)
+    egresos_out = reunir(egresos_ancho, egresos_out)
+
+    # Índice: estado final de los CFDI de esta corrida y originales cerrados por notas
+    if indice is not None:
+        for libro, df in (("INGRESOS", ingresos_out), ("EGRESOS", egresos_out)):
+            indice_cfdi.actualizar_indice(indice, libro, df)
+            indice_cfdi.cerrar_originales_por_notas(indice, libro, df)
+
+    banco_out = quitar_campos_spei(anotar_cargos_bancarios(banco_out))
+
+    # Reemplazar hojas
+    ingresos_sheets = dict(ingresos_sheets)
+    egresos_sheets = dict(egresos_sheets)
+    ingresos_sheets["ACUMULADO"] = quitar_banderas(ingresos_out)
+    egresos_sheets["ACUMULADO"] = quitar_banderas(egresos_out)
+
+    return banco_out, ingresos_sheets, egresos_sheets
+
+
+def banco_para_exportar(banco_out: pd.DataFrame, formato: str = "xlsx") -> pd.DataFrame:
+    banco_export = banco_out.copy()
+
+    # En Excel las fechas van como texto; Parquet/CSV conservan el tipo
+    if formato == "xlsx":
+        for col in banco_export.columns:
+            if "FECHA" in col.upper():
+                banco_export[col] = banco_export[col].astype(str)
+
+    return banco_export
+
+
+def exportar_resultados(banco_out, ingresos_sheets, egresos_sheets, formato="xlsx"):
+    """
+    Regresa {nombre_archivo: (bytes, mime)} para las tres descargas.
+    """
+    salidas = {}
+
+    data, ext, mime = export_bytes(
+        banco_para_exportar(banco_out, formato),
+        formato=formato,
+        sheet_name=NOMBRE_BANCO
+    )
+    salidas[f"{NOMBRE_BANCO}{ext}"] = (data, mime)
+
+    for nombre, sheets in ((NOMBRE_INGRESOS, ingresos_sheets), (NOMBRE_EGRESOS, egresos_sheets)):
+        data, ext, mime = export_bytes(sheets, formato=formato)
+        salidas[f"{nombre}{ext}"] = (data, mime)
+
+    return salidas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conciliación bancaria sin interfaz")
+    parser.add_argument("--ingresos", required=True, help="Libro de ingresos (multi-hoja)")
+    parser.add_argument("--egresos", required=True, help="Libro de egresos (multi-hoja)")
+    parser.add_argument(
+        "--banco",
+        required=True,
+        nargs="+",
+        help="Uno o varios estados de cuenta (xlsx, csv, ofx o camt.053); los traslapes se eliminan"
+    )
+    parser.add_argument("--tolerancia", type=float, default=0.01)
+    parser.add_argument("--salida", default=".", help="Directorio de salida")
+    parser.add_argument(
+        "--formato",
+        nargs="+",
+        default=["xlsx"],
+        choices=sorted(FORMATOS_SALIDA),
+        help="Uno o varios formatos de salida"
+    )
+    parser.add_argument(
+        "--estado",
+        default=None,
+        help="Archivo SQLite de conciliación incremental (reutiliza lo ya conciliado)"
+    )
+    parser.add_argument(
+        "--motor",
+        default=None,
+        choices=MOTORES,
+        help="Motor para generar candidatos monto/fecha (duckdb requiere el paquete duckdb)"
+    )
+    parser.add_argument(
+        "--backend",
+        default=None,
+        choices=BACKENDS,
+        help="Backend para limpiar montos/fechas (polars: multi-hilo, mismo resultado)"
+    )
+    parser.add_argument(
+        "--por-mes",
+        action="store_true",
+        help="Conciliar mes por mes con archivos Parquet temporales (memoria acotada)"
+    )
+    parser.add_argument(
+        "--arrastre",
+        type=int,
+        default=None,
+        help="Días que un CFDI pendiente sigue participando en los meses siguientes (con --por-mes)"
+    )
+    parser.add_argument("--spill", default=None, help="Directorio para los Parquet temporales (con --por-mes)")
+    parser.add_argument(
+        "--cascada",
+        action="store_true",
+        help="Resolver primero por referencia y por monto/fecha exactos; las etapas ven solo el residuo"
+    )
+    parser.add_argument(
+        "--cache-similitud",
+        default=None,
+        help="Parquet con el cache de similitud concepto/descripción (se carga y se actualiza)"
+    )
+    parser.add_argument(
+        "--barrido",
+        nargs="+",
+        type=float,
+        default=None,
+        help="Comparar varias tolerancias (p. ej. 0.01 0.5 1 5); escribe la tabla y los CFDI que cambian"
+    )
+    parser.add_argument(
+        "--puntos-control",
+        default=None,
+        help="Directorio para guardar cada etapa; si la corrida se cae, la siguiente sigue desde la última etapa"
+    )
+    parser.add_argument(
+        "--indice-cfdi",
+        default=None,
+        help="SQLite con los CFDI de periodos anteriores (notas y complementos que los referencian); se actualiza"
+    )
+    args = parser.parse_args(argv)
+
+    if args.estado and args.por_mes:
+        parser.error("--estado y --por-mes no se pueden combinar")
+    if args.cascada and (args.estado or args.por_mes):
+        parser.error("--cascada no se puede combinar con --estado ni con --por-mes")
+    if args.barrido and (args.estado or args.por_mes or args.cascada):
+        parser.error("--barrido no se puede combinar con --estado, --por-mes ni --cascada")
+    if args.indice_cfdi and (args.estado or args.por_mes or args.cascada or args.barrido):
+        parser.error("--indice-cfdi solo aplica a la conciliación normal")
+    if args.puntos_control and (args.estado or args.por_mes or args.cascada or args.barrido):
+        parser.error("--puntos-control solo aplica a la conciliación normal")
+
+    if args.cache_similitud and os.path.exists(args.cache_similitud):
+        cargar_cache(args.cache_similitud)
+
+    banco, duplicados = leer_bancos(args.banco)
+    if not duplicados.empty:
+        print(f"Movimientos duplicados descartados: {len(duplicados)}")
+
+    entradas = dict(
+        ingresos_sheets=leer_hojas(args.ingresos),
+        egresos_sheets=leer_hojas(args.egresos),
+        banco=banco,
+        tolerancia=args.tolerancia,
+        motor=args.motor,
+        backend=args.backend,
+    )
+
+    if args.barrido:
+        from .barrido import barrido_tolerancias
+
+        entradas.pop("tolerancia")
+        tabla, cambios = barrido_tolerancias(**entradas, tolerancias=args.barrido)
+        print(tabla.to_string(index=False))
+
+        os.makedirs(args.salida, exist_ok=True)
+        for nombre, df in (("barrido_tolerancias.csv", tabla), ("cambios_tolerancia.csv", cambios)):
+            ruta = os.path.join(args.salida, nombre)
+            df.to_csv(ruta, index=False, encoding="utf-8-sig")
+            print(f"Escrito: {ruta}")
+        return
+
+    if args.estado:
+        from .estado_conciliacion import conciliar_incremental
+
+        banco_out, ingresos_sheets, egresos_sheets, resumen = conciliar_incremental(
+            **entradas, ruta_estado=args.estado
+        )
+        for clave, valor in resumen.items():
+            print(f"{clave}: {valor}")
+    elif args.por_mes:
+        from .particiones import conciliar_por_mes, DIAS_ARRASTRE
+
+        banco_out, ingresos_sheets, egresos_sheets = conciliar_por_mes(
+            **entradas,
+            dias_arrastre=DIAS_ARRASTRE if args.arrastre is None else args.arrastre,
+            directorio=args.spill,
+        )
+    elif args.cascada:
+        banco_out, ingresos_sheets, egresos_sheets, resumen = conciliar_en_cascada(**entradas)
+        for nivel, conciliados in resumen.items():
+            print(f"Nivel {nivel}: {conciliados}")
+    else:
+        banco_out, ingresos_sheets, egresos_sheets = conciliar(**entradas, indice=args.indice_cfdi, puntos_control=args.puntos_control)
+
+    if args.cache_similitud:
+        guardar_cache(args.cache_similitud)
+
+    os.makedirs(args.salida, exist_ok=True)
+
+    for formato in args.formato:
+        salidas = exportar_resultados(banco_out, ingresos_sheets, egresos_sheets, formato)
+        for nombre, (data, _) in salidas.items():
+            ruta = os.path.join(args.salida, nombre)
+            with open(ruta, "wb") as f:
+                f.write(data)
+            print(f"Escrito: {ruta}")
+
+
+if __name__ == "__main__":
+    main()
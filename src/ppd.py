@@ -1,15 +1,15 @@
 from .complementos import agrupar_complementos_por_folio
-from .preprocessing import pick_column
+from .schema import normalizar_columnas, resolver_columnas
 import pandas as pd
 
 
 def procesar_ppd(acumulados: pd.DataFrame, complementos: pd.DataFrame):
 
-    acumulados = acumulados.copy()
-    acumulados.columns = acumulados.columns.astype(str).str.upper().str.strip()
+    acumulados = normalizar_columnas(acumulados.copy())
+    cols = resolver_columnas(acumulados)
 
-    col_folio = pick_column(acumulados, ["FOLIO"])
-    col_metodo = pick_column(acumulados, ["METODO PAGO", "METODO DE PAGO"])
+    col_folio = cols["doc.folio"]
+    col_metodo = cols["doc.metodo"]
 
     if not col_folio or not col_metodo:
         return pd.DataFrame()
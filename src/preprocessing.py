@@ -1,13 +1,45 @@
+import re
+import unicodedata
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 import pandas as pd
 import numpy as np
 
+from .config import RESTRICTED_PUE_FORMA, BACKEND, CARGOS_BANCARIOS
+from .schema import buscar_columna, resolver_columnas
+
+BACKENDS = ("pandas", "polars")
+
+#* Backend de limpieza activo (por hilo/contexto: cada sesión de Streamlit elige el suyo)
+_backend = ContextVar("backend", default=BACKEND)
+
+
+def backend_activo() -> str:
+    return _backend.get()
+
+
+@contextmanager
+def usar_backend(nombre):
+    """with usar_backend("polars"): ... (None deja el que esté activo)"""
+    if nombre is not None and nombre not in BACKENDS:
+        raise ValueError(f"Backend no soportado: {nombre}")
+    token = _backend.set(nombre or _backend.get())
+    try:
+        yield
+    finally:
+        _backend.reset(token)
+
+
 def pick_column(df, candidates):
-    for c in candidates:
-        if c in df.columns:
-            return c
-    return None
+    # Ignora acentos/espacios/guiones bajos; funciona igual con frames de pandas y polars
+    return buscar_columna(df, candidates)
 
 def to_money(series):
+    if backend_activo() == "polars":
+        from .backend_polars import to_money as to_money_polars
+        return to_money_polars(series)
+
     s = series.astype(str)
     s = s.str.replace(",", "", regex=False)
     s = s.str.replace("$", "", regex=False)
@@ -15,6 +47,12 @@ def to_money(series):
     return pd.to_numeric(s, errors="coerce")
 
 def to_date(series):
+    if backend_activo() == "polars":
+        from .backend_polars import to_date as to_date_polars
+        fechas = to_date_polars(series)
+        if fechas is not None:
+            return fechas
+
     s = series.astype(str).str.strip()
 
     # 1️⃣ Intentar parseo automático
@@ -41,4 +79,230 @@ def to_date(series):
             errors="coerce"
         )
 
-    return fechas
\ No newline at end of file
+    return fechas
+
+# =====================================
+# CATÁLOGOS → BANDERAS
+# =====================================
+#* Columnas internas de banderas (bool). El pipeline las calcula una vez y las quita al final.
+BANDERAS = (
+    "_ES_PPD_",
+    "_ES_PUE_",
+    "_ES_EFECTIVO_",
+    "_PUE_RESTRINGIDO_",
+    "_ES_CANCELADO_",
+    "_ES_PUBLICO_",
+    "_ES_NOTA_CREDITO_",
+)
+
+
+def norm_texto(x) -> str:
+    return re.sub(r"\s+", " ", str(x or "")).strip().upper()
+
+
+def norm_sin_acentos(x) -> str:
+    s = str(x or "").strip().upper()
+    return unicodedata.normalize("NFKD", s).encode("ASCII", "ignore").decode("ASCII")
+
+
+def folio_texto(folio) -> str:
+    """Folio para el banco como en el estado de cuenta: numéricos sin ".0", nulo → ""."""
+    if isinstance(folio, (int, float)) and pd.notna(folio):
+        return str(int(folio))
+    return "" if pd.isna(folio) else str(folio)
+
+
+def evaluar_por_categoria(series, fn) -> np.ndarray:
+    """
+    Evalúa fn una vez por valor distinto (categoría) y expande por códigos.
+    Evita repetir el trabajo de strings en cada fila.
+    """
+    cat = series.astype("category")
+    valores = np.array([bool(fn(v)) for v in cat.cat.categories] + [bool(fn(None))], dtype=bool)
+    codes = cat.cat.codes.to_numpy()
+    # código -1 (vacío) apunta al último elemento: fn(None)
+    return valores[np.where(codes >= 0, codes, len(valores) - 1)]
+
+
+def codificar_catalogos(df: pd.DataFrame) -> list:
+    """
+    Agrega (en sitio) las banderas de BANDERAS a partir de METODO PAGO, FORMA PAGO,
+    TIPO, ESTADO/ESTATUS y RAZON RECEPTOR. Si ya existen no se recalculan.
+    Regresa las columnas que se agregaron (para quitarlas al final de la etapa).
+    """
+    if all(b in df.columns for b in BANDERAS):
+        return []
+
+    cols = resolver_columnas(df)
+    n = len(df)
+    falso = np.zeros(n, dtype=bool)
+
+    def flag(rol, fn):
+        col = cols[rol]
+        return evaluar_por_categoria(df[col], fn) if col else falso
+
+    es_ppd = flag("doc.metodo", lambda v: "PPD" in norm_texto(v))
+    es_pue = flag("doc.metodo", lambda v: "PUE" in norm_texto(v))
+
+    def _efectivo(v):
+        forma = norm_texto(v)
+        return "EFECTIVO" in forma or forma == "01"
+
+    banderas = {
+        "_ES_PPD_": es_ppd,
+        "_ES_PUE_": es_pue,
+        "_ES_EFECTIVO_": flag("doc.forma", _efectivo),
+        "_PUE_RESTRINGIDO_": es_pue & flag(
+            "doc.forma",
+            lambda v: any(x in norm_texto(v) for x in RESTRICTED_PUE_FORMA)
+        ),
+        "_ES_CANCELADO_": flag("doc.estado_cfdi", lambda v: "CANCEL" in norm_texto(v)),
+        "_ES_PUBLICO_": flag("doc.razon_receptor", lambda v: "PUBLICO" in norm_sin_acentos(v)),
+        "_ES_NOTA_CREDITO_": flag(
+            "doc.tipo",
+            lambda v: "EGRESO" in re.sub(r"[^A-Z]", "", str(v or "").upper())
+        ),
+    }
+
+    agregadas = []
+    for nombre, valores in banderas.items():
+        if nombre not in df.columns:
+            df[nombre] = valores
+            agregadas.append(nombre)
+
+    return agregadas
+
+
+def quitar_banderas(df: pd.DataFrame) -> pd.DataFrame:
+    return df.drop(columns=[b for b in BANDERAS if b in df.columns])
+
+
+# =====================================
+# CARGOS BANCARIOS (COMISIONES / IMPUESTOS)
+# =====================================
+#* Columna interna del banco: clase del cargo ("" si no es); esos movimientos no se buscan contra CFDI
+BANDERA_CARGO_BANCARIO = "_CARGO_BANCARIO_"
+
+#* Un solo patrón compilado: un grupo con nombre por clase (C0, C1, ...)
+_PATRON_CARGOS = re.compile(
+    "|".join(f"(?P<C{k}>{patron})" for k, patron in enumerate(CARGOS_BANCARIOS.values()))
+)
+_CLASES_CARGOS = list(CARGOS_BANCARIOS)
+
+
+def clasificar_cargos_bancarios(banco: pd.DataFrame) -> pd.Series:
+    """
+    Clase de cargo bancario por movimiento ("COMISION", "IVA COMISION", ...; "" si no es).
+    El patrón se evalúa una vez por texto distinto de descripción + referencia.
+    """
+    cols = resolver_columnas(banco)
+    textos = [banco[c].fillna("").astype(str) for c in (cols["banco.descripcion"], cols["banco.referencia"]) if c]
+    if not textos:
+        return pd.Series("", index=banco.index, dtype="object")
+
+    texto = textos[0]
+    for otro in textos[1:]:
+        texto = texto + " " + otro
+
+    cat = texto.astype("category")
+    unicos = pd.Series([norm_sin_acentos(v) for v in cat.cat.categories], dtype="object")
+    grupos = unicos.str.extract(_PATRON_CARGOS)
+    # Primer grupo con coincidencia -> nombre de la clase
+    clase = grupos.notna().to_numpy()
+    nombres = np.where(
+        clase.any(axis=1),
+        np.array(_CLASES_CARGOS, dtype=object)[clase.argmax(axis=1)],
+        "",
+    )
+    codes = cat.cat.codes.to_numpy()
+    return pd.Series(np.append(nombres, "")[np.where(codes >= 0, codes, len(nombres))], index=banco.index, dtype="object")
+
+
+def es_cargo_bancario(banco: pd.DataFrame) -> pd.Series:
+    """Movimientos clasificados como cargo bancario (todo False si el banco no se clasificó)."""
+    if BANDERA_CARGO_BANCARIO in banco.columns:
+        return banco[BANDERA_CARGO_BANCARIO].fillna("").astype(str) != ""
+    return pd.Series(False, index=banco.index)
+
+
+def anotar_cargos_bancarios(banco: pd.DataFrame) -> pd.DataFrame:
+    """Al final: la clase va a OBSERVACIONES de los cargos sin conciliar y se quita la columna interna."""
+    if BANDERA_CARGO_BANCARIO not in banco.columns:
+        return banco
+
+    banco = banco.copy()
+    clase = banco.pop(BANDERA_CARGO_BANCARIO).fillna("").astype(str)
+    if "OBSERVACIONES" not in banco.columns:
+        banco["OBSERVACIONES"] = ""
+    obs = banco["OBSERVACIONES"].fillna("").astype(str).str.strip()
+    anotar = (clase != "") & obs.isin(["", "N/A"])
+    banco.loc[anotar, "OBSERVACIONES"] = "CARGO BANCARIO: " + clase[anotar]
+    return banco
+
+
+# =====================================
+# HUELLAS (llaves estables entre corridas)
+# =====================================
+def _centavos(series) -> pd.Series:
+    return (to_money(series).abs() * 100).round().fillna(-1).astype("int64")
+
+
+def _texto_norm(series) -> pd.Series:
+    return (
+        series.astype(str)
+        .str.upper()
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+        .replace({"NAN": "", "NONE": "", "NAT": ""})
+    )
+
+
+def huella_banco(banco: pd.DataFrame, con_ocurrencia: bool = True) -> pd.Series:
+    """
+    Huella por movimiento: fecha, cargo/abono en centavos, descripción normalizada,
+    referencia y saldo (si existen). Con 'con_ocurrencia' se agrega el número de
+    repetición para distinguir movimientos idénticos dentro del mismo archivo.
+    """
+    cols = resolver_columnas(banco)
+    partes = pd.DataFrame(index=banco.index)
+
+    if cols["banco.fecha"]:
+        partes["fecha"] = to_date(banco[cols["banco.fecha"]]).dt.strftime("%Y-%m-%d").fillna("")
+    for rol in ("banco.cargo", "banco.abono", "banco.saldo"):
+        if cols[rol]:
+            partes[rol] = _centavos(banco[cols[rol]])
+    for rol in ("banco.descripcion", "banco.referencia"):
+        if cols[rol]:
+            partes[rol] = _texto_norm(banco[cols[rol]])
+
+    if con_ocurrencia and len(partes.columns):
+        partes["ocurrencia"] = partes.groupby(list(partes.columns), sort=False).cumcount()
+
+    return pd.util.hash_pandas_object(partes, index=False).astype(str)
+
+
+def clave_cfdi(df: pd.DataFrame) -> pd.Series:
+    """UUID normalizado; si no hay UUID se usa 'FOLIO:<folio>'. Vacío si no hay ninguno."""
+    cols = resolver_columnas(df)
+    clave = pd.Series("", index=df.index, dtype="object")
+
+    if cols["doc.folio"]:
+        folio = _texto_norm(df[cols["doc.folio"]]).str.replace(r"\.0$", "", regex=True)
+        clave = clave.mask(folio != "", "FOLIO:" + folio)
+    if cols["doc.uuid"]:
+        uuid = _texto_norm(df[cols["doc.uuid"]])
+        clave = clave.mask(uuid != "", uuid)
+
+    return clave
+
+
+def huella_contenido(df: pd.DataFrame, roles) -> pd.Series:
+    """Hash de las columnas de entrada indicadas (detecta CFDI que cambiaron)."""
+    cols = resolver_columnas(df)
+    partes = pd.DataFrame(index=df.index)
+    for rol in roles:
+        if cols[rol]:
+            partes[rol] = _texto_norm(df[cols[rol]])
+    if not len(partes.columns):
+        return pd.Series("", index=df.index, dtype="object")
+    return pd.util.hash_pandas_object(partes, index=False).astype(str)
@@ -0,0 +1,97 @@
+"""
+Progreso y cancelación de la cadena de etapas.
+
+Fuera de reportar_progreso() no hace nada: con_progreso regresa el iterable tal cual.
+Dentro, las etapas avisan su avance al callback a lo más cada INTERVALO_PROGRESO
+segundos y revisan la cancelación cada FILAS_POR_LOTE_PROGRESO filas.
+El estado vive en un ContextVar, así que cada hilo (corrida) lleva el suyo.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import pandas as pd
+
+from .config import INTERVALO_PROGRESO, FILAS_POR_LOTE_PROGRESO
+
+_reporte = ContextVar("reporte_progreso", default=None)
+
+
+class ConciliacionCancelada(Exception):
+    """La corrida se canceló entre lotes de filas."""
+
+
+@contextmanager
+def reportar_progreso(callback, cancelar=None, intervalo: float = INTERVALO_PROGRESO):
+    """
+    callback(etapa, fraccion) recibe el nombre de la etapa y el avance total (0 a 1).
+    'cancelar' es un threading.Event; si se activa, la etapa en curso lanza ConciliacionCancelada.
+    """
+    estado = {
+        "callback": callback,
+        "cancelar": cancelar,
+        "intervalo": intervalo,
+        "ultimo": 0.0,
+        "etapa": "",
+        "numero": 0,
+        "etapas": 1,
+    }
+    token = _reporte.set(estado)
+    try:
+        yield
+    finally:
+        _reporte.reset(token)
+
+
+def _revisar_cancelacion(estado):
+    cancelar = estado["cancelar"]
+    if cancelar is not None and cancelar.is_set():
+        raise ConciliacionCancelada("Conciliación cancelada")
+
+
+def _avisar(estado, hechas, total, forzar=False):
+    _revisar_cancelacion(estado)
+
+    ahora = time.monotonic()
+    if not forzar and ahora - estado["ultimo"] < estado["intervalo"]:
+        return
+    estado["ultimo"] = ahora
+
+    parcial = hechas / total if total else 1.0
+    fraccion = (estado["numero"] - 1 + parcial) / estado["etapas"]
+    estado["callback"](estado["etapa"], min(max(fraccion, 0.0), 1.0))
+
+
+def iniciar_etapa(nombre: str, numero: int, etapas: int):
+    """Marca el inicio de la etapa 'numero' (desde 1) de 'etapas'."""
+    estado = _reporte.get()
+    if estado is None:
+        return
+    estado.update(etapa=nombre, numero=numero, etapas=etapas)
+    _avisar(estado, 0, 1, forzar=True)
+
+
+def _iterar(filas, total, estado, avance):
+    for k, fila in enumerate(filas):
+        if k % FILAS_POR_LOTE_PROGRESO == 0:
+            if avance:
+                _avisar(estado, k, total)
+            else:
+                _revisar_cancelacion(estado)
+        yield fila
+    if avance:
+        _avisar(estado, total, total)
+
+
+def con_progreso(datos, avance: bool = True):
+    """
+    Itera 'datos' (un DataFrame se recorre con iterrows) avisando el avance.
+    Solo el recorrido principal de cada etapa avisa; los secundarios o anidados
+    van con avance=False y solo revisan la cancelación (la barra nunca regresa).
+    Sin reportar_progreso activo regresa el iterable original, sin costo extra.
+    """
+    filas = datos.iterrows() if isinstance(datos, pd.DataFrame) else datos
+    estado = _reporte.get()
+    if estado is None:
+        return filas
+    return _iterar(filas, len(datos), estado, avance)
@@ -0,0 +1,155 @@
+"""
+Puntos de control de la cadena de etapas (Parquet).
+
+Al terminar cada etapa se guardan banco / ingresos / egresos intermedios en
+<directorio>/<huella>/etapa_<n>/, donde la huella combina las entradas (hojas y
+banco) con los parámetros de la corrida. Si una corrida con la misma huella se
+cae o se cancela, la siguiente carga la última etapa guardada y sigue desde ahí.
+Al terminar bien, los puntos de esa huella se borran.
+
+Las columnas object con tipos mezclados (p. ej. FOLIO numérico y texto, o
+IMPORTE PAGADO CP con "" y números) se guardan como texto más una columna con el
+tipo de cada valor, y se reconstruyen igual al cargar.
+"""
+import hashlib
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+_FRAMES = ("banco", "ingresos", "egresos")
+
+#* Sufijo de la columna con el tipo de cada valor (columnas object con tipos mezclados)
+_SUFIJO_TIPO = "\x1fTIPO"
+
+#* Tipo guardado -> constructor al cargar (los nulos se reconstruyen aparte)
+_CONSTRUCTORES = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": lambda v: v == "True",
+    "int64": np.int64,
+    "float64": np.float64,
+    "bool_": lambda v: np.bool_(v == "True"),
+    "Timestamp": pd.Timestamp,
+    "datetime": lambda v: pd.Timestamp(v).to_pydatetime(),
+}
+_NULOS = {"NoneType": None, "NaTType": pd.NaT}
+
+
+# =====================================
+# HUELLA DE LA CORRIDA
+# =====================================
+def _actualizar(h, df: pd.DataFrame):
+    h.update(repr(list(df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+
+
+def huella_corrida(ingresos_sheets: dict, egresos_sheets: dict, banco: pd.DataFrame, **parametros) -> str:
+    """Hash de las hojas, el banco y los parámetros (tolerancia, motor, backend, índice...)."""
+    h = hashlib.blake2b(digest_size=16)
+    for sheets in (ingresos_sheets, egresos_sheets):
+        for nombre in sorted(sheets):
+            h.update(str(nombre).encode())
+            _actualizar(h, sheets[nombre])
+    _actualizar(h, banco)
+    h.update(repr(sorted(parametros.items())).encode())
+    return h.hexdigest()
+
+
+# =====================================
+# GUARDAR / CARGAR
+# =====================================
+def _tabla(df: pd.DataFrame) -> pa.Table:
+    mezcladas = [
+        c for c in df.columns
+        if df[c].dtype == object and df[c].dropna().map(type).nunique() > 1
+    ]
+    if mezcladas:
+        df = df.copy()
+        for col in mezcladas:
+            valores = df[col]
+            df[col + _SUFIJO_TIPO] = valores.map(lambda v: type(v).__name__)
+            df[col] = valores.map(str).where(valores.notna(), None)
+    return pa.Table.from_pandas(df, preserve_index=True)
+
+
+def _valor(v, tipo):
+    if tipo in _NULOS:
+        return _NULOS[tipo]
+    if v is None:
+        return np.nan
+    return _CONSTRUCTORES.get(tipo, str)(v)
+
+
+def _leer(ruta: str) -> pd.DataFrame:
+    df = pq.read_table(ruta).to_pandas()
+    for columna_tipo in [c for c in df.columns if c.endswith(_SUFIJO_TIPO)]:
+        col = columna_tipo[: -len(_SUFIJO_TIPO)]
+        df[col] = pd.Series(
+            [_valor(v, t) for v, t in zip(df[col].tolist(), df[columna_tipo].tolist())],
+            index=df.index,
+            dtype=object,
+        )
+        df.drop(columns=columna_tipo, inplace=True)
+    return df
+
+
+def _carpeta(puntos, numero=None) -> str:
+    directorio, huella = puntos
+    carpeta = os.path.join(directorio, huella)
+    return carpeta if numero is None else os.path.join(carpeta, f"etapa_{numero}")
+
+
+def guardar_punto(puntos, numero: int, banco, ingresos, egresos):
+    """
+    Guarda el estado después de la etapa 'numero' (sin puntos de control no hace nada).
+    Se escribe en una carpeta temporal y se renombra: un punto a medias nunca se carga.
+    """
+    if puntos is None:
+        return
+
+    destino = _carpeta(puntos, numero)
+    temporal = destino + ".tmp"
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    for nombre, df in zip(_FRAMES, (banco, ingresos, egresos)):
+        pq.write_table(_tabla(df), os.path.join(temporal, f"{nombre}.parquet"))
+
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(temporal, destino)
+
+    # Solo hace falta el último
+    for anterior in range(1, numero):
+        shutil.rmtree(_carpeta(puntos, anterior), ignore_errors=True)
+
+
+def ultimo_punto(puntos):
+    """(numero, banco, ingresos, egresos) de la última etapa guardada, o None."""
+    if puntos is None:
+        return None
+
+    carpeta = _carpeta(puntos)
+    if not os.path.isdir(carpeta):
+        return None
+
+    numeros = [
+        int(nombre.split("_", 1)[1])
+        for nombre in os.listdir(carpeta)
+        if nombre.startswith("etapa_") and nombre.split("_", 1)[1].isdigit()
+    ]
+    if not numeros:
+        return None
+
+    numero = max(numeros)
+    frames = [_leer(os.path.join(_carpeta(puntos, numero), f"{nombre}.parquet")) for nombre in _FRAMES]
+    return (numero, *frames)
+
+
+def descartar_puntos(puntos):
+    """Borra los puntos de una corrida que ya terminó."""
+    if puntos is not None:
+        shutil.rmtree(_carpeta(puntos), ignore_errors=True)
@@ -1,135 +1,138 @@
+import numpy as np
 import pandas as pd
-from rapidfuzz import fuzz
 
-from .config import (
-    CARGO_COL_CANDIDATES,
-    FECHA_COL_CANDIDATES,
-    DESCRIP_COL_CANDIDATES,
-    EGRESO_MONTO_CANDIDATES,
-    EGRESO_FECHA_CANDIDATES,
-    EGRESO_CONCEPTO_CANDIDATES
-)
-from .preprocessing import pick_column, to_money, to_date
-from .utils_orden import mover_cancelados_al_final
+from .preprocessing import to_date
+from .candidatos import generar_candidatos
+from .similitud import preparar_textos, similitud_pares
+from .spei import campos_spei, llaves_documento, coincidencias_llave
+from .schema import resolver_columnas
+
+
+#* Puntaje extra de un candidato con folio/RFC exacto (mayor que fecha + similitud juntas)
+BONO_LLAVE = 10000
+
+
+def _asignar_uno_a_uno(pares: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pares (IZQ, DER) ya ordenados de mejor a peor → asignación voraz: cada IZQ y cada DER
+    una sola vez. En cada ronda se aceptan los pares que son el primero de su IZQ y de su
+    DER (lo mismo que recorrerlos en orden) y se descartan los que ya tienen dueño.
+    """
+    elegidos = []
+    while not pares.empty:
+        ronda = pares[~pares["IZQ"].duplicated() & ~pares["DER"].duplicated()]
+        elegidos.append(ronda)
+        pares = pares[~pares["IZQ"].isin(ronda["IZQ"]) & ~pares["DER"].isin(ronda["DER"])]
+    return pd.concat(elegidos) if elegidos else pares
 
 
 def conciliar_egresos_vs_banco(
-    egresos: pd.DataFrame,
+    egr: dict,
     banco: pd.DataFrame,
-    tolerancia: float = 1.0
-):
-    col_cargo = pick_column(banco, CARGO_COL_CANDIDATES)
-    col_fecha_banco = pick_column(banco, FECHA_COL_CANDIDATES)
-    col_desc_banco = pick_column(banco, DESCRIP_COL_CANDIDATES)
-
-    col_monto_egr = pick_column(egresos, EGRESO_MONTO_CANDIDATES)
-    col_fecha_egr = pick_column(egresos, EGRESO_FECHA_CANDIDATES)
-    col_conc_egr = pick_column(egresos, EGRESO_CONCEPTO_CANDIDATES)
-    col_forma_pago = pick_column(
-        egresos,
-        ["FORMA PAGO", "FORMA DE PAGO", "METODO DE PAGO"]
-    )
-
-    banco = banco.copy()
-    banco[col_cargo] = to_money(banco[col_cargo]).abs()
-    banco[col_fecha_banco] = to_date(banco[col_fecha_banco])
-
-    egresos = egresos.copy()
-    egresos[col_monto_egr] = to_money(egresos[col_monto_egr]).abs()
-
-    if col_fecha_egr:
-        egresos["_FECHA_EMISION_DT"] = to_date(egresos[col_fecha_egr])
+    disponibles: pd.Series,
+    tolerancia: float = 0.01,
+    motor: str = None,
+) -> dict:
+    """
+    Egresos contra cargos del banco en una sola pasada:
+      - EFECTIVO → PAGADO OTRO (no consume movimientos)
+      - candidatos por monto (tolerancia) puntuados por cercanía de fecha, similitud
+        concepto ↔ descripción y folio/RFC exacto de la descripción SPEI
+      - cada cargo queda con un solo egreso y cada egreso con un solo cargo (mejor puntaje primero)
+
+    egr: egresos preparados por el estado de cuenta (_prepare), se marcan en sitio.
+    banco: movimientos con cargo y fecha ya limpios; 'disponibles' = máscara de cargos sin dueño.
+    Regresa {etiqueta banco: (fila egreso, "PAGADO" | "NO_PAGADO", egr)}.
+    """
+    df = egr["df"]
+    cols = egr["cols"]
+    cols_banco = resolver_columnas(banco)
+
+    col_cargo = cols_banco["banco.cargo"]
+    col_fecha_banco = cols_banco["banco.fecha"]
+    col_desc_banco = cols_banco["banco.descripcion"]
+    col_monto = "MONTO_AJUSTADO" if "MONTO_AJUSTADO" in df.columns else egr["monto"]
+    col_concepto = cols["doc.concepto"]
+
+    # Lo que no resuelvan las notas de crédito ni los cancelados se decide aquí
+    libres = ~df["_USADO_"]
+    df["CONCILIADO_BANCO"] = "NO"
+    df.loc[libres, egr["estado"]] = "NO LOCALIZADO"
+    df.loc[libres, egr["fecha_pago"]] = ""
+    df.loc[libres, egr["obs"]] = ""
+    # Como antes: OBSERVACIONES sin nulos ("" si no hay nota)
+    df[egr["obs"]] = df[egr["obs"]].fillna("")
+
+    # EFECTIVO → PAGADO OTRO
+    efectivo = libres & df["_ES_EFECTIVO_"] & df[col_monto].notna()
+    df.loc[efectivo, "CONCILIADO_BANCO"] = "SI"
+    df.loc[efectivo, egr["estado"]] = "PAGADO OTRO"
+    df.loc[efectivo, egr["obs"]] = "Pago en efectivo (no bancario)"
+    df.loc[efectivo, "_USADO_"] = True
+
+    elegibles = df[libres & ~efectivo]
+    cargos = banco[disponibles & (banco[col_cargo] > 0) & pd.notna(banco[col_fecha_banco])]
+    pares = generar_candidatos(elegibles[col_monto], cargos[col_cargo], tolerancia, redondear=True, motor=motor)
+    if pares.empty:
+        return {}
+
+    # Puntaje de todos los pares a la vez: fecha + similitud + llave SPEI
+    if egr["fecha_em"]:
+        fechas_egr = df[egr["fecha_em"]]
+    elif cols["doc.fecha"]:
+        fechas_egr = to_date(df[cols["doc.fecha"]])
     else:
-        egresos["_FECHA_EMISION_DT"] = pd.NaT
-
-    # Columnas internas
-    egresos["CONCILIADO_BANCO"] = "NO"
-    egresos["ESTADO_EGRESO"] = "NO LOCALIZADO"
-    egresos["FECHA_DE_PAGO"] = ""
-    egresos["OBSERVACION"] = ""
-
-    for i, e in egresos.iterrows():
-        monto = e.get(col_monto_egr)
-        if pd.isna(monto):
-            continue
-
-        # EFECTIVO → PAGADO OTRO
-        if col_forma_pago:
-            forma = str(e.get(col_forma_pago, "")).upper().strip()
-            if "EFECTIVO" in forma or forma == "01":
-                egresos.at[i, "CONCILIADO_BANCO"] = "SI"
-                egresos.at[i, "ESTADO_EGRESO"] = "PAGADO OTRO"
-                egresos.at[i, "FECHA_DE_PAGO"] = ""
-                egresos.at[i, "OBSERVACION"] = "Pago en efectivo (no bancario)"
-                continue
-
-        candidatos = banco[
-            (banco[col_cargo] - monto).abs() <= tolerancia
-        ]
-
-        if candidatos.empty:
-            continue
-
-        candidatos = candidatos[pd.notna(candidatos[col_fecha_banco])]
-        if candidatos.empty:
-            continue
-
-        def score(row):
-            s = 1000
-            if col_fecha_egr and pd.notna(e["_FECHA_EMISION_DT"]):
-                s += max(
-                    0,
-                    300 - abs(
-                        (e["_FECHA_EMISION_DT"] - row[col_fecha_banco]).days
-                    )
-                )
-            if col_conc_egr and col_desc_banco:
-                s += fuzz.token_set_ratio(
-                    str(e.get(col_conc_egr, "")),
-                    str(row.get(col_desc_banco, ""))
-                )
-            return s
-
-        candidatos = candidatos.copy()
-        candidatos["__SCORE__"] = candidatos.apply(score, axis=1)
-        best = candidatos.sort_values("__SCORE__", ascending=False).iloc[0]
-
-        egresos.at[i, "CONCILIADO_BANCO"] = "SI"
-        egresos.at[i, "ESTADO_EGRESO"] = "PAGADO"
-        egresos.at[i, "FECHA_DE_PAGO"] = best[col_fecha_banco].strftime("%d/%m/%Y")
-        egresos.at[i, "OBSERVACION"] = "Conciliado con estado de cuenta"
-
-    # 🔹 SINCRONIZAR columnas originales
-    col_estado_original = pick_column(egresos, ["ESTADO DE PAGO", "ESTADO_PAGO"])
-    col_fecha_original = pick_column(egresos, ["FECHA DE PAGO", "FECHA_PAGO"])
-    col_obs_original = pick_column(egresos, ["OBSERVACIONES", "OBSERVACION"])
-
-    if col_estado_original:
-        egresos[col_estado_original] = egresos["ESTADO_EGRESO"]
-
-    if col_fecha_original:
-        egresos[col_fecha_original] = egresos["FECHA_DE_PAGO"]
-
-    if col_obs_original:
-        egresos[col_obs_original] = egresos["OBSERVACION"]
-
-    egresos.drop(columns=["_FECHA_EMISION_DT"], inplace=True, errors="ignore")
-
-    # 🔹 Orden final
-    egresos = mover_cancelados_al_final(egresos)
-
-    # 🔹 Eliminar columnas internas duplicadas (solo visual)
-    egresos.drop(
-        columns=["ESTADO_EGRESO", "FECHA_DE_PAGO", "OBSERVACION"],
-        errors="ignore",
-        inplace=True
-    )
-
-    resumen = {
-        "Egresos totales": len(egresos),
-        "Pagados": (egresos[col_estado_original] == "PAGADO").sum() if col_estado_original else 0,
-        "Pagados otro": (egresos[col_estado_original] == "PAGADO OTRO").sum() if col_estado_original else 0,
-        "No localizados": (egresos[col_estado_original] == "NO LOCALIZADO").sum() if col_estado_original else 0,
+        fechas_egr = pd.Series(pd.NaT, index=df.index)
+    dias = (
+        fechas_egr.loc[pares["IZQ"]].to_numpy() - cargos[col_fecha_banco].loc[pares["DER"]].to_numpy()
+    ) / np.timedelta64(1, "D")
+    puntaje = np.nan_to_num(np.clip(300 - np.abs(dias), 0, None))
+
+    if col_concepto and col_desc_banco:
+        puntaje += similitud_pares(
+            preparar_textos(df[col_concepto]).loc[pares["IZQ"]].to_numpy(),
+            preparar_textos(cargos[col_desc_banco]).loc[pares["DER"]].to_numpy(),
+        )
+
+    # RFC del proveedor (emisor): el de la empresa aparece en todos los cargos como ordenante
+    llaves = llaves_documento(df, rol_rfc="doc.rfc_emisor")
+    if llaves:
+        puntaje += coincidencias_llave(pares, llaves, campos_spei(cargos)) * BONO_LLAVE
+
+    # Empates: el movimiento que aparece primero y el egreso más antiguo
+    pares = pares.assign(
+        PUNTAJE=puntaje,
+        POS_BANCO=banco.index.get_indexer(pares["DER"]),
+        POS_EGR=df.index.get_indexer(pares["IZQ"]),
+    ).sort_values(["PUNTAJE", "POS_BANCO", "POS_EGR"], ascending=[False, True, True], kind="stable")
+    asignados = _asignar_uno_a_uno(pares)
+
+    idx = asignados["IZQ"].to_numpy()
+    fechas = cargos.loc[asignados["DER"], col_fecha_banco].dt.strftime("%d/%m/%Y").fillna("").to_numpy()
+    ppd = df.loc[idx, "_ES_PPD_"].to_numpy()
+    restringido = df.loc[idx, "_PUE_RESTRINGIDO_"].to_numpy() & ~ppd
+    pagado = ~restringido
+
+    # PPD: pagado por medio de complementos
+    df.loc[idx[ppd], egr["obs"]] = "PAGADO POR MEDIO DE COMPLEMENTOS"
+
+    # Restricciones PUE: NO PAGADO (el movimiento se consume igual)
+    df.loc[idx[restringido], egr["estado"]] = "NO PAGADO"
+    df.loc[idx[restringido], egr["fecha_pago"]] = ""
+
+    # Normal: PAGADO con la fecha del movimiento
+    df.loc[idx[pagado], egr["estado"]] = "PAGADO"
+    df.loc[idx[pagado], egr["fecha_pago"]] = fechas[pagado]
+    df.loc[idx[pagado], "CONCILIADO_BANCO"] = "SI"
+
+    normales = idx[pagado & ~ppd]
+    obs = df.loc[normales, egr["obs"]]
+    vacias = normales[(obs.isna() | (obs.astype(str).str.strip() == "")).to_numpy()]
+    df.loc[vacias, egr["obs"]] = "Conciliado con estado de cuenta"
+
+    df.loc[idx, "_USADO_"] = True
+
+    return {
+        i_banco: (df.loc[i_egr], "NO_PAGADO" if r else "PAGADO", egr)
+        for i_banco, i_egr, r in zip(asignados["DER"].tolist(), idx.tolist(), restringido.tolist())
     }
-
-    return egresos, resumen
@@ -1,26 +1,12 @@
-import re
 import pandas as pd
 import numpy as np
-from .preprocessing import pick_column, to_money, to_date
-from .config import CARGO_COL_CANDIDATES, FECHA_COL_CANDIDATES, EGRESO_MONTO_CANDIDATES
+from .preprocessing import to_money, to_date, codificar_catalogos, es_cargo_bancario
+from .schema import normalizar_columnas, resolver_columnas
 from .reconcile import conciliar_egresos_vs_banco
 from .utils_orden import mover_cancelados_al_final
 from .reconcile_publico_general import conciliar_publico_en_general_subset
-
-
-RESTRICTED_PUE_FORMA = {
-    "EFECTIVO",
-    "TARJETA CREDITO",
-    "TARJETA CRÉDITO",
-    "CONDONACION",
-    "CONDONACIÓN",
-    "NOVACION",
-    "NOVACIÓN",
-}
-
-
-def _norm(x):
-    return re.sub(r"\s+", " ", str(x or "")).strip().upper()
+from .candidatos import generar_candidatos, candidatos_por_fila
+from .progreso import con_progreso
 
 
 def _ensure_col(df, col, default=""):
@@ -30,22 +16,22 @@ def _ensure_col(df, col, default=""):
 
 
 def _prepare(df):
-    df = df.copy()
-    df.columns = df.columns.astype(str).str.upper().str.strip()
+    df = normalizar_columnas(df.copy())
+    cols = resolver_columnas(df)
 
-    col_monto = pick_column(df, EGRESO_MONTO_CANDIDATES)
-    col_folio = pick_column(df, ["FOLIO"])
-    col_fecha_em = pick_column(df, ["FECHA EMISION", "FECHA_EMISION"])
-    col_metodo = pick_column(df, ["METODO PAGO", "METODO DE PAGO", "METODO_PAGO"])
-    col_forma = pick_column(df, ["FORMA PAGO", "FORMA DE PAGO", "FORMA_PAGO"])
-    col_obs = pick_column(df, ["OBSERVACIONES", "OBSERVACION"])
+    col_monto = cols["doc.monto"]
+    col_folio = cols["doc.folio"]
+    col_fecha_em = cols["doc.fecha_emision"]
+    col_metodo = cols["doc.metodo"]
+    col_forma = cols["doc.forma"]
+    col_obs = cols["doc.observaciones"]
 
     # Estado/fecha de pago (salida)
-    col_estado_pago = pick_column(df, ["ESTADO DE PAGO", "ESTADO_PAGO"])
-    col_fecha_pago = pick_column(df, ["FECHA DE PAGO", "FECHA_PAGO"])
+    col_estado_pago = cols["doc.estado_pago"]
+    col_fecha_pago = cols["doc.fecha_pago"]
 
     # Estado fiscal real (entrada) -> aquí es donde aparece CANCELADO
-    col_estado_cfdi = pick_column(df, ["ESTADO", "ESTATUS", "ESTADO CFDI", "ESTATUS CFDI", "STATUS", "SITUACION", "SITUACIÓN"])
+    col_estado_cfdi = cols["doc.estado_cfdi"]
 
     if not col_monto:
         raise ValueError("No se encontró columna de monto")
@@ -65,6 +51,9 @@ def _prepare(df):
 
     df["_USADO_"] = False
 
+    # Banderas PPD/PUE/EFECTIVO/CANCELADO/... (si el pipeline ya las trae, se reutilizan)
+    banderas_agregadas = codificar_catalogos(df)
+
     if col_fecha_em:
         df = df.sort_values(col_fecha_em)
 
@@ -78,7 +67,9 @@ def _prepare(df):
         "estado": col_estado_pago,      # columna de salida: ESTADO DE PAGO
         "fecha_pago": col_fecha_pago,   # columna de salida: FECHA DE PAGO
         "estado_cfdi": col_estado_cfdi,  # columna real del CFDI: CANCELADO/VIGENTE/etc
-        "obs": col_obs
+        "obs": col_obs,
+        "cols": cols,
+        "banderas_agregadas": banderas_agregadas,
     }
 
 
@@ -87,19 +78,26 @@ def conciliar_estado_cuenta_con_movimientos(
     ingresos: pd.DataFrame,
     egresos: pd.DataFrame,
     tolerancia: float = 0.01,
+    motor: str = None,
+    historico_ingresos: pd.DataFrame = None,
+    historico_egresos: pd.DataFrame = None,
 ):
-    banco = banco.copy()
-    banco.columns = banco.columns.astype(str).str.upper().str.strip()
+    """
+    historico_ingresos / historico_egresos: facturas de periodos anteriores (índice de CFDI)
+    indexadas por UUID, para notas de crédito cuya factura original no viene en la hoja.
+    """
+    banco = normalizar_columnas(banco.copy())
+    cols_banco = resolver_columnas(banco)
 
-    col_cargo = pick_column(banco, CARGO_COL_CANDIDATES)
-    col_abono = pick_column(banco, ["ABONO", "ABONOS"])
-    col_fecha_banco = pick_column(banco, FECHA_COL_CANDIDATES)
+    col_cargo = cols_banco["banco.cargo"]
+    col_abono = cols_banco["banco.abono"]
+    col_fecha_banco = cols_banco["banco.fecha"]
 
     if not col_fecha_banco:
         raise ValueError("Banco: falta columna FECHA")
 
-    col_folio_fact = pick_column(banco, ["FOLIO FACTURA"])
-    col_fecha_fact = pick_column(banco, ["FECHA FACTURA"])
+    col_folio_fact = cols_banco["banco.folio_factura"]
+    col_fecha_fact = cols_banco["banco.fecha_factura"]
 
     if not col_folio_fact:
         col_folio_fact = _ensure_col(banco, "FOLIO FACTURA", "")
@@ -112,14 +110,11 @@ def conciliar_estado_cuenta_con_movimientos(
         banco[col_abono] = to_money(banco[col_abono]).abs()
 
     banco[col_fecha_banco] = to_date(banco[col_fecha_banco])
-    banco["_USADO_"] = False
-
-    # 🔹 1) Conciliación previa de egresos vs banco
-    egresos_conciliados, _ = conciliar_egresos_vs_banco(
-        egresos=egresos,
-        banco=banco,
-        tolerancia=tolerancia,
-    )
+    # Comisiones / impuestos del banco: no son candidatos de ningún CFDI
+    cargo_bancario = es_cargo_bancario(banco)
+    banco["_USADO_"] = cargo_bancario.to_numpy()
+    # Existe desde el inicio: un delta puede empezar con un movimiento sin match
+    _ensure_col(banco, "OBSERVACIONES", "")
 
     ing = _prepare(ingresos)
     # Agrupar ingresos por FOLIO (hoja ACUMULADO)
@@ -136,7 +131,7 @@ def conciliar_estado_cuenta_con_movimientos(
                 "idxs": g.index.tolist()
             }
 
-    egr = _prepare(egresos_conciliados)
+    egr = _prepare(egresos)
 
     # =========================================================
     # ✅ MARCAR CANCELADOS DESDE EL INICIO (CLAVE)
@@ -146,12 +141,7 @@ def conciliar_estado_cuenta_con_movimientos(
         dfp = pack["df"]
         col_estado_cfdi = pack.get("estado_cfdi")
         if col_estado_cfdi:
-            mask_cancelado = (
-                dfp[col_estado_cfdi]
-                .astype(str)
-                .str.upper()
-                .str.contains("CANCEL", na=False)
-            )
+            mask_cancelado = dfp["_ES_CANCELADO_"]
             # Estado de pago = CANCELADO
             dfp.loc[mask_cancelado, pack["estado"]] = "CANCELADO"
             dfp.loc[mask_cancelado, pack["fecha_pago"]] = ""
@@ -166,20 +156,20 @@ def conciliar_estado_cuenta_con_movimientos(
 
     #*Egresos
     df_egr = egr["df"]
-    col_tipo_egr = pick_column(df_egr, ["TIPO"])
-    col_uuid_egr = pick_column(df_egr, ["UUID"])
-    col_uuid_rel = pick_column(df_egr, ["UUIDS RELACIONADOS"])
-    col_total_egr = pick_column(df_egr, ["TOTAL"])
-    col_folio_egr = pick_column(df_egr, ["FOLIO"])
+    col_tipo_egr = egr["cols"]["doc.tipo"]
+    col_uuid_egr = egr["cols"]["doc.uuid"]
+    col_uuid_rel = egr["cols"]["doc.uuid_relacionados"]
+    col_total_egr = egr["cols"]["doc.total"]
+    col_folio_egr = egr["cols"]["doc.folio"]
 
     #*Ingresos
     df_ing = ing["df"]
-    col_tipo_ing = pick_column(df_ing, ["TIPO"])
-    col_uuid_ing = pick_column(df_ing, ["UUID"])
-    col_uuid_rel_ing = pick_column(df_ing, ["UUIDS RELACIONADOS"])
-    col_total_ing = pick_column(df_ing, ["TOTAL"])
-    col_folio_ing = pick_column(df_ing, ["FOLIO"])
-    col_folio_doc = pick_column(df_ing, ["FOLIO DOCUMENTO", "FOLIO_DOC", "FOLIO FACTURA"])
+    col_tipo_ing = ing["cols"]["doc.tipo"]
+    col_uuid_ing = ing["cols"]["doc.uuid"]
+    col_uuid_rel_ing = ing["cols"]["doc.uuid_relacionados"]
+    col_total_ing = ing["cols"]["doc.total"]
+    col_folio_ing = ing["cols"]["doc.folio"]
+    col_folio_doc = ing["cols"]["doc.folio_documento"]
 
     #* Egresos
     if all([col_tipo_egr, col_uuid_egr, col_uuid_rel, col_total_egr, col_folio_egr, col_cargo]):
@@ -187,22 +177,19 @@ def conciliar_estado_cuenta_con_movimientos(
         df_egr["_UUID_NORM_"] = df_egr[col_uuid_egr].astype(str).str.strip()
         lookup = df_egr.set_index("_UUID_NORM_", drop=False)
 
-        for idx, row in df_egr.iterrows():
-
-            tipo = str(row.get(col_tipo_egr, ""))
-            tipo_norm = re.sub(r"[^A-Z]", "", tipo.upper())
-
-            if "EGRESO" not in tipo_norm:
-                continue
+        for idx, row in con_progreso(df_egr[df_egr["_ES_NOTA_CREDITO_"]], avance=False):
 
             uuid_rel_val = str(row.get(col_uuid_rel, "")).strip()
             if not uuid_rel_val:
                 continue
 
-            if uuid_rel_val not in lookup.index:
+            if uuid_rel_val in lookup.index:
+                row_rel = lookup.loc[uuid_rel_val]
+            elif historico_egresos is not None and uuid_rel_val.upper() in historico_egresos.index:
+                row_rel = historico_egresos.loc[uuid_rel_val.upper()]
+            else:
                 continue
 
-            row_rel = lookup.loc[uuid_rel_val]
             if isinstance(row_rel, pd.DataFrame):
                 row_rel = row_rel.iloc[0]
 
@@ -216,6 +203,7 @@ def conciliar_estado_cuenta_con_movimientos(
 
             cand_banco = banco[
                 (banco[col_cargo].notna()) &
+                ~cargo_bancario &
                 (
                     np.isclose(
                         banco[col_cargo],
@@ -269,23 +257,20 @@ def conciliar_estado_cuenta_con_movimientos(
         df_ing["_UUID_NORM_"] = df_ing[col_uuid_ing].astype(str).str.strip()
         lookup_ing = df_ing.set_index("_UUID_NORM_", drop=False)
 
-        for idx, row in df_ing.iterrows():
-
-            tipo = str(row.get(col_tipo_ing, ""))
-            tipo_norm = re.sub(r"[^A-Z]", "", tipo.upper())
-
-            # 🔥 Solo aplicar cuando sea NOTA DE CREDITO (Egreso)
-            if "EGRESO" not in tipo_norm:
-                continue
+        # 🔥 Solo aplicar cuando sea NOTA DE CREDITO (Egreso)
+        for idx, row in con_progreso(df_ing[df_ing["_ES_NOTA_CREDITO_"]], avance=False):
 
             uuid_rel_val = str(row.get(col_uuid_rel_ing, "")).strip()
             if not uuid_rel_val:
                 continue
 
-            if uuid_rel_val not in lookup_ing.index:
+            if uuid_rel_val in lookup_ing.index:
+                row_rel = lookup_ing.loc[uuid_rel_val]
+            elif historico_ingresos is not None and uuid_rel_val.upper() in historico_ingresos.index:
+                row_rel = historico_ingresos.loc[uuid_rel_val.upper()]
+            else:
                 continue
 
-            row_rel = lookup_ing.loc[uuid_rel_val]
             if isinstance(row_rel, pd.DataFrame):
                 row_rel = row_rel.iloc[0]
 
@@ -296,6 +281,7 @@ def conciliar_estado_cuenta_con_movimientos(
 
             cand_banco = banco[
                 (banco[col_abono].notna()) &
+                ~cargo_bancario &
                 (
                     np.isclose(
                         banco[col_abono],
@@ -345,28 +331,21 @@ def conciliar_estado_cuenta_con_movimientos(
     # =========================================================
     # MATCH
     # =========================================================
-    def match(pack, monto, fecha_pago):
+    def _monto_col(pack):
+        # 🔥 Detectar si existe MONTO_AJUSTADO
         df = pack["df"]
+        return "MONTO_AJUSTADO" if "MONTO_AJUSTADO" in df.columns else pack["monto"]
 
-        # 🔥 Detectar si existe MONTO_AJUSTADO
-        monto_col = "MONTO_AJUSTADO" if "MONTO_AJUSTADO" in df.columns else pack["monto"]
+    def match(pack, ids, fecha_pago):
+        """ids = candidatos por monto (ya filtrados por tolerancia) en el orden del frame."""
+        df = pack["df"]
 
-        cand = df[
-            (~df["_USADO_"]) &
-            (
-                (df[monto_col].round(2) - round(monto, 2)).abs()
-                <= tolerancia
-            )
-        ]
+        cand = df.loc[ids]
+        cand = cand[~cand["_USADO_"]]
 
         # 🔥 EXCLUIR PUE + EFECTIVO del match bancario
         if pack["metodo"] and pack["forma"]:
-            cand = cand[
-                ~(
-                    cand[pack["metodo"]].astype(str).str.upper().str.contains("PUE", na=False) &
-                    cand[pack["forma"]].astype(str).str.upper().str.contains("EFECTIVO", na=False)
-                )
-            ]
+            cand = cand[~(cand["_ES_PUE_"] & cand["_ES_EFECTIVO_"])]
 
         if cand.empty:
             return None
@@ -376,12 +355,10 @@ def conciliar_estado_cuenta_con_movimientos(
 
         """ fallback_ppd = None """
 
-        for idx, row in cand.iterrows():
-            metodo = _norm(row.get(pack["metodo"]))
-            forma = _norm(row.get(pack["forma"]))
+        for idx, row in con_progreso(cand, avance=False):
 
             #* Si es PPD, se marca como PAGADO si la cantidad se encuentra en la hoja de COMPLEMENTOS y si esa cantidad en COMPLEMENTOS se encuentra en el estado de cuenta (banco)
-            if "PPD" in metodo:
+            if row["_ES_PPD_"]:
                 df.at[idx, pack["estado"]] = "PAGADO"
                 df.at[idx, pack["fecha_pago"]] = (
                     fecha_pago.strftime("%d/%m/%Y") if pd.notna(fecha_pago) else ""
@@ -394,7 +371,7 @@ def conciliar_estado_cuenta_con_movimientos(
                 return row, "PAGADO", pack
 
             # Restricciones PUE (se marca NO PAGADO y se usa)
-            if "PUE" in metodo and any(x in forma for x in RESTRICTED_PUE_FORMA):
+            if row["_PUE_RESTRINGIDO_"]:
                 df.at[idx, pack["estado"]] = "NO PAGADO"
                 df.at[idx, pack["fecha_pago"]] = ""
                 df.at[idx, "_USADO_"] = True
@@ -429,7 +406,42 @@ def conciliar_estado_cuenta_con_movimientos(
     # =========================================================
     # RECORRER BANCO Y CONCILIAR
     # =========================================================
-    for i, b in banco[~banco["_USADO_"]].iterrows():
+    # Candidatos monto ↔ movimiento generados de una sola vez (band join en centavos)
+    cand_folio = {}
+    cand_ing = {}
+    asignados_egr = {}
+
+    montos_banco = pd.Series(np.nan, index=banco.index)
+    if col_cargo:
+        montos_banco = montos_banco.fillna(banco[col_cargo])
+    if col_abono:
+        montos_banco = banco[col_abono].fillna(montos_banco)
+        cand_ing = candidatos_por_fila(generar_candidatos(
+            banco.loc[banco[col_abono] > 0, col_abono],
+            ing["df"][_monto_col(ing)],
+            tolerancia,
+            redondear=True,
+            motor=motor,
+        ))
+    if grupos_folio:
+        cand_folio = candidatos_por_fila(generar_candidatos(
+            montos_banco.round(2),
+            pd.Series({folio: data["total_pagado"] for folio, data in grupos_folio.items()}),
+            tolerancia,
+            motor=motor,
+        ))
+
+    # Egresos ↔ cargos en una sola pasada (los movimientos de un grupo por folio quedan fuera)
+    if col_cargo:
+        asignados_egr = conciliar_egresos_vs_banco(
+            egr,
+            banco,
+            disponibles=~banco["_USADO_"] & ~banco.index.isin(list(cand_folio)),
+            tolerancia=tolerancia,
+            motor=motor,
+        )
+
+    for i, b in con_progreso(banco[~banco["_USADO_"]]):
 
         fecha_pago = b[col_fecha_banco]
 
@@ -449,46 +461,44 @@ def conciliar_estado_cuenta_con_movimientos(
         # =========================================================
         # BUSCAR COINCIDENCIA POR FOLIO ACUMULADO
         # =========================================================
-        for folio_val, data in grupos_folio.items():
-
-            total = data["total_pagado"]
+        folios_match = cand_folio.get(i)
 
-            if abs(total - monto_banco) <= tolerancia:
+        if folios_match:
 
-                idxs = data["idxs"]
+            data = grupos_folio[folios_match[0]]
 
-                folios_doc = []
-                fechas = []
+            idxs = data["idxs"]
 
-                for idx in idxs:
+            folios_doc = []
+            fechas = []
 
-                    row = df_ing.loc[idx]
+            for idx in idxs:
 
-                    if pd.notna(row.get(col_folio_doc)):
-                        folios_doc.append(str(row[col_folio_doc]))
+                row = df_ing.loc[idx]
 
-                    if pd.notna(row.get(ing["fecha_em"])):
-                        fechas.append(
-                            row[ing["fecha_em"]].strftime("%d/%m/%Y")
-                        )
+                if pd.notna(row.get(col_folio_doc)):
+                    folios_doc.append(str(row[col_folio_doc]))
 
-                    df_ing.at[idx, "_USADO_"] = True
-                    df_ing.at[idx, ing["estado"]] = "PAGADO"
-                    df_ing.at[idx, ing["fecha_pago"]] = (
-                        fecha_pago.strftime("%d/%m/%Y")
-                        if pd.notna(fecha_pago)
-                        else ""
+                if pd.notna(row.get(ing["fecha_em"])):
+                    fechas.append(
+                        row[ing["fecha_em"]].strftime("%d/%m/%Y")
                     )
 
-                banco.at[i, col_folio_fact] = "-".join(folios_doc)
-                banco.at[i, col_fecha_fact] = "-".join(fechas)
-                banco.at[i, "OBSERVACIONES"] = "CONCILIADO"
+                df_ing.at[idx, "_USADO_"] = True
+                df_ing.at[idx, ing["estado"]] = "PAGADO"
+                df_ing.at[idx, ing["fecha_pago"]] = (
+                    fecha_pago.strftime("%d/%m/%Y")
+                    if pd.notna(fecha_pago)
+                    else ""
+                )
 
-                banco.at[i, "_USADO_"] = True
+            banco.at[i, col_folio_fact] = "-".join(folios_doc)
+            banco.at[i, col_fecha_fact] = "-".join(fechas)
+            banco.at[i, "OBSERVACIONES"] = "CONCILIADO"
 
-                conciliado = True
+            banco.at[i, "_USADO_"] = True
 
-                break
+            conciliado = True
 
         if conciliado:
             continue
@@ -499,10 +509,10 @@ def conciliar_estado_cuenta_con_movimientos(
         res = None
 
         if col_cargo and pd.notna(b.get(col_cargo)) and b[col_cargo] > 0:
-            res = match(egr, b[col_cargo], fecha_pago)
+            res = asignados_egr.get(i)
 
         if not res and col_abono and pd.notna(b.get(col_abono)) and b[col_abono] > 0:
-            res = match(ing, b[col_abono], fecha_pago)
+            res = match(ing, cand_ing.get(i, []), fecha_pago)
 
         if not res:
 
@@ -542,17 +552,19 @@ def conciliar_estado_cuenta_con_movimientos(
             
 
     # =========================================================
-    # Marcar ingresos no conciliados (sin pisar CANCELADOS)
+    # Marcar ingresos no conciliados (sin pisar CANCELADOS ni pagos PARCIAL de corridas previas)
     # =========================================================
     df_ing = ing["df"]
-    mask_no_conciliado = ~df_ing["_USADO_"]
+    mask_no_conciliado = ~df_ing["_USADO_"] & (
+        df_ing[ing["estado"]].astype(str).str.upper().str.strip() != "PARCIAL"
+    )
     df_ing.loc[mask_no_conciliado, ing["estado"]] = "NO LOCALIZADO"
 
     # =========================================================
     # Limpieza y orden final
     # =========================================================
-    ing["df"].drop(columns=["_USADO_"], inplace=True, errors="ignore")
-    egr["df"].drop(columns=["_USADO_"], inplace=True, errors="ignore")
+    ing["df"].drop(columns=["_USADO_"] + ing["banderas_agregadas"], inplace=True, errors="ignore")
+    egr["df"].drop(columns=["_USADO_"] + egr["banderas_agregadas"], inplace=True, errors="ignore")
 
     banco = mover_cancelados_al_final(banco)
     ingresos_out = mover_cancelados_al_final(ing["df"])
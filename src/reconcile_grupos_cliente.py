@@ -0,0 +1,208 @@
+import pandas as pd
+
+from .preprocessing import to_money, to_date, codificar_catalogos, es_cargo_bancario, folio_texto
+from .schema import normalizar_columnas, resolver_columnas
+from .progreso import con_progreso
+
+#* Ventana de emisión: facturas emitidas hasta N días antes del depósito (y unos días después)
+DIAS_ANTES_DEPOSITO = 60
+DIAS_DESPUES_DEPOSITO = 3
+
+#* Límites de la búsqueda por depósito y cliente (evitan la explosión combinatoria)
+MAX_FACTURAS_GRUPO = 10
+MAX_NODOS_BUSQUEDA = 20000
+
+ESTADOS_ABIERTOS = {"", "NAN", "NO LOCALIZADO"}
+
+
+def _fechas(series: pd.Series) -> pd.Series:
+    """Las etapas previas dejan las fechas como texto dd/mm/aaaa."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    fechas = pd.to_datetime(series, format="%d/%m/%Y", errors="coerce")
+    return fechas.fillna(to_date(series))
+
+
+def subset_sum_acotado(valores, objetivo, tolerancia=0, minimo=2, max_items=MAX_FACTURAS_GRUPO, max_nodos=MAX_NODOS_BUSQUEDA):
+    """
+    Busca posiciones de 'valores' (centavos > 0, en orden de preferencia) cuya suma
+    quede a 'tolerancia' centavos del objetivo, con entre 'minimo' y 'max_items' elementos.
+    Poda por suma restante y corta al agotar 'max_nodos'. Regresa la lista o None.
+    """
+    n = len(valores)
+    sufijo = [0] * (n + 1)
+    for k in range(n - 1, -1, -1):
+        sufijo[k] = sufijo[k + 1] + valores[k]
+
+    nodos = 0
+    elegidos = []
+
+    def buscar(inicio, suma):
+        nonlocal nodos
+        if len(elegidos) >= minimo and abs(suma - objetivo) <= tolerancia:
+            return list(elegidos)
+        if len(elegidos) == max_items:
+            return None
+
+        for k in range(inicio, n):
+            nodos += 1
+            if nodos > max_nodos:
+                return None
+            # Ni tomando todo lo que queda se alcanza el objetivo
+            if suma + sufijo[k] < objetivo - tolerancia:
+                return None
+            nueva = suma + valores[k]
+            if nueva > objetivo + tolerancia:
+                continue
+            elegidos.append(k)
+            encontrado = buscar(k + 1, nueva)
+            if encontrado:
+                return encontrado
+            elegidos.pop()
+
+        return None
+
+    if sufijo[0] < objetivo - tolerancia:
+        return None
+    return buscar(0, 0)
+
+
+def conciliar_abonos_multifactura(
+    ingresos: pd.DataFrame,
+    banco: pd.DataFrame,
+    tolerancia: float = 0.01,
+    dias_antes: int = DIAS_ANTES_DEPOSITO,
+    dias_despues: int = DIAS_DESPUES_DEPOSITO,
+):
+    """
+    Un abono que liquida varias facturas del mismo cliente (RFC / RAZON RECEPTOR).
+    Solo usa abonos sin conciliar y facturas abiertas (no PPD, no PUBLICO EN GENERAL,
+    no canceladas). Si más de un cliente cuadra con el abono, no se asigna.
+    """
+    ingresos = ingresos.copy()
+    banco = banco.copy()
+
+    normalizar_columnas(ingresos)
+    normalizar_columnas(banco)
+
+    cols_ing = resolver_columnas(ingresos)
+    cols_banco = resolver_columnas(banco)
+
+    col_total = cols_ing["doc.monto"]
+    col_estado = cols_ing["doc.estado_pago"]
+    col_fecha_pago = cols_ing["doc.fecha_pago"]
+    col_folio_ing = cols_ing["doc.folio"]
+    col_fecha_em = cols_ing["doc.fecha_emision"]
+    col_cliente = cols_ing["doc.rfc_receptor"] or cols_ing["doc.razon_receptor"]
+    col_obs_ing = cols_ing["doc.observaciones"] or "OBSERVACIONES"
+
+    col_abono = cols_banco["banco.abono"]
+    col_fecha_banco = cols_banco["banco.fecha"]
+    col_folio_fact = cols_banco["banco.folio_factura"]
+    col_fecha_fact = cols_banco["banco.fecha_factura"]
+
+    if not all([col_total, col_estado, col_fecha_em, col_cliente, col_abono, col_fecha_banco, col_folio_fact]):
+        return ingresos, banco
+
+    if not col_fecha_pago:
+        col_fecha_pago = "FECHA DE PAGO"
+        ingresos[col_fecha_pago] = ""
+    if col_obs_ing not in ingresos.columns:
+        ingresos[col_obs_ing] = ""
+    if "OBSERVACIONES" not in banco.columns:
+        banco["OBSERVACIONES"] = ""
+
+    banderas_agregadas = codificar_catalogos(ingresos)
+
+    # ===============================
+    # FACTURAS ABIERTAS
+    # ===============================
+    estado = ingresos[col_estado].astype(str).str.upper().str.strip()
+    cliente = ingresos[col_cliente].astype(str).str.upper().str.strip()
+    centavos_ing = (to_money(ingresos[col_total]).abs() * 100).round()
+    fecha_em = _fechas(ingresos[col_fecha_em])
+
+    abiertas = (
+        estado.isin(ESTADOS_ABIERTOS)
+        & ~ingresos["_ES_PPD_"]
+        & ~ingresos["_ES_PUBLICO_"]
+        & ~ingresos["_ES_CANCELADO_"]
+        & ~ingresos["_ES_NOTA_CREDITO_"]
+        & ~cliente.isin(["", "NAN", "NONE"])
+        & (centavos_ing > 0)
+        & fecha_em.notna()
+    )
+
+    facturas = pd.DataFrame({
+        "cliente": cliente[abiertas],
+        "centavos": centavos_ing[abiertas].astype("int64"),
+        "fecha": fecha_em[abiertas],
+    }).sort_values(["cliente", "fecha"], kind="stable")
+
+    # ===============================
+    # ABONOS SIN CONCILIAR
+    # ===============================
+    folio_fact = banco[col_folio_fact].fillna("").astype(str).str.strip()
+    obs_banco = banco["OBSERVACIONES"].fillna("").astype(str).str.strip()
+    centavos_banco = (to_money(banco[col_abono]).abs() * 100).round()
+    fecha_banco = _fechas(banco[col_fecha_banco])
+
+    libres = (
+        (centavos_banco > 0)
+        & (folio_fact == "")
+        & obs_banco.isin(["", "N/A"])
+        & fecha_banco.notna()
+        & ~es_cargo_bancario(banco)
+    )
+
+    tol_cent = int(round(tolerancia * 100))
+    usadas = set()
+
+    for i in con_progreso(banco.index[libres]):
+
+        objetivo = int(centavos_banco[i])
+        fecha_dep = fecha_banco[i]
+
+        en_ventana = facturas[
+            (facturas["fecha"] >= fecha_dep - pd.Timedelta(days=dias_antes))
+            & (facturas["fecha"] <= fecha_dep + pd.Timedelta(days=dias_despues))
+            & ~facturas.index.isin(usadas)
+        ]
+        if len(en_ventana) < 2:
+            continue
+
+        # Solo clientes cuyo saldo abierto en la ventana alcanza el abono
+        totales = en_ventana.groupby("cliente", sort=False)["centavos"].sum()
+        clientes = totales.index[totales >= objetivo - tol_cent]
+
+        soluciones = []
+        for c in clientes:
+            grupo = en_ventana[en_ventana["cliente"] == c]
+            posiciones = subset_sum_acotado(grupo["centavos"].tolist(), objetivo, tol_cent)
+            if posiciones:
+                soluciones.append(grupo.index[posiciones].tolist())
+            if len(soluciones) > 1:
+                break
+
+        # Ambiguo (varios clientes cuadran) o sin combinación
+        if len(soluciones) != 1:
+            continue
+
+        idxs = soluciones[0]
+        usadas.update(idxs)
+        fecha_txt = fecha_dep.strftime("%d/%m/%Y")
+
+        ingresos.loc[idxs, col_estado] = "PAGADO"
+        ingresos.loc[idxs, col_fecha_pago] = fecha_txt
+        ingresos.loc[idxs, col_obs_ing] = f"Conciliado en grupo con un abono ({len(idxs)} facturas)"
+
+        folios = [folio_texto(f) for f in ingresos.loc[idxs, col_folio_ing]] if col_folio_ing else []
+        folios = [f for f in folios if f]
+        banco.at[i, col_folio_fact] = "-".join(folios)
+        if col_fecha_fact:
+            banco.at[i, col_fecha_fact] = "-".join(fecha_em[idxs].dt.strftime("%d/%m/%Y"))
+        banco.at[i, "OBSERVACIONES"] = "CONCILIADO"
+
+    ingresos.drop(columns=banderas_agregadas, inplace=True)
+
+    return ingresos, banco
@@ -1,48 +1,37 @@
 import pandas as pd
-from rapidfuzz import fuzz
 
-from .config import (
-    FECHA_COL_CANDIDATES,
-    DESCRIP_COL_CANDIDATES,
-    EGRESO_MONTO_CANDIDATES,
-    EGRESO_FECHA_CANDIDATES,
-    EGRESO_CONCEPTO_CANDIDATES,
-    INGRESO_ID_CANDIDATES
-)
-from .preprocessing import pick_column, to_money, to_date
+from .preprocessing import to_money, to_date, codificar_catalogos
+from .candidatos import generar_candidatos, candidatos_por_fila
+from .similitud import preparar_textos, similitud_candidatos
+from .spei import campos_spei, llaves_documento, pares_con_llave
+from .schema import resolver_columnas
+from .progreso import con_progreso
 
 
 def conciliar_ingresos_vs_banco(
     ingresos: pd.DataFrame,
     banco: pd.DataFrame,
-    tolerancia: float = 1.0
+    tolerancia: float = 1.0,
+    motor: str = None,
 ):
     # =============================
     # COLUMNAS BANCO
     # =============================
-    col_abono = pick_column(
-        banco,
-        [
-            "ABONO", "ABONOS", "CREDITO", "CRÉDITO",
-            "DEPOSITO", "DEPÓSITO", "ENTRADA",
-            "ENTRADAS", "HABER", "IMPORTE", "MONTO"
-        ]
-    )
-    col_fecha_banco = pick_column(banco, FECHA_COL_CANDIDATES)
-    col_desc_banco = pick_column(banco, DESCRIP_COL_CANDIDATES)
+    cols_banco = resolver_columnas(banco)
+
+    col_abono = cols_banco["banco.abono"] or cols_banco["banco.monto"]
+    col_fecha_banco = cols_banco["banco.fecha"]
+    col_desc_banco = cols_banco["banco.descripcion"]
 
     # =============================
     # COLUMNAS INGRESOS
     # =============================
-    col_monto_ing = pick_column(ingresos, EGRESO_MONTO_CANDIDATES)
-    col_fecha_ing = pick_column(ingresos, EGRESO_FECHA_CANDIDATES)
-    col_conc_ing = pick_column(ingresos, EGRESO_CONCEPTO_CANDIDATES)
-    col_id_ing = pick_column(ingresos, INGRESO_ID_CANDIDATES)
-
-    col_metodo_pago = pick_column(
-        ingresos,
-        ["METODO", "METODO PAGO", "METODO_PAGO", "FORMA", "FORMA PAGO", "PAGO"]
-    )
+    cols_ing = resolver_columnas(ingresos)
+
+    col_monto_ing = cols_ing["doc.monto"]
+    col_fecha_ing = cols_ing["doc.fecha"]
+    col_conc_ing = cols_ing["doc.concepto"]
+    col_id_ing = cols_ing["doc.id"]
 
     if not col_abono or not col_fecha_banco or not col_monto_ing:
         raise ValueError("Faltan columnas necesarias para conciliación")
@@ -61,6 +50,7 @@ def conciliar_ingresos_vs_banco(
     # =============================
     ingresos = ingresos.copy()
     ingresos[col_monto_ing] = to_money(ingresos[col_monto_ing]).abs()
+    banderas_agregadas = codificar_catalogos(ingresos)
 
     if col_fecha_ing:
         ingresos["_FECHA_EMISION_DT"] = to_date(ingresos[col_fecha_ing])
@@ -78,43 +68,47 @@ def conciliar_ingresos_vs_banco(
     # =============================
     # 🔒 LIMPIEZA GLOBAL PPD (CLAVE)
     # =============================
-    if col_metodo_pago:
-        mask_ppd = (
-            ingresos[col_metodo_pago]
-            .astype(str)
-            .str.upper()
-            .str.startswith("PPD")
-        )
-        ingresos.loc[mask_ppd, [
-            "CONCILIADO_BANCO",
-            "ESTADO_INGRESO",
-            "FECHA_DE_COBRO",
-            "OBSERVACION"
-        ]] = ""
+    mask_ppd = ingresos["_ES_PPD_"]
+    ingresos.loc[mask_ppd, [
+        "CONCILIADO_BANCO",
+        "ESTADO_INGRESO",
+        "FECHA_DE_COBRO",
+        "OBSERVACION"
+    ]] = ""
 
     conciliados = 0
 
     # =============================
     # CONCILIACIÓN (SOLO PUE)
     # =============================
-    for i, ing in ingresos.iterrows():
-        metodo_pago = ""
-        if col_metodo_pago:
-            metodo_pago = str(ing.get(col_metodo_pago, "")).upper().strip()
-
-        # 🚫 PPD → JAMÁS SE CONCILIA
-        if metodo_pago.startswith("PPD"):
-            continue
+    # 🚫 PPD → JAMÁS SE CONCILIA
+    pares_ing = generar_candidatos(
+        ingresos.loc[~mask_ppd, col_monto_ing],
+        banco[col_abono],
+        float(tolerancia),
+        motor=motor,
+    )
+    candidatos_ing = candidatos_por_fila(pares_ing)
+
+    # Folio / RFC del CFDI igual al extraído de la descripción SPEI (join exacto sobre los pares)
+    con_llave_ing = pares_con_llave(pares_ing, llaves_documento(ingresos), campos_spei(banco))
+
+    # Similitud concepto ↔ descripción de todos los pares en un lote (textos preparados una vez)
+    similitud_ing = {}
+    if col_conc_ing and col_desc_banco:
+        similitud_ing = similitud_candidatos(
+            pares_ing,
+            preparar_textos(ingresos[col_conc_ing]),
+            preparar_textos(banco[col_desc_banco]),
+        )
 
+    for i, ing in con_progreso(ingresos[~mask_ppd]):
         monto = ing.get(col_monto_ing)
         if pd.isna(monto):
             continue
 
-        disponibles = banco[~banco["__USADO__"]]
-
-        candidates = disponibles[
-            (disponibles[col_abono] - float(monto)).abs() <= float(tolerancia)
-        ].copy()
+        candidates = banco.loc[candidatos_ing.get(i, [])]
+        candidates = candidates[~candidates["__USADO__"]].copy()
 
         # 🔴 NUEVO: marcar como NO PAGADO si no hay coincidencias
         if candidates.empty:
@@ -124,7 +118,11 @@ def conciliar_ingresos_vs_banco(
             ingresos.at[i, "OBSERVACION"] = "No encontrado en estado de cuenta"
             continue
 
-        if col_id_ing:
+        por_llave = candidates[candidates.index.isin(con_llave_ing.get(i, ()))]
+        if not por_llave.empty:
+            candidates = por_llave
+        elif col_id_ing:
+            # Sin llave estructurada: el id dentro del texto de la descripción
             id_doc = str(ing.get(col_id_ing, "")).strip()
             if id_doc:
                 by_id = candidates[
@@ -135,22 +133,14 @@ def conciliar_ingresos_vs_banco(
                 if not by_id.empty:
                     candidates = by_id
 
-        def score_row(row):
-            score = 0
-            if pd.notna(ing["_FECHA_EMISION_DT"]):
-                diff = abs(
-                    (ing["_FECHA_EMISION_DT"].normalize() - row[col_fecha_banco]).days
-                )
-                score += max(0, 300 - diff)
-
-            if col_conc_ing and col_desc_banco:
-                score += fuzz.token_set_ratio(
-                    str(ing.get(col_conc_ing, "")),
-                    str(row.get(col_desc_banco, ""))
-                )
-            return score
-
-        candidates["__SCORE__"] = candidates.apply(score_row, axis=1)
+        puntaje = pd.Series(0.0, index=candidates.index)
+        if pd.notna(ing["_FECHA_EMISION_DT"]):
+            dias = (ing["_FECHA_EMISION_DT"].normalize() - candidates[col_fecha_banco]).dt.days.abs()
+            puntaje += (300 - dias).clip(lower=0)
+        if i in similitud_ing:
+            # Candidatos ya filtrados (usados / por id): puntajes por etiqueta
+            puntaje += similitud_ing[i].reindex(candidates.index).to_numpy()
+        candidates["__SCORE__"] = puntaje
         best = candidates.sort_values("__SCORE__", ascending=False).iloc[0]
 
         # ✅ SOLO PUE SE MARCA PAGADO
@@ -167,5 +157,5 @@ def conciliar_ingresos_vs_banco(
         "No cobrados": int(len(ingresos) - conciliados),
     }
 
-    ingresos.drop(columns=["_FECHA_EMISION_DT"], inplace=True, errors="ignore")
+    ingresos.drop(columns=["_FECHA_EMISION_DT"] + banderas_agregadas, inplace=True, errors="ignore")
     return ingresos, resumen
@@ -1,5 +1,7 @@
 import pandas as pd
-from .preprocessing import pick_column, to_money, to_date
+from .preprocessing import to_money, to_date, es_cargo_bancario
+from .schema import resolver_columnas
+from .progreso import con_progreso
 
 
 def conciliar_ingresos_con_abonos(
@@ -13,11 +15,13 @@ def conciliar_ingresos_con_abonos(
     # ===============================
     # COLUMNAS INGRESOS
     # ===============================
-    col_total = pick_column(ingresos, ["TOTAL", "IMPORTE", "MONTO"])
-    col_estado = pick_column(ingresos, ["ESTADO DE PAGO", "ESTADO_PAGO"])
-    col_fecha_pago = pick_column(ingresos, ["FECHA DE PAGO", "FECHA_PAGO"])
-    col_folio_ing = pick_column(ingresos, ["FOLIO"])
-    col_fecha_em = pick_column(ingresos, ["FECHA EMISION", "FECHA_EMISION"])
+    cols_ing = resolver_columnas(ingresos)
+
+    col_total = cols_ing["doc.monto"]
+    col_estado = cols_ing["doc.estado_pago"]
+    col_fecha_pago = cols_ing["doc.fecha_pago"]
+    col_folio_ing = cols_ing["doc.folio"]
+    col_fecha_em = cols_ing["doc.fecha_emision"]
 
     if not col_estado:
         ingresos["ESTADO DE PAGO"] = ""
@@ -30,12 +34,14 @@ def conciliar_ingresos_con_abonos(
     # ===============================
     # COLUMNAS BANCO
     # ===============================
-    col_abono = pick_column(banco, ["ABONO", "ABONOS"])
-    col_cargo = pick_column(banco, ["CARGO", "CARGOS"])
-    col_fecha_banco = pick_column(banco, ["FECHA"])
+    cols_banco = resolver_columnas(banco)
+
+    col_abono = cols_banco["banco.abono"]
+    col_cargo = cols_banco["banco.cargo"]
+    col_fecha_banco = cols_banco["banco.fecha"]
 
-    col_folio_fact = pick_column(banco, ["FOLIO FACTURA"])
-    col_fecha_fact = pick_column(banco, ["FECHA FACTURA"])
+    col_folio_fact = cols_banco["banco.folio_factura"]
+    col_fecha_fact = cols_banco["banco.fecha_factura"]
 
     if not col_folio_fact:
         banco["FOLIO FACTURA"] = ""
@@ -63,13 +69,13 @@ def conciliar_ingresos_con_abonos(
         banco[col_cargo] = to_money(banco[col_cargo]).abs()
 
     banco[col_fecha_banco] = to_date(banco[col_fecha_banco])
-    banco["_USADO_ING_"] = False
+    banco["_USADO_ING_"] = es_cargo_bancario(banco).to_numpy()
 
     # ===============================
     # MATCH INGRESOS ↔ BANCO
     # ===============================
-    for i, ing in ingresos.iterrows():
-        if ing[col_estado] == "PAGADO":
+    for i, ing in con_progreso(ingresos):
+        if ing[col_estado] in ("PAGADO", "PARCIAL"):
             continue
 
         total = ing[col_total]
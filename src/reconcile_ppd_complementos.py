@@ -1,6 +1,112 @@
 import pandas as pd
-import numpy as np
-from .preprocessing import pick_column, to_money, to_date
+from .preprocessing import to_money, to_date, es_cargo_bancario
+from .schema import normalizar_columnas, resolver_columnas
+from .candidatos import generar_candidatos, candidatos_por_fila
+from .complementos import libro_de_pagos, normalizar_folio
+from .progreso import con_progreso
+
+COL_PAGADO_CP = "IMPORTE PAGADO CP"
+COL_SALDO = "SALDO INSOLUTO"
+
+
+def _cp_aplicados(ingresos, col_folio) -> set:
+    """Pares (folio factura, folio CP) ya registrados con importe en FOLIO CP / IMPORTE PAGADO CP."""
+    if "FOLIO CP" not in ingresos.columns or COL_PAGADO_CP not in ingresos.columns:
+        return set()
+
+    con_pago = to_money(ingresos[COL_PAGADO_CP]).fillna(0) > 0
+    folios_cp = ingresos.loc[con_pago, "FOLIO CP"].fillna("").astype(str).str.strip()
+    folios_cp = folios_cp[folios_cp != ""]
+    if folios_cp.empty:
+        return set()
+
+    cp = normalizar_folio(folios_cp.str.split("-").explode())
+    factura = normalizar_folio(ingresos.loc[cp.index, col_folio])
+    return set(zip(factura.tolist(), cp.tolist()))
+
+
+def _aplicar_libro(ingresos, pagos, detalle, col_folio, col_total, col_estado, col_fecha_pago, tolerancia):
+    """
+    pagos: un renglón por (complemento encontrado en banco, folio de factura), en orden.
+    Actualiza en sitio estado, fechas, folios de CP, importe pagado y saldo insoluto.
+    """
+    pagos = pagos.assign(
+        FOLIO=pagos["FOLIO"].astype(str).str.strip(),
+        FOLIO_CP=normalizar_folio(pagos["FOLIO_CP"]),
+        IMPORTE=pd.to_numeric(pagos["IMPORTE"], errors="coerce"),
+    )
+
+    # CP que la factura ya trae aplicados (índice de CFDI / corridas anteriores): no se vuelven a sumar
+    ya_aplicados = _cp_aplicados(ingresos, col_folio)
+    if ya_aplicados:
+        pares = pd.MultiIndex.from_arrays([pagos["FOLIO"], pagos["FOLIO_CP"]])
+        pagos = pagos[~pares.isin(list(ya_aplicados))]
+        if pagos.empty:
+            return
+    pagos = pagos.assign(SIN_DESGLOSE=pagos["IMPORTE"].isna())
+
+    # Datos por factura: CP aplicados y el último pago (mismo orden que el recorrido)
+    por_factura = pagos.groupby("FOLIO", sort=False).agg(
+        FECHA_PAGO=("FECHA_PAGO", "last"),
+        FECHA_CP=("FECHA_CP", "last"),
+        SIN_DESGLOSE=("SIN_DESGLOSE", "max"),
+    )
+    por_factura["FOLIO_CP"] = (
+        pagos.drop_duplicates(["FOLIO", "FOLIO_CP"]).groupby("FOLIO", sort=False)["FOLIO_CP"].agg("-".join)
+    )
+
+    # Importe por factura: desglose de la hoja COMPLEMENTOS, o el del CP si paga una sola factura
+    libro = (
+        libro_de_pagos(detalle, folios_cp=set(pagos["FOLIO_CP"]), excluir=ya_aplicados)
+        if detalle is not None else None
+    )
+    if libro is not None and not libro.empty:
+        por_factura["PAGADO"] = libro["PAGADO"].reindex(por_factura.index)
+        por_factura["SIN_DESGLOSE"] = por_factura["PAGADO"].isna()
+    else:
+        por_factura["PAGADO"] = pagos.groupby("FOLIO", sort=False)["IMPORTE"].sum()
+
+    if "OBSERVACIONES" not in ingresos.columns:
+        ingresos["OBSERVACIONES"] = ""
+
+    folio = normalizar_folio(ingresos[col_folio])
+    mask = folio.isin(por_factura.index)
+    if not mask.any():
+        return
+
+    fila = por_factura.reindex(folio[mask])
+    fila.index = ingresos.index[mask]
+
+    total = to_money(ingresos.loc[mask, col_total]).abs() if col_total else pd.Series(float("nan"), index=fila.index)
+    # Pagos ya registrados en corridas anteriores (modo por mes / incremental)
+    previo = to_money(ingresos.loc[mask, COL_PAGADO_CP]).fillna(0)
+    pagado = previo + fila["PAGADO"].fillna(0)
+
+    # Sin desglose o sin TOTAL no se puede medir el saldo: se toma como pago completo
+    completo = fila["SIN_DESGLOSE"].astype(bool) | total.isna()
+    pagado = pagado.where(~completo, total)
+    saldo = (total - pagado).clip(lower=0).round(2).where(~completo, 0.0)
+    parcial = saldo > tolerancia
+
+    ingresos.loc[mask, col_estado] = parcial.map({True: "PARCIAL", False: "PAGADO"})
+    ingresos.loc[mask, "OBSERVACIONES"] = parcial.map({
+        True: "PAGO PARCIAL POR MEDIO DE COMPLEMENTOS",
+        False: "PAGADO POR MEDIO DE COMPLEMENTOS",
+    })
+    # Parcialidades de corridas anteriores: se conservan sus CP
+    folio_cp = fila["FOLIO_CP"]
+    folio_cp_previo = ingresos.loc[mask, "FOLIO CP"].fillna("").astype(str).str.strip()
+    con_previo = (previo > 0) & (folio_cp_previo != "")
+    folio_cp = folio_cp.where(~con_previo, folio_cp_previo + "-" + folio_cp)
+    ingresos.loc[mask, "FOLIO CP"] = folio_cp
+    ingresos.loc[mask, COL_PAGADO_CP] = pagado.round(2)
+    ingresos.loc[mask, COL_SALDO] = saldo
+
+    # Fechas solo donde hubo dato (como antes, el último pago manda)
+    con_fecha = fila["FECHA_PAGO"].notna()
+    ingresos.loc[con_fecha[con_fecha].index, col_fecha_pago] = fila.loc[con_fecha, "FECHA_PAGO"]
+    con_fecha_cp = fila["FECHA_CP"].notna()
+    ingresos.loc[con_fecha_cp[con_fecha_cp].index, "FECHA CP"] = fila.loc[con_fecha_cp, "FECHA_CP"]
 
 
 def conciliar_ppd_desde_complementos(
@@ -9,7 +115,15 @@ def conciliar_ppd_desde_complementos(
     banco: pd.DataFrame,
     tolerancia: float = 0.01,
     tipo_movimiento: str = "ABONO",  # "ABONO" para ingresos, "CARGO" para egresos
+    motor: str = None,
+    detalle: pd.DataFrame = None,
 ):
+    """
+    Cada complemento (agrupado por folio de CP) se busca en el banco por su importe.
+    Con los complementos encontrados se arma un libro de pagos por factura: lo pagado
+    contra el TOTAL deja la factura PAGADO o PARCIAL con su SALDO INSOLUTO.
+    'detalle' es la hoja COMPLEMENTOS sin agrupar (desglose por factura de cada CP).
+    """
     banco = banco.copy()
     complementos = complementos.copy()
     ingresos_acumulado = ingresos_acumulado.copy()
@@ -18,28 +132,30 @@ def conciliar_ppd_desde_complementos(
     # NORMALIZAR COLUMNAS
     # ===============================
     for df in (banco, complementos, ingresos_acumulado):
-        df.columns = df.columns.astype(str).str.upper().str.strip()
+        normalizar_columnas(df)
+
+    cols_comp = resolver_columnas(complementos)
+    cols_ing = resolver_columnas(ingresos_acumulado)
+    cols_banco = resolver_columnas(banco)
 
-    banco["_USADO_PPD_"] = False
+    # Comisiones / impuestos del banco quedan fuera desde el inicio
+    banco["_USADO_PPD_"] = es_cargo_bancario(banco).to_numpy()
 
     # ===============================
     # COLUMNAS COMPLEMENTOS
     # ===============================
-    col_folio_doc = pick_column(complementos, ["FOLIO DOCUMENTO", "FOLIO DOC", "FOLIO"])
-    col_fecha_doc = pick_column(
-        complementos,
-        ["FECHA EMISION (DOC)", "FECHA EMISION(DOC)", "FECHA EMISION DOC", "FECHA DOC"]
-    )
-    col_importe_pag = pick_column(complementos, ["IMPORTE PAGADO"])
-    col_folio_cp = pick_column(complementos, ["FOLIO", "FOLIO COMPLEMENTO DE PAGO"])
-    col_fecha_cp = pick_column(complementos, ["FECHA EMISION", "FECHA COMPLEMENTO DE PAGO"])
+    col_folio_doc = cols_comp["comp.folio_documento"]
+    col_fecha_doc = cols_comp["comp.fecha_doc"]
+    col_importe_pag = cols_comp["comp.importe_pagado"]
+    col_folio_cp = cols_comp["comp.folio"]
+    col_fecha_cp = cols_comp["comp.fecha_cp"]
 
     # ===============================
     # COLUMNAS INGRESOS / EGRESOS
     # ===============================
-    col_folio_ing = pick_column(ingresos_acumulado, ["FOLIO"])
-    col_estado = pick_column(ingresos_acumulado, ["ESTADO DE PAGO"])
-    col_fecha_pago = pick_column(ingresos_acumulado, ["FECHA DE PAGO"])
+    col_folio_ing = cols_ing["doc.folio"]
+    col_estado = cols_ing["doc.estado_pago"]
+    col_fecha_pago = cols_ing["doc.fecha_pago"]
 
     if not col_estado:
         ingresos_acumulado["ESTADO DE PAGO"] = ""
@@ -53,15 +169,15 @@ def conciliar_ppd_desde_complementos(
     # COLUMNAS BANCO (DINÁMICO)
     # ===============================
     if tipo_movimiento.upper() == "ABONO":
-        col_mov = pick_column(banco, ["ABONO", "ABONOS"])
+        col_mov = cols_banco["banco.abono"]
     else:
-        col_mov = pick_column(banco, ["CARGO", "CARGOS"])
+        col_mov = cols_banco["banco.cargo"]
 
-    col_fecha_banco = pick_column(banco, ["FECHA"])
-    col_folio_fact = pick_column(banco, ["FOLIO FACTURA"]) or "FOLIO FACTURA"
-    col_fecha_fact = pick_column(banco, ["FECHA FACTURA"]) or "FECHA FACTURA"
-    col_folio_cp_out = pick_column(banco, ["FOLIO COMPLEMENTO DE PAGO"]) or "FOLIO COMPLEMENTO DE PAGO"
-    col_fecha_cp_out = pick_column(banco, ["FECHA COMPLEMENTO DE PAGO", "FCHA COMPLEMENTO DE PAGO"]) or "FECHA COMPLEMENTO DE PAGO"
+    col_fecha_banco = cols_banco["banco.fecha"]
+    col_folio_fact = cols_banco["banco.folio_factura"] or "FOLIO FACTURA"
+    col_fecha_fact = cols_banco["banco.fecha_factura"] or "FECHA FACTURA"
+    col_folio_cp_out = cols_banco["banco.folio_cp"] or "FOLIO COMPLEMENTO DE PAGO"
+    col_fecha_cp_out = cols_banco["banco.fecha_cp"] or "FECHA COMPLEMENTO DE PAGO"
 
     #* Reutilizar columnas existentes (evita duplicados)
     for c in [col_folio_fact, col_fecha_fact, col_folio_cp_out, col_fecha_cp_out]:
@@ -91,7 +207,23 @@ def conciliar_ppd_desde_complementos(
     if "FECHA CP" not in ingresos_acumulado.columns:
         ingresos_acumulado["FECHA CP"] = ""
 
-    for _, cp in complementos.iterrows():
+    for c in (COL_PAGADO_CP, COL_SALDO):
+        if c not in ingresos_acumulado.columns:
+            ingresos_acumulado[c] = ""
+
+    # Movimientos candidatos por complemento (mismo criterio que np.isclose: atol + rtol)
+    candidatos_cp = candidatos_por_fila(generar_candidatos(
+        complementos[col_importe_pag],
+        banco.loc[~banco["_USADO_PPD_"], col_mov],
+        tolerancia,
+        rtol=1e-05,
+        motor=motor,
+    ))
+
+    # Pagos encontrados en banco (el libro por factura se arma después, de una sola vez)
+    aplicados = []
+
+    for i_cp, cp in con_progreso(complementos):
 
         folio = cp[col_folio_doc]
         monto = cp[col_importe_pag]
@@ -103,29 +235,9 @@ def conciliar_ppd_desde_complementos(
 
         folios_cp = [f.strip() for f in folio_norm.split("-")]
 
-        print("Folio complemento:", repr(folio_norm))
-        print("Folios ingresos únicos:", ingresos_acumulado[col_folio_ing].astype(str).unique())
-
-        mask_ing = (
-            ingresos_acumulado[col_folio_ing]
-                .astype(str)
-                .str.replace(".0", "", regex=False)
-                .str.strip()
-                .isin(folios_cp)
-        )
-
         # 🔎 Buscar movimiento en banco
-        movs = banco[
-            (banco[col_mov].notna()) &
-            (
-                np.isclose(
-                    banco[col_mov],
-                    monto,
-                    atol=tolerancia
-                )
-            ) &
-            (~banco["_USADO_PPD_"])
-        ]
+        movs = banco.loc[candidatos_cp.get(i_cp, [])]
+        movs = movs[~movs["_USADO_PPD_"]]
 
         if movs.empty:
             continue
@@ -155,36 +267,31 @@ def conciliar_ppd_desde_complementos(
 
         banco.at[mov.name, "_USADO_PPD_"] = True
 
-        # ===============================
-        # ACTUALIZAR INGRESOS / EGRESOS
-        # ===============================
-        if mask_ing.any():
-            ingresos_acumulado.loc[mask_ing, col_estado] = "PAGADO"
-        
-        # 🔥 AGREGAR OBSERVACIÓN EN INGRESOS
-        ingresos_acumulado.loc[
-            mask_ing,
-            "OBSERVACIONES"
-        ] = "PAGADO POR MEDIO DE COMPLEMENTOS"
-
-        if col_fecha_banco and pd.notna(mov[col_fecha_banco]):
-            ingresos_acumulado.loc[mask_ing, col_fecha_pago] = (
-                mov[col_fecha_banco].strftime("%d/%m/%Y")
-            )
+        fecha_pago = mov[col_fecha_banco] if col_fecha_banco else None
+        fecha_cp = cp[col_fecha_cp] if col_fecha_cp else None
 
-        # 🔥 NUEVA FUNCIONALIDAD
-        if "FOLIO CP" not in ingresos_acumulado.columns:
-            ingresos_acumulado["FOLIO CP"] = ""
+        aplicados.append({
+            "FOLIO": folios_cp,
+            "FOLIO_CP": str(cp[col_folio_cp]),
+            "IMPORTE": monto if len(folios_cp) == 1 else None,
+            "FECHA_PAGO": fecha_pago.strftime("%d/%m/%Y") if pd.notna(fecha_pago) else None,
+            "FECHA_CP": fecha_cp.strftime("%d/%m/%Y") if pd.notna(fecha_cp) else None,
+        })
 
-        if "FECHA CP" not in ingresos_acumulado.columns:
-            ingresos_acumulado["FECHA CP"] = ""
-
-        ingresos_acumulado.loc[mask_ing, "FOLIO CP"] = cp[col_folio_cp]
-
-        if col_fecha_cp and pd.notna(cp[col_fecha_cp]):
-            ingresos_acumulado.loc[mask_ing, "FECHA CP"] = (
-                cp[col_fecha_cp].strftime("%d/%m/%Y")
-            )
+    # ===============================
+    # ACTUALIZAR INGRESOS / EGRESOS (LIBRO DE PAGOS)
+    # ===============================
+    if aplicados and col_folio_ing:
+        _aplicar_libro(
+            ingresos_acumulado,
+            pd.DataFrame(aplicados).explode("FOLIO"),
+            detalle,
+            col_folio_ing,
+            cols_ing["doc.monto"],
+            col_estado,
+            col_fecha_pago,
+            tolerancia,
+        )
 
     banco.drop(columns=["_USADO_PPD_"], inplace=True, errors="ignore")
 
@@ -1,9 +1,8 @@
 import pandas as pd
-import unicodedata
 
-def _norm_no_accents(s: str) -> str:
-    s = str(s or "").strip().upper()
-    return unicodedata.normalize("NFKD", s).encode("ASCII", "ignore").decode("ASCII")
+from .preprocessing import codificar_catalogos, evaluar_por_categoria, norm_sin_acentos, es_cargo_bancario
+from .schema import normalizar_columnas, resolver_columnas
+from .progreso import con_progreso
 
 
 def conciliar_publico_en_general_subset(
@@ -14,27 +13,23 @@ def conciliar_publico_en_general_subset(
     ingresos = ingresos.copy()
     banco = banco.copy()
 
-    ingresos.columns = ingresos.columns.astype(str).str.upper().str.strip()
-    banco.columns = banco.columns.astype(str).str.upper().str.strip()
+    normalizar_columnas(ingresos)
+    normalizar_columnas(banco)
 
-    def pick(df, candidates):
-        cols = {c.upper().strip(): c for c in df.columns}
-        for cand in candidates:
-            if cand.upper().strip() in cols:
-                return cols[cand.upper().strip()]
-        return None
+    cols_ing = resolver_columnas(ingresos)
+    cols_banco = resolver_columnas(banco)
 
-    col_razon = pick(ingresos, ["RAZON RECEPTOR", "RAZON_RECEPTOR", "RAZON"])
-    col_total = pick(ingresos, ["TOTAL", "MONTO", "IMPORTE"])
-    col_estado = pick(ingresos, ["ESTADO DE PAGO", "ESTADO_PAGO"])
-    col_fecha_pago = pick(ingresos, ["FECHA DE PAGO", "FECHA_PAGO"])
-    col_folio_ing = pick(ingresos, ["FOLIO"])
-    col_fecha_em_ing = pick(ingresos, ["FECHA EMISION", "FECHA_EMISION"])
+    col_razon = cols_ing["doc.razon_receptor"]
+    col_total = cols_ing["doc.monto"]
+    col_estado = cols_ing["doc.estado_pago"]
+    col_fecha_pago = cols_ing["doc.fecha_pago"]
+    col_folio_ing = cols_ing["doc.folio"]
+    col_fecha_em_ing = cols_ing["doc.fecha_emision"]
 
-    col_abono = pick(banco, ["ABONOS", "ABONO"])
-    col_fecha_banco = pick(banco, ["FECHA"])
-    col_folio_fact = pick(banco, ["FOLIO FACTURA"])
-    col_fecha_fact = pick(banco, ["FECHA FACTURA"])
+    col_abono = cols_banco["banco.abono"]
+    col_fecha_banco = cols_banco["banco.fecha"]
+    col_folio_fact = cols_banco["banco.folio_factura"]
+    col_fecha_fact = cols_banco["banco.fecha_factura"]
 
     if not all([col_razon, col_total, col_abono, col_fecha_banco, col_folio_fact]):
         return ingresos, banco
@@ -51,22 +46,19 @@ def conciliar_publico_en_general_subset(
     banco[col_abono] = pd.to_numeric(banco[col_abono], errors="coerce").fillna(0).abs().round(2)
     banco[col_fecha_banco] = pd.to_datetime(banco[col_fecha_banco], errors="coerce")
 
-    for i, ing in ingresos.iterrows():
+    banderas_agregadas = codificar_catalogos(ingresos)
+    pagado = evaluar_por_categoria(ingresos[col_estado], lambda v: norm_sin_acentos(v) in ("PAGADO", "PARCIAL"))
+    pendientes = ingresos[ingresos["_ES_PUBLICO_"].to_numpy() & ~pagado]
+    cargo_bancario = es_cargo_bancario(banco)
 
-        estado = _norm_no_accents(ing.get(col_estado, ""))
-        if estado == "PAGADO":
-            continue
-
-        razon = _norm_no_accents(ing.get(col_razon, ""))
-        if "PUBLICO" not in razon:
-            continue
+    for i, ing in con_progreso(pendientes):
 
         target = float(ing.get(col_total, 0))
         if target <= 0:
             continue
 
         folio_vacio = banco[col_folio_fact].isna() | (banco[col_folio_fact].astype(str).str.strip() == "")
-        pool = banco[(banco[col_abono] > 0) & folio_vacio].copy()
+        pool = banco[(banco[col_abono] > 0) & folio_vacio & ~cargo_bancario].copy()
 
         if pool.empty:
             continue
@@ -128,4 +120,6 @@ def conciliar_publico_en_general_subset(
         if "OBSERVACIONES" in ingresos.columns:
             ingresos.at[i, "OBSERVACIONES"] = f"Conciliado PUBLICO EN GENERAL ({len(usados_idx)} abonos)"
 
+    ingresos.drop(columns=banderas_agregadas, inplace=True)
+
     return ingresos, banco
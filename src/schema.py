@@ -0,0 +1,154 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+import pandas as pd
+
+from .config import COLUMN_ALIASES
+
+
+def normalizar_alias(nombre) -> str:
+    """Clave de comparación: sin acentos, mayúsculas y solo letras/números."""
+    s = unicodedata.normalize("NFKD", str(nombre)).encode("ASCII", "ignore").decode("ASCII")
+    return re.sub(r"[^A-Z0-9]", "", s.upper())
+
+
+#* Alias ya normalizados (se calcula una vez al importar)
+_ALIAS_NORM = {
+    rol: [(alias, normalizar_alias(alias)) for alias in aliases]
+    for rol, aliases in COLUMN_ALIASES.items()
+}
+
+
+def _firma(df: pd.DataFrame) -> tuple:
+    # LazyFrame de polars solo expone su esquema (sin evaluar el plan)
+    columnas = df.collect_schema().names() if hasattr(df, "collect_schema") else df.columns
+    return tuple(str(c) for c in columnas)
+
+
+@lru_cache(maxsize=256)
+def _encabezados(firma: tuple) -> tuple:
+    return tuple(c.upper().strip() for c in firma)
+
+
+@lru_cache(maxsize=256)
+def _indice(firma: tuple) -> dict:
+    indice = {}
+    for col in firma:
+        indice.setdefault(normalizar_alias(col), col)
+    return indice
+
+
+@lru_cache(maxsize=256)
+def _compilar(firma: tuple):
+    """
+    Resuelve todos los roles del registro para un layout de encabezados.
+    Regresa (rol -> columna, rol -> alias que coincidió).
+    """
+    indice = _indice(firma)
+
+    mapping, coincidencias = {}, {}
+    for rol, aliases in _ALIAS_NORM.items():
+        mapping[rol] = None
+        for alias, clave in aliases:
+            if clave in indice:
+                mapping[rol] = indice[clave]
+                coincidencias[rol] = alias
+                break
+
+    return mapping, coincidencias
+
+
+def normalizar_columnas(df: pd.DataFrame) -> pd.DataFrame:
+    """Encabezados en mayúsculas y sin espacios sobrantes (en sitio)."""
+    df.columns = list(_encabezados(_firma(df)))
+    return df
+
+
+def resolver_columnas(df: pd.DataFrame) -> dict:
+    """
+    rol -> nombre real de la columna (o None) según COLUMN_ALIASES.
+    El resultado se cachea por la firma de encabezados del libro.
+    """
+    mapping, _ = _compilar(_firma(df))
+    return dict(mapping)
+
+
+def reporte_columnas(df: pd.DataFrame, prefijo: str = "") -> pd.DataFrame:
+    """Tabla rol / columna / alias coincidente (útil para revisar layouts nuevos)."""
+    mapping, coincidencias = _compilar(_firma(df))
+    filas = [
+        {"ROL": rol, "COLUMNA": col, "ALIAS": coincidencias.get(rol)}
+        for rol, col in mapping.items()
+        if rol.startswith(prefijo)
+    ]
+    return pd.DataFrame(filas, columns=["ROL", "COLUMNA", "ALIAS"])
+
+
+def buscar_columna(df: pd.DataFrame, candidates):
+    """Búsqueda ad hoc (fuera del registro) con la misma normalización."""
+    indice = _indice(_firma(df))
+    for c in candidates:
+        clave = normalizar_alias(c)
+        if clave in indice:
+            return indice[clave]
+    return None
+
+
+# =====================================
+# PROYECCIÓN (COLUMNAS DE TRABAJO)
+# =====================================
+#* Columna con la posición original de cada fila (para reunir al final)
+COLUMNA_FILA = "_FILA_"
+
+#* Columnas que las etapas leen o completan por nombre literal (además de los roles doc.*)
+COLUMNAS_ETAPAS = (
+    "MONTO_AJUSTADO",
+    "CONCILIADO_BANCO",
+    "FOLIO CP",
+    "FECHA CP",
+    "IMPORTE PAGADO CP",
+    "SALDO INSOLUTO",
+    "ESTADO DE PAGO",
+    "FECHA DE PAGO",
+    "OBSERVACIONES",
+    "OBSERVACION",
+    "ESTADO_INGRESO",
+    "ESTADO_EGRESO",
+    "FECHA_DE_COBRO",
+    "FECHA_DE_PAGO",
+)
+
+
+def columnas_de_trabajo(df: pd.DataFrame, extra=()) -> list:
+    """Columnas que usan las etapas: roles doc.*, COLUMNAS_ETAPAS y 'extra' (en el orden del frame)."""
+    mapping, _ = _compilar(_firma(df))
+    usadas = {col for rol, col in mapping.items() if rol.startswith("doc.") and col is not None}
+    usadas.update(COLUMNAS_ETAPAS)
+    usadas.update(extra)
+    return [c for c in df.columns if c in usadas]
+
+
+def proyectar(df: pd.DataFrame, extra=()):
+    """
+    Separa un ACUMULADO en (ancho, angosto). El angosto solo trae las columnas de
+    trabajo más COLUMNA_FILA; las etapas operan sobre él y el ancho se reúne al
+    final con reunir(). Los encabezados del ancho quedan normalizados.
+    """
+    ancho = normalizar_columnas(df.copy())
+    ancho[COLUMNA_FILA] = range(len(ancho))
+    angosto = ancho[columnas_de_trabajo(ancho, extra) + [COLUMNA_FILA]].copy()
+    return ancho, angosto
+
+
+def reunir(ancho: pd.DataFrame, angosto: pd.DataFrame) -> pd.DataFrame:
+    """
+    Frame completo con las filas (y el orden) del angosto: las columnas de trabajo
+    se reemplazan en su lugar y las nuevas se agregan al final, como en las etapas.
+    """
+    df = ancho.set_index(COLUMNA_FILA).loc[angosto[COLUMNA_FILA].to_numpy()]
+    df.index = angosto.index
+    for col in angosto.columns:
+        if col != COLUMNA_FILA:
+            df[col] = angosto[col]
+    return df
@@ -0,0 +1,132 @@
+"""
+Similitud de textos (concepto / proveedor vs descripción bancaria) con rapidfuzz.
+
+Las descripciones se preparan una vez por frame (sin acentos, mayúsculas, sin
+signos y sin tokens que no distinguen nada como SPEI o TRANSF). Los puntajes de
+todos los pares candidatos de una etapa se calculan en un solo lote con
+rapidfuzz.process.cpdist, y se guardan en un cache LRU por hash del par
+normalizado. El cache se puede guardar en Parquet y reutilizar mes con mes
+(los mismos proveedores y descripciones se repiten). Es compartido por todas
+las sesiones de la app e hilos del proceso, así que todo acceso pasa por un lock.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+from .config import TOKENS_VACIOS_DESCRIPCION, TAMANO_CACHE_SIMILITUD
+from .preprocessing import norm_sin_acentos
+
+_SEPARADOR = "\x1f"
+
+#* Cache LRU: hash del par normalizado -> puntaje
+_CACHE = OrderedDict()
+_BLOQUEO = threading.Lock()
+
+
+# =====================================
+# PREPARAR TEXTOS
+# =====================================
+def preparar_texto(x) -> str:
+    if x is None or (isinstance(x, float) and np.isnan(x)):
+        return ""
+    tokens = re.sub(r"[^A-Z0-9]+", " ", norm_sin_acentos(x)).split()
+    return " ".join(t for t in tokens if t not in TOKENS_VACIOS_DESCRIPCION)
+
+
+def preparar_textos(series: pd.Series) -> pd.Series:
+    """Texto preparado por fila; se calcula una vez por valor distinto."""
+    cat = series.astype("category")
+    preparados = np.array([preparar_texto(v) for v in cat.cat.categories] + [""], dtype=object)
+    # Código -1 (nulo) apunta al "" del final
+    return pd.Series(preparados[cat.cat.codes.to_numpy()], index=series.index)
+
+
+# =====================================
+# PUNTAJES (LOTE + CACHE)
+# =====================================
+def _claves(izq: np.ndarray, der: np.ndarray) -> np.ndarray:
+    # Hash estable entre procesos y corridas (a diferencia de hash())
+    pares = np.char.add(np.char.add(izq.astype(str), _SEPARADOR), der.astype(str))
+    return pd.util.hash_array(pares.astype(object))
+
+
+def _guardar_en_cache(claves, puntajes):
+    with _BLOQUEO:
+        for clave, puntaje in zip(claves.tolist(), puntajes.tolist()):
+            _CACHE[clave] = puntaje
+        while len(_CACHE) > TAMANO_CACHE_SIMILITUD:
+            _CACHE.popitem(last=False)
+
+
+def similitud_pares(izq, der) -> np.ndarray:
+    """token_set_ratio de cada par (izq[k], der[k]) de textos ya preparados."""
+    izq = np.asarray(izq, dtype=object)
+    der = np.asarray(der, dtype=object)
+    puntajes = np.zeros(len(izq), dtype=float)
+    if not len(izq):
+        return puntajes
+
+    claves = _claves(izq, der)
+    faltan = np.ones(len(izq), dtype=bool)
+    with _BLOQUEO:
+        for k, clave in enumerate(claves.tolist()):
+            puntaje = _CACHE.get(clave)
+            if puntaje is not None:
+                _CACHE.move_to_end(clave)
+                puntajes[k] = puntaje
+                faltan[k] = False
+
+    # Fuera del lock: el lote puede tardar y otros hilos siguen leyendo el cache
+    if faltan.any():
+        nuevos = process.cpdist(
+            izq[faltan].tolist(),
+            der[faltan].tolist(),
+            scorer=fuzz.token_set_ratio,
+            processor=None,
+            workers=-1,
+        )
+        puntajes[faltan] = nuevos
+        _guardar_en_cache(claves[faltan], puntajes[faltan])
+
+    return puntajes
+
+
+def similitud_candidatos(pares: pd.DataFrame, textos_izq: pd.Series, textos_der: pd.Series) -> dict:
+    """
+    Puntajes de todos los pares candidatos (IZQ, DER) en un solo lote.
+    Regresa {etiqueta_izq: Series de puntajes indexada por etiqueta_der}.
+    """
+    if pares.empty:
+        return {}
+    puntajes = pd.Series(
+        similitud_pares(textos_izq.loc[pares["IZQ"]].to_numpy(), textos_der.loc[pares["DER"]].to_numpy()),
+        index=pares["DER"].to_numpy(),
+    )
+    posiciones = pares.groupby("IZQ", sort=False).indices
+    return {izq: puntajes.iloc[pos] for izq, pos in posiciones.items()}
+
+
+# =====================================
+# CACHE PERSISTENTE
+# =====================================
+def cargar_cache(ruta: str) -> int:
+    """Carga un cache guardado con guardar_cache. Regresa cuántos pares se cargaron."""
+    df = pd.read_parquet(ruta)
+    _guardar_en_cache(df["CLAVE"].to_numpy(np.uint64), df["PUNTAJE"].to_numpy(float))
+    return len(df)
+
+
+def guardar_cache(ruta: str):
+    with _BLOQUEO:
+        claves = np.fromiter(_CACHE.keys(), dtype=np.uint64, count=len(_CACHE))
+        puntajes = np.fromiter(_CACHE.values(), dtype=float, count=len(_CACHE))
+    pd.DataFrame({"CLAVE": claves, "PUNTAJE": puntajes}).to_parquet(ruta)
+
+
+def limpiar_cache():
+    with _BLOQUEO:
+        _CACHE.clear()
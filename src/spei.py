@@ -0,0 +1,130 @@
+"""
+Campos estructurados de las descripciones SPEI (clave de rastreo, RFC, CLABE, folio, referencia).
+
+Se extraen una vez por texto distinto con regex compiladas (Series.str.extract) y
+quedan como columnas de texto en el banco. Los cruces por monto usan esas llaves para
+preferir, con un join exacto sobre los pares candidatos, el movimiento cuyo folio o
+RFC coincide con el CFDI; la similitud fuzzy solo decide cuando no hay llave.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from .config import PATRONES_SPEI
+from .preprocessing import norm_sin_acentos
+from .schema import resolver_columnas
+
+#* Columnas internas del banco (una por campo)
+COLUMNAS_SPEI = {campo: f"_SPEI_{campo}_" for campo in PATRONES_SPEI}
+
+_PATRONES = {campo: re.compile(patron) for campo, patron in PATRONES_SPEI.items()}
+
+#* Campos que pueden venir varias veces (RFC del ordenante y del beneficiario): se guardan todos
+_MULTIPLES = {"RFC"}
+_SEPARADOR = "|"
+
+
+def normalizar_llave(series: pd.Series) -> pd.Series:
+    """Folio / RFC comparable: mayúsculas, sin espacios ni '.0' de Excel; nulos como <NA>."""
+    llave = (
+        series.astype("string")
+        .str.upper()
+        .str.replace(r"\.0$", "", regex=True)
+        .str.replace(r"\s+", "", regex=True)
+    )
+    return llave.mask(llave.isin(["", "NAN", "NONE"]))
+
+
+def extraer_campos_spei(banco: pd.DataFrame) -> pd.DataFrame:
+    """Un frame con COLUMNAS_SPEI (dtype string) indexado como el banco."""
+    cols = resolver_columnas(banco)
+    textos = [banco[c].fillna("").astype(str) for c in (cols["banco.descripcion"], cols["banco.referencia"]) if c]
+    vacio = pd.DataFrame(
+        {col: pd.Series(pd.NA, index=banco.index, dtype="string") for col in COLUMNAS_SPEI.values()}
+    )
+    if not textos:
+        return vacio
+
+    texto = textos[0]
+    for otro in textos[1:]:
+        texto = texto + " " + otro
+
+    # Cada regex corre una vez por texto distinto
+    cat = texto.astype("category")
+    unicos = pd.Series([norm_sin_acentos(v) for v in cat.cat.categories], dtype="object")
+    codes = cat.cat.codes.to_numpy()
+    posiciones = np.where(codes >= 0, codes, len(unicos))
+
+    campos = {}
+    for campo, patron in _PATRONES.items():
+        if campo in _MULTIPLES:
+            valores = unicos.str.findall(patron).map(lambda v: _SEPARADOR.join(dict.fromkeys(v)) or pd.NA)
+        else:
+            valores = unicos.str.extract(patron, expand=False)
+        valores = normalizar_llave(pd.concat([valores, pd.Series([pd.NA])], ignore_index=True))
+        campos[COLUMNAS_SPEI[campo]] = pd.array(valores.to_numpy()[posiciones], dtype="string")
+
+    # La referencia numérica del banco, si viene en su propia columna, es la referencia
+    if cols["banco.referencia"]:
+        ref = normalizar_llave(banco[cols["banco.referencia"]])
+        numerica = ref.str.fullmatch(r"\d{4,12}").fillna(False).astype(bool)
+        actual = pd.Series(campos[COLUMNAS_SPEI["REFERENCIA"]], index=banco.index)
+        campos[COLUMNAS_SPEI["REFERENCIA"]] = actual.where(actual.notna() | ~numerica, ref).array
+
+    return pd.DataFrame(campos, index=banco.index)
+
+
+def campos_spei(banco: pd.DataFrame) -> pd.DataFrame:
+    """Campos ya extraídos por el pipeline, o se extraen aquí."""
+    if all(c in banco.columns for c in COLUMNAS_SPEI.values()):
+        return banco[list(COLUMNAS_SPEI.values())]
+    return extraer_campos_spei(banco)
+
+
+def quitar_campos_spei(banco: pd.DataFrame) -> pd.DataFrame:
+    return banco.drop(columns=[c for c in COLUMNAS_SPEI.values() if c in banco.columns])
+
+
+def llaves_documento(docs: pd.DataFrame, rol_rfc: str = "doc.rfc_receptor") -> dict:
+    """
+    Llaves del CFDI que se cruzan contra los campos SPEI: {campo: Series normalizada}.
+    rol_rfc: RFC de la contraparte; en ingresos es el receptor (cliente) y en
+    egresos el emisor (proveedor), el del beneficiario en el SPEI enviado.
+    """
+    cols = resolver_columnas(docs)
+    llaves = {}
+    if cols["doc.folio"]:
+        llaves["FOLIO"] = normalizar_llave(docs[cols["doc.folio"]])
+    if cols[rol_rfc]:
+        llaves["RFC"] = normalizar_llave(docs[cols[rol_rfc]])
+    return llaves
+
+
+def coincidencias_llave(pares: pd.DataFrame, llaves_izq: dict, campos_der: pd.DataFrame) -> np.ndarray:
+    """Máscara por par (IZQ, DER): folio o RFC del CFDI igual al campo extraído del movimiento."""
+    coincide = np.zeros(len(pares), dtype=bool)
+    for campo, llave in llaves_izq.items():
+        izq = llave.reindex(pares["IZQ"]).to_numpy()
+        der = campos_der[COLUMNAS_SPEI[campo]].reindex(pares["DER"]).to_numpy()
+        iguales = pd.notna(izq) & pd.notna(der)
+        if campo in _MULTIPLES:
+            iguales[iguales] = [i in d.split(_SEPARADOR) for i, d in zip(izq[iguales], der[iguales])]
+        else:
+            iguales[iguales] = izq[iguales] == der[iguales]
+        coincide |= iguales
+    return coincide
+
+
+def pares_con_llave(pares: pd.DataFrame, llaves_izq: dict, campos_der: pd.DataFrame) -> dict:
+    """
+    Join exacto sobre los pares candidatos (IZQ, DER): folio o RFC del CFDI igual al campo
+    extraído del movimiento. Regresa {etiqueta_izq: set(etiquetas_der)} solo con coincidencias.
+    """
+    if pares.empty or not llaves_izq:
+        return {}
+
+    coincide = coincidencias_llave(pares, llaves_izq, campos_der)
+    if not coincide.any():
+        return {}
+    return pares[coincide].groupby("IZQ", sort=False)["DER"].agg(set).to_dict()
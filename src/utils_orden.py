@@ -1,4 +1,4 @@
-from .preprocessing import pick_column
+from .schema import resolver_columnas
 
 
 def mover_cancelados_al_final(df):
@@ -7,33 +7,25 @@ def mover_cancelados_al_final(df):
     (CANCELADO, CFDI CANCELADO, CANCELADA, etc.) al final del DataFrame.
     """
 
-    col_estado = pick_column(
-        df,
-        [
-            "ESTADO",
-            "ESTADO DE PAGO",
-            "ESTADO_PAGO",
-            "ESTATUS",
-            "ESTATUS CFDI",
-            "ESTADO CFDI",
-            "STATUS",
-            "SITUACION",
-            "SITUACIÓN"
-        ]
-    )
+    cols = resolver_columnas(df)
+    col_estado = cols["doc.estado_cfdi"] or cols["doc.estado_pago"]
 
     if not col_estado:
         return df
 
     df = df.copy()
 
-    df["_ORD_CANCELADO_"] = (
-        df[col_estado]
-        .astype(str)
-        .str.upper()
-        .str.strip()
-        .str.contains("CANCEL", na=False)
-    )
+    # La bandera precalculada solo aplica al estado fiscal (el de pago cambia durante la corrida)
+    if col_estado == cols["doc.estado_cfdi"] and "_ES_CANCELADO_" in df.columns:
+        df["_ORD_CANCELADO_"] = df["_ES_CANCELADO_"]
+    else:
+        df["_ORD_CANCELADO_"] = (
+            df[col_estado]
+            .astype(str)
+            .str.upper()
+            .str.strip()
+            .str.contains("CANCEL", na=False)
+        )
 
     df = (
         df